@@ -0,0 +1,193 @@
+#!/usr/bin/python
+
+"""End-to-end apply latency against a fake docker daemon.
+
+For each backend and group size this starts a fake daemon
+(tests/fake_docker.py), with the configured per-operation latency and
+failure rates, and applies a generated manifest twice: once from scratch
+(cold) and once more with everything already running (warm).  The CLI backend
+drives the daemon through benchmarks/fake_docker_cli.py, so it pays a process
+per operation as it would with the real client.
+
+Every case runs in a fresh process, with the fake daemon in a child process
+of its own, so that max_rss_kb is the peak RSS of the agent alone.  For the CLI
+backend, cli_max_rss_kb is the largest peak RSS among the docker clients it
+ran.
+Each case prints one JSON object per line:
+
+  {"backend": "api", "containers": 100, "ok": true, "cold_seconds": ...,
+   "warm_seconds": ..., "forks": ..., "requests": ..., "max_rss_kb": ...}
+
+Usage:
+  python -m benchmarks.apply_benchmark [--sizes 1,10,100,500]
+      [--backends api,cli] [--latency pull=0.05,create=0.01]
+      [--failure-rate start=0.01] [--output results.jsonl]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from container_agent import docker_backend
+from container_agent import image_cache
+from container_agent import run_containers
+from tests import fake_docker
+
+
+DEFAULT_SIZES = '1,10,50,100,500'
+DEFAULT_BACKENDS = 'api,cli'
+DEFAULT_LATENCY = 'pull=0.05,create=0.005,start=0.01,kill=0.002'
+
+
+def ParseRates(spec):
+    """Parses 'op=value,op=value' into a dict of op -> float."""
+    rates = {}
+    for item in filter(None, spec.split(',')):
+        op, _, value = item.partition('=')
+        rates[op] = float(value)
+    return rates
+
+
+def GenerateManifest(n):
+    return {
+        'version': 'v1beta1',
+        'containers': [{'name': 'ctr%d' % i,
+                        'image': 'bench/image%d:1.0' % (i % 10),
+                        'ports': [{'containerPort': 10000 + i}],
+                        'env': [{'key': 'INDEX', 'value': str(i)}]}
+                       for i in range(n)],
+    }
+
+
+def NewCliShim(tmpdir, socket_path, fork_log, rss_log=''):
+    """Writes an executable that runs fake_docker_cli, and returns its
+    path."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = os.path.join(tmpdir, 'docker')
+    with open(path, 'w') as f:
+        f.write('#!/bin/sh\n'
+                'FAKE_DOCKER_SOCKET=%s FAKE_DOCKER_FORK_LOG=%s '
+                'FAKE_DOCKER_RSS_LOG=%s '
+                'PYTHONPATH=%s exec %s -m benchmarks.fake_docker_cli "$@"\n'
+                % (socket_path, fork_log, rss_log, root, sys.executable))
+    os.chmod(path, 0o755)
+    return path
+
+
+def ServeDaemon(conn, latency, failure_rates):
+    """Runs a fake daemon until told to stop over conn.
+
+    Sends the socket path once the daemon is up, and the number of requests
+    it served once it is told to stop.
+    """
+    server = fake_docker.FakeDockerServer().Start()
+    server.state.latency = latency
+    server.state.failure_rates = failure_rates
+    conn.send(server.socket_path)
+    try:
+        conn.recv()
+        conn.send(len(server.state.requests))
+    finally:
+        server.Stop()
+
+
+def RunCase(backend_kind, n, latency, failure_rates):
+    """Runs one case in this process and returns its result dict."""
+    # Retries should not dominate the timings.
+    run_containers.PULL_RETRY_DELAY = 0.1
+
+    # The daemon runs in a child so that its memory is not counted as ours.
+    conn, child_conn = multiprocessing.Pipe()
+    daemon = multiprocessing.Process(
+        target=ServeDaemon, args=(child_conn, latency, failure_rates))
+    daemon.start()
+    socket_path = conn.recv()
+    tmpdir = tempfile.mkdtemp()
+    fork_log = os.path.join(tmpdir, 'forks')
+    rss_log = os.path.join(tmpdir, 'rss')
+    open(fork_log, 'w').close()
+    open(rss_log, 'w').close()
+    if backend_kind == docker_backend.BACKEND_CLI:
+        backend = docker_backend.CliBackend(
+            NewCliShim(tmpdir, socket_path, fork_log, rss_log))
+    else:
+        backend = docker_backend.ApiBackend(socket_path)
+
+    result = {'backend': backend_kind, 'containers': n, 'ok': True}
+    try:
+        containers = run_containers.LoadConfig(GenerateManifest(n))
+        cache = image_cache.ImageCache(backend)
+        for phase in ('cold', 'warm'):
+            start = time.time()
+            try:
+                run_containers.RunContainers(backend, containers, cache=cache)
+            except SystemExit:
+                result['ok'] = False
+            result['%s_seconds' % phase] = round(time.time() - start, 4)
+        with open(fork_log) as f:
+            result['forks'] = len(f.readlines())
+        result['max_rss_kb'] = resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss
+        # RUSAGE_CHILDREN would carry our own peak over into every client,
+        # so each one reports its own.
+        if backend_kind == docker_backend.BACKEND_CLI:
+            with open(rss_log) as f:
+                result['cli_max_rss_kb'] = max(
+                    [int(line) for line in f] or [0])
+        conn.send(None)
+        result['requests'] = conn.recv()
+    finally:
+        daemon.terminate()
+        daemon.join()
+        shutil.rmtree(tmpdir)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help='comma-separated container counts')
+    parser.add_argument('--backends', default=DEFAULT_BACKENDS,
+                        help='comma-separated backends: api, cli')
+    parser.add_argument('--latency', default=DEFAULT_LATENCY,
+                        help='per-operation seconds, as op=seconds,...')
+    parser.add_argument('--failure-rate', default='',
+                        help='per-operation failure probability, as '
+                        'op=rate,...')
+    parser.add_argument('--output',
+                        help='append results here as well as to stdout')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        backend_kind, n = args.case.split(':')
+        print(json.dumps(RunCase(backend_kind, int(n),
+                                 ParseRates(args.latency),
+                                 ParseRates(args.failure_rate)),
+                         sort_keys=True))
+        return
+
+    for backend_kind in args.backends.split(','):
+        for n in args.sizes.split(','):
+            line = subprocess.check_output(
+                [sys.executable, '-m', 'benchmarks.apply_benchmark',
+                 '--case', '%s:%s' % (backend_kind, n),
+                 '--latency', args.latency,
+                 '--failure-rate', args.failure_rate]).decode('utf-8')
+            line = line.strip().splitlines()[-1]
+            print(line)
+            sys.stdout.flush()
+            if args.output:
+                with open(args.output, 'a') as f:
+                    f.write(line + '\n')
+
+
+if __name__ == '__main__':
+    main()
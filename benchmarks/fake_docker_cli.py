@@ -0,0 +1,127 @@
+#!/usr/bin/python
+
+"""A stand-in for the docker command line client.
+
+It understands the subcommands the CliBackend uses, and carries each out
+against a fake daemon (tests/fake_docker.py) through its Remote API, so a
+CliBackend pointed at this costs one process per operation, as it would with
+the real client.
+
+Environment:
+  FAKE_DOCKER_SOCKET: the fake daemon's socket
+  FAKE_DOCKER_FORK_LOG: if set, a file to append a line to per invocation
+  FAKE_DOCKER_RSS_LOG: if set, a file to append each invocation's peak RSS in
+      kilobytes to
+"""
+
+import json
+import os
+import resource
+import sys
+
+from container_agent import docker_backend
+from container_agent import run_containers
+
+
+def ParseRunArgs(args):
+    """The inverse of docker_backend.RunArgs()."""
+    ctr = run_containers.Container('', '')
+    i = 0
+    while args[i].startswith('-'):
+        flag, value = args[i], args[i + 1]
+        i += 2
+        if flag == '--name':
+            ctr.name = value
+        elif flag == '--hostname':
+            ctr.hostname = value
+        elif flag == '--workdir':
+            ctr.working_dir = value
+        elif flag == '--net':
+            ctr.network_from = value
+        elif flag == '--cpu-shares':
+            ctr.cpu_shares = int(value)
+        elif flag == '--cpuset-cpus':
+            ctr.cpuset = value
+        elif flag == '--memory':
+            ctr.memory = int(value)
+        elif flag == '-p':
+            ports, _, proto = value.partition('/')
+            host_port, ctr_port = ports.split(':')
+            ctr.ports.append((int(host_port), int(ctr_port),
+                              '/' + proto if proto else ''))
+        elif flag == '-v':
+            ctr.mounts.append(value)
+        elif flag == '-e':
+            ctr.env_vars.append(value)
+        elif flag == '--label':
+            key, _, label = value.partition('=')
+            ctr.labels[key] = label
+    ctr.image = args[i]
+    ctr.command = args[i + 1:]
+    return ctr
+
+
+def PeakRssKb():
+    """Returns the peak RSS of this process, in kilobytes.
+
+    ru_maxrss is kept across fork and exec on Linux, so there it would be the
+    peak of whoever started us; VmHWM belongs to this image alone.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def Main(argv):
+    if os.environ.get('FAKE_DOCKER_FORK_LOG'):
+        with open(os.environ['FAKE_DOCKER_FORK_LOG'], 'a') as f:
+            f.write(' '.join(argv[:2]) + '\n')
+    backend = docker_backend.ApiBackend(os.environ['FAKE_DOCKER_SOCKET'])
+    command, args = argv[0], argv[1:]
+    try:
+        if command == 'pull':
+            backend.Pull(args[0])
+        elif command == 'import':
+            stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+            backend.ImportImage(args[-1], stdin.read())
+        elif command == 'kill':
+            backend.Kill(args[0])
+        elif command == 'rm':
+            backend.Remove(args[-1])
+        elif command == 'run':
+            print(backend.Run(ParseRunArgs(args[1:])))
+        elif command == 'inspect' and args[0] == '--format':
+            image_id = backend.ImageId(args[2])
+            if image_id is None:
+                return 1
+            print(image_id)
+        elif command == 'inspect':
+            info = backend.Inspect(args[0])
+            if info is None:
+                sys.stderr.write('Error: No such object: %s\n' % (args[0]))
+                return 1
+            print(json.dumps([info]))
+        elif command == 'restart':
+            backend.Restart(args[0])
+        elif command == 'wait':
+            print(backend.Wait(args[0]))
+        else:
+            sys.stderr.write('fake docker: unsupported: %s\n' % (command))
+            return 2
+    except docker_backend.DockerError as e:
+        sys.stderr.write('%s\n' % (e))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    status = Main(sys.argv[1:])
+    if os.environ.get('FAKE_DOCKER_RSS_LOG'):
+        with open(os.environ['FAKE_DOCKER_RSS_LOG'], 'a') as f:
+            f.write('%d\n' % (PeakRssKb()))
+    sys.exit(status)
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+
+"""How manifest validation time grows with the size of the manifest.
+
+Generates manifests with N containers, each with its own port, volume mount
+and a few env vars, plus N volumes, and times run_containers.ValidateConfig
+on them.  Time per entry should stay flat as N grows.
+
+Usage: python -m benchmarks.validate_benchmark [--sizes 100,1000,10000]
+"""
+
+import argparse
+import time
+
+from container_agent import run_containers
+
+
+def GenerateConfig(n, env_per_container=4):
+    return {
+        'version': 'v1beta1',
+        'volumes': [{'name': 'vol%d' % i} for i in range(n)],
+        'containers': [{
+            'name': 'ctr%d' % i,
+            'image': 'foo/bar:1.0',
+            'ports': [{'name': 'port%d' % i,
+                       'containerPort': 1 + i % 65535,
+                       'hostPort': 1 + i % 65535}],
+            'volumeMounts': [{'name': 'vol%d' % i, 'path': '/mnt/data'}],
+            'env': [{'key': 'KEY_%d' % j, 'value': 'value'}
+                    for j in range(env_per_container)],
+        } for i in range(n)],
+    }
+
+
+def Time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='100,1000,5000,20000',
+                        help='comma-separated container counts')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per size; the best is reported')
+    args = parser.parse_args()
+
+    print('%10s %10s %12s %14s' % ('containers', 'entries', 'seconds',
+                                   'usec/entry'))
+    for n in [int(size) for size in args.sizes.split(',')]:
+        config = GenerateConfig(n)
+        entries = sum(2 + len(ctr['ports']) + len(ctr['volumeMounts']) +
+                      len(ctr['env']) for ctr in config['containers'])
+        result = run_containers.ValidateConfig(config)
+        # Host ports wrap around past 65535 containers.
+        if not result.IsValid() and n <= 65535:
+            raise SystemExit('unexpected errors: %s' % (result.errors[:3]))
+        seconds = Time(lambda: run_containers.ValidateConfig(config),
+                       args.repeat)
+        print('%10d %10d %12.4f %14.2f' % (n, entries, seconds,
+                                           seconds * 1e6 / entries))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The agent's logging, shared by all of its modules.
+
+Everything is logged to syslog's LOCAL3 facility, over a single datagram
+socket to /dev/log.  Logging never blocks the agent: lines wait in a bounded
+ring buffer for a writer thread, which sends whatever has piled up in one
+go.  When syslog cannot keep up, the oldest waiting lines are dropped, and
+counted (see metrics.LOG_LINES_DROPPED); the writer says how many once it
+catches up.
+"""
+
+import atexit
+import collections
+import os
+import socket
+import sys
+import syslog
+import threading
+import time
+
+from container_agent import metrics
+
+
+SYSLOG_SOCKET = '/dev/log'
+
+# How many lines may wait for the writer before the oldest are dropped.
+RING_SIZE = 1024
+
+# How long, in seconds, syslog may take to accept a line.
+SEND_TIMEOUT = 1.0
+
+# How long, in seconds, Flush() waits at most.
+FLUSH_TIMEOUT = 2.0
+
+
+class SyslogWriter(object):
+
+    """Sends log lines to syslog from a thread of its own.
+
+    Args:
+      ident: the tag for every line; by default the program name
+      path: the syslog socket
+      ring_size: how many lines may wait to be sent
+    """
+
+    def __init__(self, ident=None, path=SYSLOG_SOCKET, ring_size=RING_SIZE):
+        self.ident = ident or os.path.basename(sys.argv[0] or 'python')
+        self.path = path
+        self.ring = collections.deque()
+        self.ring_size = ring_size
+        self.dropped = 0        # lines dropped and not yet reported
+        self.dropped_total = 0
+        self.sending = 0        # lines taken from the ring, not yet sent
+        self.sock = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+
+    def _Format(self, priority, msg):
+        return ('<%d>%s %s[%d]: %s'
+                % (priority, time.strftime('%b %d %H:%M:%S'), self.ident,
+                   os.getpid(), msg)).encode('utf-8', 'replace')
+
+    def Log(self, priority, msg):
+        """Queues a line for syslog; never blocks on syslog itself."""
+        line = self._Format(priority, msg)
+        with self.lock:
+            if len(self.ring) >= self.ring_size:
+                self.ring.popleft()
+                self._Drop(1)
+            self.ring.append(line)
+            self._EnsureThread()
+            self.changed.notify_all()
+
+    def _Drop(self, n):
+        """Counts lost lines; called with the lock held."""
+        self.dropped += n
+        self.dropped_total += n
+        metrics.LOG_LINES_DROPPED.Inc(amount=n)
+
+    def _EnsureThread(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._Run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _Run(self):
+        while True:
+            with self.lock:
+                while not self.ring:
+                    self.changed.wait()
+                batch = list(self.ring)
+                self.ring.clear()
+                if self.dropped:
+                    batch.insert(0, self._Format(
+                        syslog.LOG_LOCAL3 | syslog.LOG_ERR,
+                        'dropped %d log line%s: syslog was too slow'
+                        % (self.dropped, 's' if self.dropped > 1 else '')))
+                    self.dropped = 0
+                self.sending = len(batch)
+            for line in batch:
+                sent = self._Send(line)
+                with self.lock:
+                    self.sending -= 1
+                    if not sent:
+                        self._Drop(1)
+                    self.changed.notify_all()
+
+    def _Send(self, line):
+        try:
+            if self.sock is None:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                sock.settimeout(SEND_TIMEOUT)
+                try:
+                    sock.connect(self.path)
+                except socket.error:
+                    sock.close()
+                    raise
+                self.sock = sock
+            self.sock.send(line)
+            return True
+        except socket.error:
+            # Syslog may have restarted; try a fresh socket next time.
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+            return False
+
+    def Flush(self, timeout=FLUSH_TIMEOUT):
+        """Waits, for at most timeout seconds, until every queued line has
+        been sent (or dropped)."""
+        deadline = time.time() + timeout
+        with self.lock:
+            while self.ring or self.sending:
+                remaining = deadline - time.time()
+                if remaining <= 0 or self.thread is None:
+                    return
+                self.changed.wait(remaining)
+
+
+WRITER = SyslogWriter()
+atexit.register(WRITER.Flush)
+
+
+def Open(ident):
+    """Sets the tag of the agent's log lines."""
+    WRITER.ident = ident
+
+
+def Flush():
+    WRITER.Flush()
+
+
+def LogInfo(msg):
+    WRITER.Log(syslog.LOG_LOCAL3 | syslog.LOG_INFO, msg)
+
+
+def LogError(msg):
+    WRITER.Log(syslog.LOG_LOCAL3 | syslog.LOG_ERR, msg)
@@ -0,0 +1,79 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Remember the agent's containers across restarts of the agent.
+
+The supervisor keeps a record of every container it watches in the state
+file: the container's ID, its fingerprint (see reconcile.py) and its restart
+history.  When the agent starts again, a container whose record still
+matches its manifest entry, and which is still running with that
+fingerprint, is adopted: it is supervised again, with its restart history,
+and neither pulled nor recreated.  That costs one inspect per container.
+
+A state file that cannot be read is treated as empty: everything is then
+checked against docker as if the agent had never run.
+"""
+
+import json
+import os
+
+from container_agent.agent_log import LogError
+
+
+DEFAULT_STATE_PATH = '/var/lib/container-agent/state.json'
+
+# Bumped whenever the format changes; records in another format are ignored.
+STATE_FORMAT = 1
+
+
+class StateFile(object):
+
+    """Stores the records of the supervised containers, as JSON.
+
+    A record is a dict with the container's 'id', its 'fingerprint' and its
+    'restart' state (see restart_policy.RestartState.ToDict()).
+    """
+
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        self.path = path
+
+    def Load(self):
+        """Returns a dict of container name -> record."""
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except (IOError, OSError):
+            return {}
+        except ValueError as e:
+            LogError('ignoring corrupt state file %s: %s' % (self.path, e))
+            return {}
+        if not isinstance(state, dict) or \
+                state.get('format') != STATE_FORMAT:
+            LogError('ignoring state file %s: unknown format' % (self.path))
+            return {}
+        return state.get('containers', {})
+
+    def Save(self, records):
+        """Replaces the stored records with a dict of name -> record."""
+        tmp_path = self.path + '.tmp'
+        directory = os.path.dirname(self.path)
+        try:
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(tmp_path, 'w') as f:
+                json.dump({'format': STATE_FORMAT, 'containers': records}, f,
+                          indent=2, sort_keys=True)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            LogError('could not write state file %s: %s' % (self.path, e))
@@ -0,0 +1,552 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Start containers from an asyncio event loop (--engine asyncio).
+
+The default engine, run_containers.RunContainers, blocks a thread on every
+docker operation and gets its concurrency from pools of threads.  This one
+does the same work, with the same pull policies, fingerprints and startup
+order, as coroutines on one event loop in one thread:
+
+  AsyncCliBackend: runs the docker CLI as asyncio subprocesses.
+  AsyncApiBackend: speaks the Remote API over asyncio unix socket streams,
+      reusing a small pool of connections.
+
+Every docker operation has a timeout (see DEFAULT_TIMEOUTS); one that runs
+over is cancelled, and a CLI process is killed.  The first container that
+cannot be started cancels everything still in progress.
+
+This needs Python 3; run_containers imports it only when it is asked for.
+"""
+
+import asyncio
+import json
+import os
+import time
+from urllib.parse import quote, urlencode
+
+from container_agent import docker_backend
+from container_agent import image_cache
+from container_agent import metrics
+from container_agent import pause_image
+from container_agent import reconcile
+from container_agent import run_containers
+from container_agent import scheduler
+from container_agent import tracing
+from container_agent.agent_log import LogInfo
+
+
+# Seconds each kind of docker operation may take before it is cancelled.
+DEFAULT_TIMEOUTS = {
+    'pull': 600,
+    'import': 60,
+    'inspect': 30,
+    'kill': 30,
+    'rm': 30,
+    'run': 60,
+}
+
+
+def Timeouts(overrides=None):
+    timeouts = dict(DEFAULT_TIMEOUTS)
+    timeouts.update(overrides or {})
+    return timeouts
+
+
+class AsyncCliBackend(object):
+
+    """Drives docker by running its command line client as subprocesses."""
+
+    def __init__(self, docker_cmd=docker_backend.DOCKER_CMD, timeouts=None):
+        self.docker_cmd = docker_cmd
+        self.timeouts = Timeouts(timeouts)
+
+    async def _Run(self, op, args, stdin_data=None):
+        """Runs docker with args; returns (exit status, output)."""
+        with tracing.Span('docker', command=args[0]) as span:
+            proc = await asyncio.create_subprocess_exec(
+                self.docker_cmd, *args,
+                stdin=(asyncio.subprocess.PIPE if stdin_data is not None
+                       else None),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT)
+            try:
+                o, _ = await asyncio.wait_for(proc.communicate(stdin_data),
+                                              self.timeouts[op])
+            except asyncio.TimeoutError:
+                raise docker_backend.DockerError(
+                    'docker %s timed out after %ss'
+                    % (args[0], self.timeouts[op]))
+            finally:
+                # Whether it timed out or was cancelled, leave nothing
+                # running behind.
+                if proc.returncode is None:
+                    proc.kill()
+                    await proc.wait()
+            span.Set('exit_code', proc.returncode)
+        return proc.returncode, o.decode('utf-8', 'replace')
+
+    async def Close(self):
+        pass
+
+    async def Pull(self, image):
+        status, o = await self._Run('pull', ['pull', image])
+        if status != 0:
+            raise docker_backend.DockerError(o)
+
+    async def ImportImage(self, image, tarball):
+        status, o = await self._Run('import', ['import', '-', image],
+                                    tarball)
+        if status != 0:
+            raise docker_backend.DockerError(o)
+
+    async def Kill(self, name):
+        await self._Run('kill', ['kill', name])
+
+    async def Remove(self, name):
+        await self._Run('rm', ['rm', '-f', name])
+
+    async def Run(self, ctr):
+        status, o = await self._Run(
+            'run', ['run', '-d'] + docker_backend.RunArgs(ctr))
+        if status != 0:
+            raise docker_backend.DockerError(o)
+        return o.strip()
+
+    async def Inspect(self, name):
+        status, o = await self._Run('inspect', ['inspect', name])
+        if status != 0:
+            if docker_backend.RE_NO_SUCH.search(o):
+                return None
+            raise docker_backend.DockerError(o)
+        return json.loads(o)[0]
+
+    async def ImageId(self, image):
+        status, o = await self._Run(
+            'inspect', ['inspect', '--format', '{{.Id}}', image])
+        if status != 0:
+            return None
+        return o.strip()
+
+
+class _Connection(object):
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def Close(self):
+        self.writer.close()
+
+
+async def ReadResponse(reader, method='GET'):
+    """Reads one HTTP/1.1 response; returns (status, body, keep_alive)."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        key, _, value = line.partition(':')
+        headers[key.strip().lower()] = value.strip()
+
+    keep_alive = headers.get('connection', '').lower() != 'close'
+    # These never have a body, whatever the headers say; docker sends a
+    # bare 204 for kill, rm and start.
+    if method == 'HEAD' or status // 100 == 1 or status in (204, 304):
+        return status, b'', keep_alive
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if not size:
+                await reader.readline()
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        return status, b''.join(chunks), keep_alive
+    if 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+        return status, body, keep_alive
+    return status, await reader.read(), False
+
+
+class AsyncApiBackend(object):
+
+    """Drives docker through the Remote API on its unix socket."""
+
+    def __init__(self, socket_path=docker_backend.DOCKER_SOCKET,
+                 timeouts=None, pool_size=docker_backend.DEFAULT_POOL_SIZE):
+        self.socket_path = socket_path
+        self.timeouts = Timeouts(timeouts)
+        self.pool_size = pool_size
+        self.idle = []
+
+    async def _Exchange(self, method, path, body, headers):
+        while True:
+            reused = bool(self.idle)
+            if reused:
+                conn = self.idle.pop()
+            else:
+                conn = _Connection(
+                    *await asyncio.open_unix_connection(self.socket_path))
+            try:
+                head = ['%s %s HTTP/1.1' % (method, path), 'Host: docker']
+                head.extend('%s: %s' % item
+                            for item in sorted(headers.items()))
+                conn.writer.write(('\r\n'.join(head) + '\r\n\r\n')
+                                  .encode('latin-1') + body)
+                await conn.writer.drain()
+                status, data, keep_alive = await ReadResponse(
+                    conn.reader, method)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                conn.Close()
+                # The daemon may have closed an idle keep-alive connection;
+                # that is worth one more try on a fresh one.
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                conn.Close()
+                raise
+            if keep_alive and len(self.idle) < self.pool_size:
+                self.idle.append(conn)
+            else:
+                conn.Close()
+            return status, data
+
+    async def _Request(self, op, method, path, query=None, body=None,
+                       content_type=None):
+        """Makes one API call and returns (status, body bytes).
+
+        The body is sent as JSON, unless a content_type says what its bytes
+        are.
+        """
+        if query:
+            path += '?' + urlencode(sorted(query.items()))
+        headers = {'Content-Length': '0'}
+        data = b''
+        if content_type is not None:
+            data = body
+            headers['Content-Type'] = content_type
+            headers['Content-Length'] = str(len(data))
+        elif body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+            headers['Content-Length'] = str(len(data))
+
+        with tracing.Span('docker_api', method=method, path=path) as span:
+            try:
+                status, data = await asyncio.wait_for(
+                    self._Exchange(method, path, data, headers),
+                    self.timeouts[op])
+            except asyncio.TimeoutError:
+                raise docker_backend.DockerError(
+                    '%s %s timed out after %ss'
+                    % (method, path, self.timeouts[op]))
+            except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+                raise docker_backend.DockerError('%s %s: %s'
+                                                 % (method, path, e))
+            span.Set('status', status)
+        return status, data
+
+    async def _Json(self, op, method, path, query=None, body=None,
+                    ok=(200,)):
+        status, data = await self._Request(op, method, path, query, body)
+        if status not in ok:
+            raise docker_backend.DockerError(
+                '%s %s: HTTP %d: %s'
+                % (method, path, status,
+                   data.decode('utf-8', 'replace').strip()))
+        if not data:
+            return None
+        return json.loads(data.decode('utf-8'))
+
+    async def Close(self):
+        idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.Close()
+
+    async def Pull(self, image):
+        repo, tag = docker_backend.SplitImage(image)
+        status, data = await self._Request(
+            'pull', 'POST', '/images/create', {'fromImage': repo, 'tag': tag})
+        text = data.decode('utf-8', 'replace')
+        if status != 200:
+            raise docker_backend.DockerError(text)
+        docker_backend.CheckProgress(text)
+
+    async def ImportImage(self, image, tarball):
+        repo, tag = docker_backend.SplitImage(image)
+        status, data = await self._Request(
+            'import', 'POST', '/images/create',
+            {'fromSrc': '-', 'repo': repo, 'tag': tag}, tarball,
+            'application/x-tar')
+        text = data.decode('utf-8', 'replace')
+        if status != 200:
+            raise docker_backend.DockerError(text)
+        docker_backend.CheckProgress(text)
+
+    async def Kill(self, name):
+        await self._Request('kill', 'POST',
+                            '/containers/%s/kill' % quote(name))
+
+    async def Remove(self, name):
+        await self._Request('rm', 'DELETE', '/containers/%s' % quote(name),
+                            {'force': '1'})
+
+    async def Run(self, ctr):
+        created = await self._Json('run', 'POST', '/containers/create',
+                                   {'name': ctr.name},
+                                   docker_backend.CreateConfig(ctr),
+                                   ok=(201,))
+        ctr_id = created['Id']
+        await self._Json('run', 'POST', '/containers/%s/start' % ctr_id,
+                         ok=(204, 304))
+        return ctr_id
+
+    async def Inspect(self, name):
+        status, data = await self._Request(
+            'inspect', 'GET', '/containers/%s/json' % quote(name))
+        if status != 200:
+            return None
+        return json.loads(data.decode('utf-8'))
+
+    async def ImageId(self, image):
+        status, data = await self._Request(
+            'inspect', 'GET', '/images/%s/json' % quote(image))
+        if status != 200:
+            return None
+        return json.loads(data.decode('utf-8'))['Id']
+
+
+def NewBackend(kind=docker_backend.BACKEND_AUTO,
+               docker_cmd=docker_backend.DOCKER_CMD,
+               socket_path=docker_backend.DOCKER_SOCKET, timeouts=None):
+    """Returns an async backend of the requested kind; see
+    docker_backend.NewBackend."""
+    if kind == docker_backend.BACKEND_AUTO:
+        kind = (docker_backend.BACKEND_API if os.path.exists(socket_path)
+                else docker_backend.BACKEND_CLI)
+    if kind == docker_backend.BACKEND_API:
+        return AsyncApiBackend(socket_path, timeouts)
+    if kind == docker_backend.BACKEND_CLI:
+        return AsyncCliBackend(docker_cmd, timeouts)
+    raise ValueError('unknown docker backend: %s' % kind)
+
+
+class _Run(object):
+
+    """One call of Engine.RunContainers."""
+
+    def __init__(self, backend, containers, pull_concurrency, cache,
+                 start_concurrency, pulled):
+        self.backend = backend
+        self.containers = containers
+        self.cache = cache
+        self.policies = run_containers.PullPolicies(containers)
+        self.pull_slots = asyncio.Semaphore(pull_concurrency)
+        self.start_slots = asyncio.Semaphore(start_concurrency)
+        self.pulls = {}         # image -> pull task
+        self.prefetched = set(pulled or ())
+        self.starts = {}        # container name -> start task
+        self.recreated = set()
+
+    async def ImageId(self, image):
+        fresh, image_id = self.cache.Lookup(image)
+        if not fresh:
+            image_id = await self.backend.ImageId(image)
+            self.cache.Remember(image, image_id)
+        return image_id
+
+    async def NeedsPull(self, image):
+        if image in self.prefetched:
+            return False
+        policy = self.policies[image]
+        if policy == image_cache.PULL_ALWAYS:
+            return True
+        if policy == image_cache.PULL_IF_NOT_PRESENT:
+            return await self.ImageId(image) is None
+        return False
+
+    async def _PullImage(self, image):
+        """Pulls an image, retrying as run_containers.PullImage does."""
+        start = time.time()
+        async with self.pull_slots:
+            with tracing.Span('pull', image=image) as span:
+                for attempt in range(1, run_containers.PULL_ATTEMPTS + 1):
+                    span.Set('attempts', attempt)
+                    try:
+                        with tracing.Span('pull_attempt', image=image,
+                                          attempt=attempt):
+                            await self.backend.Pull(image)
+                        break
+                    except docker_backend.DockerError as e:
+                        LogInfo(str(e))
+                        pulls_left = run_containers.PULL_ATTEMPTS - attempt
+                        if pulls_left == 0:
+                            raise docker_backend.DockerError(
+                                'failed to pull %s' % (image))
+                        LogInfo('could not pull %s, will retry %d more '
+                                'time%s' % (image, pulls_left,
+                                            's' if pulls_left > 1 else ''))
+                        with tracing.Span('pull_retry_delay', image=image,
+                                          attempt=attempt):
+                            await asyncio.sleep(
+                                run_containers.PULL_RETRY_DELAY)
+        self.cache.Invalidate(image)
+        seconds = time.time() - start
+        metrics.DOCKER_SECONDS.Observe(seconds, 'pull', image)
+        LogInfo('pulled %s in %.1fs' % (image, seconds))
+        return seconds
+
+    def Pull(self, image):
+        """Returns the task pulling an image, starting it if need be."""
+        if image not in self.pulls:
+            self.pulls[image] = asyncio.ensure_future(self._PullImage(image))
+        return self.pulls[image]
+
+    async def _Timed(self, op, image, call):
+        with metrics.DOCKER_SECONDS.Time(op, image):
+            return await call
+
+    async def _Start(self, ctr):
+        # Wait for everything this container needs.
+        for name in run_containers.StartupDependencies(ctr):
+            if name in self.starts:
+                await self.starts[name]
+
+        async with self.start_slots:
+            with tracing.Span('start_container', container=ctr.name,
+                              image=ctr.image) as span:
+                LogInfo("starting container '%s'" % (ctr.name))
+                if (ctr.image in self.pulls or
+                        await self.NeedsPull(ctr.image)):
+                    await self.Pull(ctr.image)
+                image_id = await self.ImageId(ctr.image)
+                if image_id is None and \
+                        ctr.image_pull_policy == image_cache.PULL_NEVER:
+                    raise docker_backend.DockerError(
+                        "image %s for container '%s' is not present, and "
+                        'its imagePullPolicy is Never' % (ctr.image,
+                                                          ctr.name))
+
+                fingerprint = reconcile.Fingerprint(ctr, image_id)
+                ctr.labels[reconcile.FINGERPRINT_LABEL] = fingerprint
+                info = await self.backend.Inspect(ctr.name)
+                if (run_containers.NetworkOwner(ctr) not in self.recreated
+                        and reconcile.IsUpToDate(info, fingerprint)):
+                    LogInfo("container '%s' is up to date, leaving it alone"
+                            % (ctr.name))
+                    span.Set('up_to_date', True)
+                    return info['Id']
+                self.recreated.add(ctr.name)
+
+                await self._Timed('kill', ctr.image,
+                                  self.backend.Kill(ctr.name))
+                await self._Timed('rm', ctr.image,
+                                  self.backend.Remove(ctr.name))
+                try:
+                    return await self._Timed('run', ctr.image,
+                                             self.backend.Run(ctr))
+                except docker_backend.DockerError as e:
+                    LogInfo(str(e))
+                    raise docker_backend.DockerError(
+                        "failed to run container '%s'" % (ctr.name))
+
+    async def ImportInfraImage(self):
+        """As run_containers.ImportInfraImage."""
+        if (not any(ctr.image == pause_image.IMAGE
+                    for ctr in self.containers) or
+                await self.ImageId(pause_image.IMAGE) is not None):
+            return
+        LogInfo('importing the infrastructure image %s' % (pause_image.IMAGE))
+        await self.backend.ImportImage(pause_image.IMAGE,
+                                       pause_image.Tarball())
+        self.cache.Invalidate(pause_image.IMAGE)
+
+    async def _Gather(self, tasks):
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # The first failure abandons everything else.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def Run(self):
+        await self.ImportInfraImage()
+
+        # As in run_containers.RunContainers, images that do not come from a
+        # registry inside the group are pulled up front, and nothing is
+        # started (or torn down) until they all are.
+        for ctr in self.containers:
+            if (not run_containers.IsLocalRegistryImage(ctr.image) and
+                    await self.NeedsPull(ctr.image)):
+                self.Pull(ctr.image)
+        await self._Gather(list(self.pulls.values()))
+
+        for ctr in self.containers:
+            self.starts[ctr.name] = asyncio.ensure_future(self._Start(ctr))
+        await self._Gather(list(self.pulls.values()) +
+                           list(self.starts.values()))
+        return dict((ctr.name, self.starts[ctr.name].result())
+                    for ctr in self.containers)
+
+
+class Engine(object):
+
+    """Runs containers from an event loop of its own.
+
+    Args:
+      backend: an AsyncCliBackend or AsyncApiBackend
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.loop = asyncio.new_event_loop()
+
+    def RunContainers(self, containers, pull_concurrency=None, cache=None,
+                      start_concurrency=None, pulled=None):
+        """Does what run_containers.RunContainers does, on the event loop.
+
+        Returns a dict of container name -> container ID.  Exits, as Fatal()
+        does, if a container cannot be started.
+        """
+        pull_concurrency = (pull_concurrency or
+                            run_containers.DEFAULT_PULL_CONCURRENCY)
+        start_concurrency = (start_concurrency or
+                             run_containers.DEFAULT_START_CONCURRENCY)
+        if cache is None:
+            # Only its bookkeeping is used; lookups go through the backend.
+            cache = image_cache.ImageCache(None)
+        cycle = scheduler.FindCycle(dict(
+            (ctr.name, run_containers.StartupDependencies(ctr))
+            for ctr in containers))
+        if cycle is not None:
+            raise ValueError('dependency cycle: %s' % (' -> '.join(cycle)))
+        run = _Run(self.backend, containers, pull_concurrency, cache,
+                   start_concurrency, pulled)
+        try:
+            return self.loop.run_until_complete(run.Run())
+        except docker_backend.DockerError as e:
+            run_containers.Fatal(str(e))
+
+    def Close(self):
+        self.loop.run_until_complete(self.backend.Close())
+        self.loop.close()
@@ -0,0 +1,268 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Keep applying a manifest as it changes.
+
+In daemon mode the agent watches its manifest, and also reloads it on SIGHUP.
+A manifest file is watched with inotify where the kernel offers it and by
+polling otherwise; see metadata.py for the other source of manifests.
+Each new version is loaded and validated before anything is touched; a
+manifest that fails validation is rejected and the running group is left as
+it is.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+
+from container_agent import tracing
+from container_agent.agent_log import LogError
+from container_agent.agent_log import LogInfo
+
+
+# Seconds between checks of the manifest when inotify is not available.
+POLL_INTERVAL = 5
+
+# From <sys/inotify.h>.
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher(object):
+
+    """Notices changes to a file through inotify on its directory.
+
+    Watching the directory, rather than the file, catches editors and tools
+    that replace the file by renaming a new one over it.
+    """
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.name = os.path.basename(path).encode('utf-8')
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        directory = os.path.dirname(os.path.abspath(path)).encode('utf-8')
+        mask = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE |
+                IN_DELETE)
+        if libc.inotify_add_watch(self.fd, directory, mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, 'inotify_add_watch failed')
+
+    def fileno(self):
+        return self.fd
+
+    def Timeout(self):
+        return None
+
+    def Changed(self):
+        """Drains pending events and says whether any were about the
+        file."""
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    return changed
+                raise
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if name == self.name:
+                    changed = True
+
+    def Close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+
+    """Notices changes to a file by checking its metadata periodically."""
+
+    def __init__(self, path, interval=POLL_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.signature = self._Signature()
+
+    def _Signature(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime)
+
+    def fileno(self):
+        return None
+
+    def Timeout(self):
+        return self.interval
+
+    def Changed(self):
+        signature = self._Signature()
+        if signature == self.signature:
+            return False
+        self.signature = signature
+        return True
+
+    def Close(self):
+        pass
+
+
+def NewWatcher(path, poll_interval=POLL_INTERVAL):
+    """Returns an InotifyWatcher for path if possible, else a
+    PollingWatcher."""
+    try:
+        return InotifyWatcher(path)
+    except (OSError, AttributeError, TypeError) as e:
+        LogInfo('inotify is not available (%s), polling %s every %ss'
+                % (e, path, poll_interval))
+        return PollingWatcher(path, poll_interval)
+
+
+class ManifestFile(object):
+
+    """A manifest source backed by a file on disk."""
+
+    def __init__(self, path, watcher=None):
+        self.path = path
+        self.watcher = watcher or NewWatcher(path)
+
+    def __str__(self):
+        return self.path
+
+    def Read(self):
+        """Returns the current manifest text, or None if there is none."""
+        try:
+            with open(self.path, 'r') as fp:
+                return fp.read()
+        except IOError as e:
+            LogError('could not read manifest %s: %s' % (self.path, e))
+            return None
+
+    def fileno(self):
+        return self.watcher.fileno()
+
+    def Timeout(self):
+        return self.watcher.Timeout()
+
+    def Changed(self):
+        return self.watcher.Changed()
+
+    def Close(self):
+        self.watcher.Close()
+
+
+class Daemon(object):
+
+    """Re-applies a manifest whenever it changes or on SIGHUP.
+
+    Args:
+      source: where the manifest comes from; a ManifestFile, or anything
+          with the same interface
+      load: a callable taking the manifest text and returning the loaded
+          group; it reports invalid manifests by raising SystemExit, as
+          Fatal() does
+      apply: a callable taking a loaded group and applying it
+    """
+
+    def __init__(self, source, load, apply):
+        self.source = source
+        self.load = load
+        self.apply = apply
+        self.applied_text = None
+        self.stopped = threading.Event()
+        self.wake_r, self.wake_w = os.pipe()
+
+    def Wake(self):
+        """Asks for a reload; safe to call from a signal handler."""
+        os.write(self.wake_w, b'x')
+
+    def Stop(self):
+        self.stopped.set()
+        self.Wake()
+
+    def _Reject(self, text):
+        LogError('rejected new manifest from %s: the running group is '
+                 'unchanged' % (self.source))
+        # Do not retry the same broken text until it changes again.
+        self.applied_text = text
+        return False
+
+    def Reload(self, force=False):
+        """Loads and applies the manifest, if it changed or if forced.
+
+        Returns True if the manifest was applied.
+        """
+        text = self.source.Read()
+        if text is None:
+            return False
+        if text == self.applied_text and not force:
+            return False
+
+        # Loading and applying it is one trace.
+        with tracing.Span('reload', source=str(self.source)):
+            LogInfo('loading new manifest from %s' % (self.source))
+            try:
+                group = self.load(text)
+            except SystemExit:
+                return self._Reject(text)
+            except Exception as e:
+                # Validation should have caught it, but no manifest may
+                # take the agent down.
+                LogError('invalid manifest: %r' % (e))
+                return self._Reject(text)
+            self.applied_text = text
+            self.apply(group)
+            return True
+
+    def Run(self):
+        """Applies the manifest, then every change to it, until Stop().
+
+        A Wake() forces a reload even if the manifest has not changed.
+        """
+        self.Reload()
+        fds = [self.wake_r]
+        if self.source.fileno() is not None:
+            fds.append(self.source.fileno())
+        while not self.stopped.is_set():
+            try:
+                ready, _, _ = select.select(fds, [], [],
+                                            self.source.Timeout())
+            except (OSError, select.error) as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            force = False
+            if self.wake_r in ready:
+                os.read(self.wake_r, 4096)
+                force = True
+            changed = self.source.Changed()
+            if (force or changed) and not self.stopped.is_set():
+                self.Reload(force)
+        self.source.Close()
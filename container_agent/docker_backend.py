@@ -0,0 +1,760 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Ways of driving the Docker daemon.
+
+Two backends implement the same small interface (Pull, Kill, Remove, Run,
+Inspect, ImageId, Restart, Wait, Events, Logs, ListContainers, ListImages,
+RemoveImage, ImportImage):
+
+  CliBackend: forks the docker CLI for every operation.  This works with any
+      docker that has the flags we need, but every call costs a process.
+  ApiBackend: speaks the Docker Remote API over the daemon's unix socket,
+      reusing a small pool of persistent HTTP connections.
+
+Both take the accumulated container parameters (see run_containers.Container)
+and raise DockerError when an operation that must succeed does not.
+"""
+
+import calendar
+import json
+import os
+import re
+import select
+import socket
+import struct
+import subprocess
+import threading
+import time
+
+from container_agent import tracing
+
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib
+
+try:
+    from urllib.parse import quote, urlencode
+except ImportError:
+    from urllib import quote, urlencode
+
+
+DOCKER_CMD = 'docker'
+DOCKER_SOCKET = '/var/run/docker.sock'
+
+BACKEND_CLI = 'cli'
+BACKEND_API = 'api'
+BACKEND_AUTO = 'auto'
+VALID_BACKENDS = [BACKEND_AUTO, BACKEND_API, BACKEND_CLI]
+
+DEFAULT_POOL_SIZE = 4
+
+# What the docker CLI says about a container or image that does not exist.
+RE_NO_SUCH = re.compile(r'No such (object|container|image)')
+
+# The network mode of containers in the host's network namespace.
+NETWORK_HOST = 'host'
+
+# The streams of a container's output, as numbered in the Remote API.
+STDOUT = 1
+STDERR = 2
+
+# The most container output read at a time, per stream.
+LOG_READ_SIZE = 64 * 1024
+
+# The header of each frame of a multiplexed output stream: the stream, then
+# the length of the frame.
+LOG_FRAME_HEADER = struct.Struct('>BxxxL')
+
+# The part of a docker timestamp that matters here.
+RE_TIME = re.compile(r'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)')
+
+# 'docker events' lines, in the pre-1.10 and the later format.
+RE_CLI_EVENTS = [
+    re.compile(r"(?P<id>[0-9a-f]{12,64}): \(from [^)]*\) (?P<status>\w+)\s*$"),
+    re.compile(r"\bcontainer (?P<status>\w+) (?P<id>[0-9a-f]{12,64})\b"),
+]
+
+
+class DockerError(Exception):
+
+    """An operation against the Docker daemon failed."""
+
+
+class LogStream(object):
+
+    """The output of a container, as it is written.
+
+    Iterating gives (STDOUT or STDERR, bytes) pairs of at most LOG_READ_SIZE
+    bytes, and ends when the container stops or Close() is called (from any
+    thread).  Nothing more is read until the consumer asks for it.
+    """
+
+    def __init__(self, chunks, close):
+        self.chunks = chunks
+        self.close = close
+
+    def __iter__(self):
+        return self.chunks
+
+    def Close(self):
+        self.close()
+
+
+def FlagList(values, flag):
+    """Turns a list of values into a list of flags.
+
+    This takes a list of strings, and produces a new list with an extra string
+    ('flag') between each value.
+
+    Args:
+      values: a list of strings
+      flag: a string
+
+    Returns:
+      the expanded list of strings
+
+    Example:
+      FlagList(["a", "b", "c"], "-x") => ["-x", "a", "-x", "b", "-x", "c"]
+
+    """
+
+    result = []
+    for v in values:
+        result.extend([flag, v])
+    return result
+
+
+def FlagOrNothing(value, flag):
+    """Turns a value into a flag list iff value is not None."""
+    if value is not None:
+        return [flag, value]
+    return []
+
+
+def IntOrNone(value):
+    """Turns an int into a flag value, leaving None alone."""
+    if value is not None:
+        return '%d' % (value)
+    return None
+
+
+def PublishedPorts(ctr):
+    """Returns the ports to publish for a container: none for one in the
+    host's network namespace, whose ports are the host's already."""
+    if ctr.network_from == NETWORK_HOST:
+        return []
+    return ctr.ports
+
+
+def RunArgs(ctr):
+    """Returns the 'docker run' arguments (after 'run -d') for a container."""
+    return (['--name', ctr.name] +
+            FlagOrNothing(ctr.hostname, '--hostname') +
+            FlagOrNothing(ctr.working_dir, '--workdir') +
+            FlagOrNothing(ctr.network_from, '--net') +
+            FlagOrNothing(IntOrNone(ctr.cpu_shares), '--cpu-shares') +
+            FlagOrNothing(ctr.cpuset, '--cpuset-cpus') +
+            FlagOrNothing(IntOrNone(ctr.memory), '--memory') +
+            FlagList(['%s:%s%s' % (p[0], p[1], p[2])
+                      for p in PublishedPorts(ctr)], '-p') +
+            FlagList(ctr.mounts, '-v') +
+            FlagList(ctr.env_vars, '-e') +
+            FlagList(['%s=%s' % (k, v)
+                      for k, v in sorted(ctr.labels.items())], '--label') +
+            [ctr.image] +
+            ctr.command)
+
+
+def PortKey(port, proto):
+    """Returns the Remote API name of a port, e.g. '53/udp'."""
+    return '%d%s' % (port, proto or '/tcp')
+
+
+def CreateConfig(ctr):
+    """Returns the Remote API equivalent of RunArgs(ctr), less the name."""
+    exposed = {}
+    bindings = {}
+    for host_port, ctr_port, proto in PublishedPorts(ctr):
+        key = PortKey(ctr_port, proto)
+        exposed[key] = {}
+        bindings.setdefault(key, []).append({'HostPort': str(host_port)})
+
+    config = {
+        'Image': ctr.image,
+        'Cmd': ctr.command or None,
+        'Env': ctr.env_vars,
+        'Labels': dict(ctr.labels),
+        'ExposedPorts': exposed,
+        'HostConfig': {
+            'Binds': ctr.mounts,
+            'PortBindings': bindings,
+        },
+    }
+    if ctr.hostname is not None:
+        config['Hostname'] = ctr.hostname
+    if ctr.working_dir is not None:
+        config['WorkingDir'] = ctr.working_dir
+    if ctr.network_from is not None:
+        config['HostConfig']['NetworkMode'] = ctr.network_from
+    if ctr.cpu_shares is not None:
+        config['HostConfig']['CpuShares'] = ctr.cpu_shares
+    if ctr.cpuset is not None:
+        config['HostConfig']['CpusetCpus'] = ctr.cpuset
+    if ctr.memory is not None:
+        config['HostConfig']['Memory'] = ctr.memory
+    return config
+
+
+def ParseTime(text):
+    """Parses a docker timestamp, e.g. '2014-06-01T12:00:00.123456789Z',
+    into seconds since the epoch."""
+    m = RE_TIME.match(text or '')
+    if not m:
+        return 0
+    return calendar.timegm(time.strptime(m.group(1), '%Y-%m-%dT%H:%M:%S'))
+
+
+def ParseCliEvent(line):
+    """Parses a line of 'docker events' into {'status': ..., 'id': ...}.
+
+    Returns None for lines that are not container events.
+    """
+    for regex in RE_CLI_EVENTS:
+        m = regex.search(line)
+        if m:
+            return {'status': m.group('status'), 'id': m.group('id')}
+    return None
+
+
+def ParseApiEvent(event):
+    """Reduces a Remote API event to {'status': ..., 'id': ...}."""
+    actor = event.get('Actor') or {}
+    return {'status': event.get('status') or event.get('Action'),
+            'id': event.get('id') or actor.get('ID')}
+
+
+def CheckProgress(text):
+    """Raises DockerError if the progress messages docker streams back
+    from a pull or an import report a failure.  Progress is a series of
+    JSON objects; a failure part way through still returns 200, with an
+    "error" message."""
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue
+        if 'error' in message:
+            raise DockerError(message['error'])
+
+
+def ResponseSocket(resp):
+    """Returns the socket an HTTPResponse reads its body from."""
+    fp = resp.fp
+    # Python 3 buffers a SocketIO; Python 2 reads a socket._fileobject.
+    return getattr(fp, 'raw', fp)._sock
+
+
+def StreamLines(resp):
+    """Yields the lines of a response body as they arrive.
+
+    The body is read from the connection itself, decoding any chunked
+    framing here: Python 2's HTTPResponse has no readline(), and its
+    read(n) of a chunked body waits until it has all n bytes.
+    """
+    fp = resp.fp
+    if not resp.chunked:
+        for line in iter(fp.readline, b''):
+            yield line
+        return
+    pending = b''
+    while True:
+        size_line = fp.readline()
+        if not size_line:
+            break
+        size = int(size_line.split(b';')[0].strip(), 16)
+        if not size:
+            break
+        data = fp.read(size)
+        fp.readline()       # the CRLF after the chunk
+        lines = (pending + data).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+        if len(data) < size:
+            break
+    if pending:
+        yield pending
+
+
+def SplitImage(image):
+    """Splits an image reference into (repository, tag)."""
+    repo, sep, tag = image.rpartition(':')
+    if not sep or '/' in tag:
+        return image, 'latest'
+    return repo, tag
+
+
+class CliBackend(object):
+
+    """Drives docker by running its command line client."""
+
+    def __init__(self, docker_cmd=DOCKER_CMD):
+        self.docker_cmd = docker_cmd
+
+    def _Run(self, args, stdin_data=None):
+        with tracing.Span('docker', command=args[0]) as span:
+            proc = subprocess.Popen(
+                [self.docker_cmd] + args,
+                stdin=subprocess.PIPE if stdin_data is not None else None,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT)
+            o, _ = proc.communicate(stdin_data)
+            span.Set('exit_code', proc.returncode)
+        return proc.returncode, o.decode('utf-8', 'replace')
+
+    def _Call(self, args):
+        with tracing.Span('docker', command=args[0]) as span:
+            with open(os.devnull, 'w') as devnull:
+                status = subprocess.call([self.docker_cmd] + args,
+                                         stdout=devnull, stderr=devnull)
+            span.Set('exit_code', status)
+        return status
+
+    def Pull(self, image):
+        status, o = self._Run(['pull', image])
+        if status != 0:
+            raise DockerError(o)
+
+    def ImportImage(self, image, tarball):
+        """Creates an image from the bytes of a tarball of its files."""
+        status, o = self._Run(['import', '-', image], tarball)
+        if status != 0:
+            raise DockerError(o)
+
+    def Kill(self, name):
+        self._Call(['kill', name])
+
+    def Remove(self, name):
+        self._Call(['rm', '-f', name])
+
+    def Run(self, ctr):
+        status, o = self._Run(['run', '-d'] + RunArgs(ctr))
+        if status != 0:
+            raise DockerError(o)
+        return o.strip()
+
+    def Inspect(self, name):
+        status, o = self._Run(['inspect', name])
+        if status != 0:
+            # Anything else, such as the daemon being down, is not an
+            # answer.
+            if RE_NO_SUCH.search(o):
+                return None
+            raise DockerError(o)
+        return json.loads(o)[0]
+
+    def ImageId(self, image):
+        status, o = self._Run(['inspect', '--format', '{{.Id}}', image])
+        if status != 0:
+            return None
+        return o.strip()
+
+    def Restart(self, name):
+        status, o = self._Run(['restart', name])
+        if status != 0:
+            raise DockerError(o)
+
+    def ListContainers(self, label):
+        """Returns (ID, name) pairs for every container, running or not,
+        that has a label."""
+        status, o = self._Run(['ps', '-a', '--no-trunc',
+                               '--filter', 'label=%s' % (label),
+                               '--format', '{{.ID}} {{.Names}}'])
+        if status != 0:
+            raise DockerError(o)
+        return [tuple(line.split(None, 1)) for line in o.splitlines()
+                if line.strip()]
+
+    def ListImages(self):
+        """Returns a list of {'Id', 'Size', 'Created'} for every image."""
+        status, o = self._Run(['images', '-q', '--no-trunc'])
+        if status != 0:
+            raise DockerError(o)
+        image_ids = sorted(set(o.split()))
+        if not image_ids:
+            return []
+        status, o = self._Run(['inspect'] + image_ids)
+        if status != 0:
+            raise DockerError(o)
+        return [{'Id': image['Id'], 'Size': image.get('Size', 0),
+                 'Created': ParseTime(image.get('Created'))}
+                for image in json.loads(o)]
+
+    def RemoveImage(self, image_id):
+        status, o = self._Run(['rmi', image_id])
+        if status != 0:
+            raise DockerError(o)
+
+    def Wait(self, name):
+        status, o = self._Run(['wait', name])
+        if status != 0:
+            raise DockerError(o)
+        return int(o.strip())
+
+    def Events(self):
+        """Subscribes to container events.
+
+        Returns an iterator over them, which ends with the stream.  This is
+        a single long-lived 'docker events' process.
+        """
+        with open(os.devnull, 'w') as devnull:
+            proc = subprocess.Popen([self.docker_cmd, 'events'],
+                                    stdout=subprocess.PIPE, stderr=devnull)
+        return self._Events(proc)
+
+    def Logs(self, name, since=0):
+        """Follows the output of a container, from the time 'since' (in
+        seconds since the epoch) onwards.
+
+        Returns a LogStream.  This is a single 'docker logs' process.
+        """
+        proc = subprocess.Popen([self.docker_cmd, 'logs', '-f',
+                                 '--since', str(int(since)), name],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+
+        def Close():
+            try:
+                proc.kill()
+            except OSError:
+                pass
+        return LogStream(self._Logs(proc), Close)
+
+    def _Logs(self, proc):
+        streams = {proc.stdout.fileno(): STDOUT, proc.stderr.fileno(): STDERR}
+        try:
+            while streams:
+                ready, _, _ = select.select(list(streams), [], [])
+                for fd in ready:
+                    data = os.read(fd, LOG_READ_SIZE)
+                    if not data:
+                        del streams[fd]
+                        continue
+                    yield streams[fd], data
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            proc.stdout.close()
+            proc.stderr.close()
+
+    def _Events(self, proc):
+        try:
+            for line in iter(proc.stdout.readline, b''):
+                event = ParseCliEvent(line.decode('utf-8', 'replace'))
+                if event is not None:
+                    yield event
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+
+    """An HTTPConnection to a unix domain socket."""
+
+    def __init__(self, path, timeout=None):
+        httplib.HTTPConnection.__init__(self, 'localhost')
+        self.path = path
+        self.sock_timeout = timeout
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.sock_timeout is not None:
+            sock.settimeout(self.sock_timeout)
+        sock.connect(self.path)
+        self.sock = sock
+
+
+class ConnectionPool(object):
+
+    """Keeps up to 'size' idle connections for reuse across threads."""
+
+    def __init__(self, factory, size=DEFAULT_POOL_SIZE):
+        self.factory = factory
+        self.size = size
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def Get(self):
+        """Returns (connection, reused)."""
+        with self.lock:
+            if self.idle:
+                return self.idle.pop(), True
+        return self.factory(), False
+
+    def Put(self, conn):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def Close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+
+class ApiBackend(object):
+
+    """Drives docker through the Remote API on its unix socket."""
+
+    def __init__(self, socket_path=DOCKER_SOCKET, pool_size=DEFAULT_POOL_SIZE):
+        self.socket_path = socket_path
+        self.pool = ConnectionPool(
+            lambda: UnixHTTPConnection(self.socket_path), pool_size)
+
+    def _Request(self, method, path, query=None, body=None,
+                 content_type=None):
+        """Makes one API call and returns (status, body bytes).
+
+        The body is sent as JSON, unless a content_type says what its bytes
+        are.
+        """
+        if query:
+            path += '?' + urlencode(sorted(query.items()))
+        headers = {}
+        if content_type is not None:
+            headers['Content-Type'] = content_type
+        elif body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+
+        with tracing.Span('docker_api', method=method, path=path) as span:
+            while True:
+                conn, reused = self.pool.Get()
+                try:
+                    conn.request(method, path, body, headers)
+                    resp = conn.getresponse()
+                    data = resp.read()
+                except (httplib.HTTPException, socket.error) as e:
+                    conn.close()
+                    # The daemon may have closed an idle keep-alive
+                    # connection; that is worth one more try on a fresh one.
+                    if reused:
+                        continue
+                    raise DockerError('%s %s: %s' % (method, path, e))
+                if resp.will_close:
+                    conn.close()
+                else:
+                    self.pool.Put(conn)
+                span.Set('status', resp.status)
+                return resp.status, data
+
+    def _Json(self, method, path, query=None, body=None, ok=(200,)):
+        status, data = self._Request(method, path, query, body)
+        if status not in ok:
+            raise DockerError('%s %s: HTTP %d: %s'
+                              % (method, path, status,
+                                 data.decode('utf-8', 'replace').strip()))
+        if not data:
+            return None
+        return json.loads(data.decode('utf-8'))
+
+    def Close(self):
+        self.pool.Close()
+
+    def Pull(self, image):
+        repo, tag = SplitImage(image)
+        status, data = self._Request(
+            'POST', '/images/create', {'fromImage': repo, 'tag': tag})
+        text = data.decode('utf-8', 'replace')
+        if status != 200:
+            raise DockerError(text)
+        CheckProgress(text)
+
+    def ImportImage(self, image, tarball):
+        """Creates an image from the bytes of a tarball of its files."""
+        repo, tag = SplitImage(image)
+        status, data = self._Request(
+            'POST', '/images/create',
+            {'fromSrc': '-', 'repo': repo, 'tag': tag}, tarball,
+            'application/x-tar')
+        text = data.decode('utf-8', 'replace')
+        if status != 200:
+            raise DockerError(text)
+        CheckProgress(text)
+
+    def Kill(self, name):
+        self._Request('POST', '/containers/%s/kill' % quote(name))
+
+    def Remove(self, name):
+        self._Request('DELETE', '/containers/%s' % quote(name),
+                      {'force': '1'})
+
+    def Run(self, ctr):
+        created = self._Json('POST', '/containers/create',
+                             {'name': ctr.name}, CreateConfig(ctr),
+                             ok=(201,))
+        ctr_id = created['Id']
+        self._Json('POST', '/containers/%s/start' % ctr_id,
+                   ok=(204, 304))
+        return ctr_id
+
+    def Inspect(self, name):
+        status, data = self._Request('GET',
+                                     '/containers/%s/json' % quote(name))
+        if status != 200:
+            return None
+        return json.loads(data.decode('utf-8'))
+
+    def ImageId(self, image):
+        status, data = self._Request('GET', '/images/%s/json' % quote(image))
+        if status != 200:
+            return None
+        return json.loads(data.decode('utf-8'))['Id']
+
+    def Restart(self, name):
+        self._Json('POST', '/containers/%s/restart' % quote(name),
+                   ok=(204,))
+
+    def ListContainers(self, label):
+        """Returns (ID, name) pairs for every container, running or not,
+        that has a label."""
+        ctrs = self._Json('GET', '/containers/json',
+                          {'all': '1',
+                           'filters': json.dumps({'label': [label]})})
+        return [(ctr['Id'], ctr['Names'][0].lstrip('/')) for ctr in ctrs]
+
+    def ListImages(self):
+        """Returns a list of {'Id', 'Size', 'Created'} for every image."""
+        return [{'Id': image['Id'], 'Size': image.get('Size', 0),
+                 'Created': image.get('Created', 0)}
+                for image in self._Json('GET', '/images/json')]
+
+    def RemoveImage(self, image_id):
+        self._Json('DELETE', '/images/%s' % quote(image_id))
+
+    def Wait(self, name):
+        return self._Json('POST',
+                          '/containers/%s/wait' % quote(name))['StatusCode']
+
+    def Events(self):
+        """Subscribes to container events.
+
+        Returns an iterator over them, which ends with the stream.  The
+        stream never goes idle, so it gets its own connection rather than
+        one from the pool.
+        """
+        conn = UnixHTTPConnection(self.socket_path)
+        try:
+            conn.request('GET', '/events')
+            resp = conn.getresponse()
+        except (httplib.HTTPException, socket.error) as e:
+            conn.close()
+            raise DockerError('GET /events: %s' % e)
+        if resp.status != 200:
+            conn.close()
+            raise DockerError('GET /events: HTTP %d' % resp.status)
+        return self._Events(conn, resp)
+
+    def Logs(self, name, since=0):
+        """Follows the output of a container, from the time 'since' (in
+        seconds since the epoch) onwards.
+
+        Returns a LogStream.  Like the events stream, it gets a connection
+        of its own.
+        """
+        path = '/containers/%s/logs?%s' % (quote(name), urlencode(sorted({
+            'follow': '1', 'stdout': '1', 'stderr': '1',
+            'since': str(int(since))}.items())))
+        conn = UnixHTTPConnection(self.socket_path)
+        try:
+            conn.request('GET', path)
+            resp = conn.getresponse()
+        except (httplib.HTTPException, socket.error) as e:
+            conn.close()
+            raise DockerError('GET %s: %s' % (path, e))
+        if resp.status != 200:
+            conn.close()
+            raise DockerError('GET %s: HTTP %d' % (path, resp.status))
+        # With 'Connection: close' the connection lets go of its socket (on
+        # Python 2, closes its wrapper of it), and the response reads from
+        # the socket underneath instead.
+        sock = ResponseSocket(resp)
+
+        def Close():
+            # Shutting the socket down wakes a reader blocked on it.
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        return LogStream(self._Logs(conn, resp), Close)
+
+    def _Logs(self, conn, resp):
+        # Containers without a TTY have their output multiplexed into
+        # frames, each with a header.
+        try:
+            while True:
+                header = resp.read(LOG_FRAME_HEADER.size)
+                if len(header) < LOG_FRAME_HEADER.size:
+                    return
+                stream, size = LOG_FRAME_HEADER.unpack(header)
+                while size:
+                    data = resp.read(min(size, LOG_READ_SIZE))
+                    if not data:
+                        return
+                    size -= len(data)
+                    yield stream, data
+        except (httplib.HTTPException, socket.error, ValueError):
+            # Closed, from this end or the daemon's.
+            return
+        finally:
+            conn.close()
+
+    def _Events(self, conn, resp):
+        try:
+            for line in StreamLines(resp):
+                try:
+                    event = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    continue
+                yield ParseApiEvent(event)
+        except (httplib.HTTPException, socket.error, ValueError) as e:
+            raise DockerError('GET /events: %s' % e)
+        finally:
+            conn.close()
+
+
+def NewBackend(kind=BACKEND_AUTO, docker_cmd=DOCKER_CMD,
+               socket_path=DOCKER_SOCKET):
+    """Returns a backend of the requested kind.
+
+    BACKEND_AUTO picks the API backend when the daemon's socket exists.
+    """
+    if kind == BACKEND_AUTO:
+        kind = BACKEND_API if os.path.exists(socket_path) else BACKEND_CLI
+    if kind == BACKEND_API:
+        return ApiBackend(socket_path)
+    if kind == BACKEND_CLI:
+        return CliBackend(docker_cmd)
+    raise ValueError('unknown docker backend: %s' % kind)
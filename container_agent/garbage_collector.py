@@ -0,0 +1,180 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Remove the containers and images the agent no longer needs.
+
+Every container the agent starts carries its fingerprint label (see
+reconcile.py).  One with that label whose name is not in the manifest is an
+orphan, left behind by an earlier manifest (e.g. one applied before the
+agent restarted), and is removed; orphans are removed in parallel.
+
+Images are only removed once the disk docker keeps them on is fuller than
+the high-water mark, and then until it is no fuller than the low-water mark.
+Images used by the manifest are kept; of the rest, the least recently used
+go first.  An image counts as used when it was last seen in use by a
+manifest, or, if it never was, when it was created.
+"""
+
+import os
+import time
+
+from container_agent import docker_backend
+from container_agent import metrics
+from container_agent import reconcile
+from container_agent import scheduler
+from container_agent import tracing
+from container_agent.agent_log import LogError
+from container_agent.agent_log import LogInfo
+
+
+DEFAULT_DOCKER_ROOT = '/var/lib/docker'
+
+# Disk usage, in percent, above which images are removed, and down to which.
+DEFAULT_HIGH_WATER = 85
+DEFAULT_LOW_WATER = 75
+
+# At most this many orphans are removed at once.
+DEFAULT_CONCURRENCY = 8
+
+
+def DiskUsage(path):
+    """Returns the percentage of the disk holding path that is in use."""
+    st = os.statvfs(path)
+    if not st.f_blocks:
+        return 0.0
+    return 100.0 * (st.f_blocks - st.f_bavail) / st.f_blocks
+
+
+class GarbageCollector(object):
+
+    """Removes orphaned containers, and unused images when disk runs low.
+
+    Args:
+      backend: a docker backend
+      cache: the image_cache.ImageCache to tell about removed images
+      docker_root: where docker keeps its images
+      high_water: the disk usage, in percent, that starts image removal
+      low_water: the disk usage, in percent, that stops it
+      concurrency: how many orphans to remove at once
+      disk_usage: a callable returning the disk usage of a path, in percent
+      clock: a callable returning the current time
+    """
+
+    def __init__(self, backend, cache=None, docker_root=DEFAULT_DOCKER_ROOT,
+                 high_water=DEFAULT_HIGH_WATER, low_water=DEFAULT_LOW_WATER,
+                 concurrency=DEFAULT_CONCURRENCY, disk_usage=DiskUsage,
+                 clock=time.time):
+        self.backend = backend
+        self.cache = cache
+        self.docker_root = docker_root
+        self.high_water = high_water
+        self.low_water = low_water
+        self.concurrency = concurrency
+        self.disk_usage = disk_usage
+        self.clock = clock
+        self.last_used = {}     # image ID -> when last used by a manifest
+
+    def CollectContainers(self, containers, keeper=None):
+        """Removes the agent's containers that are not in containers.
+
+        Args:
+          containers: the list of Containers the manifest wants
+          keeper: the supervisor.Supervisor, to stop watching orphans
+
+        Returns:
+          the sorted names of the containers removed
+        """
+        wanted = set(ctr.name for ctr in containers)
+        orphans = [(ctr_id, name) for ctr_id, name
+                   in self.backend.ListContainers(reconcile.FINGERPRINT_LABEL)
+                   if name not in wanted]
+
+        def Remove(orphan):
+            ctr_id, name = orphan
+            LogInfo("removing orphaned container '%s' (%s)" % (name, ctr_id))
+            if keeper is not None:
+                keeper.Unwatch(ctr_id)
+            self.backend.Kill(ctr_id)
+            self.backend.Remove(ctr_id)
+            return name
+
+        return sorted(scheduler.RunGraph(Remove, orphans, {},
+                                         self.concurrency))
+
+    def CollectImages(self, containers):
+        """Removes images the containers do not use, least recently used
+        first, while the disk is fuller than the low-water mark; if it is
+        no fuller than the high-water mark, does nothing.
+
+        Returns:
+          the IDs of the images removed
+        """
+        now = self.clock()
+        in_use = set()
+        for ctr in containers:
+            image_id = self.backend.ImageId(ctr.image)
+            if image_id is not None:
+                in_use.add(image_id)
+                self.last_used[image_id] = now
+
+        usage = self.disk_usage(self.docker_root)
+        if usage <= self.high_water:
+            return []
+        LogInfo('%s is %.0f%% full: removing unused images'
+                % (self.docker_root, usage))
+
+        unused = [image for image in self.backend.ListImages()
+                  if image['Id'] not in in_use]
+        unused.sort(key=lambda image: (
+            self.last_used.get(image['Id'], image['Created']), image['Id']))
+        removed = []
+        for image in unused:
+            if usage <= self.low_water:
+                break
+            try:
+                self.backend.RemoveImage(image['Id'])
+            except docker_backend.DockerError as e:
+                # Most likely a stopped container still uses it.
+                LogInfo('could not remove image %s: %s' % (image['Id'], e))
+                continue
+            LogInfo('removed image %s' % (image['Id']))
+            self.last_used.pop(image['Id'], None)
+            if self.cache is not None:
+                self.cache.InvalidateId(image['Id'])
+            removed.append(image['Id'])
+            usage = self.disk_usage(self.docker_root)
+        return removed
+
+    def CollectMetrics(self, containers):
+        """Stops exporting the docker timings of images the containers do
+        not use, so that old images do not pile up in the metrics."""
+        images = set(ctr.image for ctr in containers)
+        for operation, image in metrics.DOCKER_SECONDS.Labels():
+            if image not in images:
+                metrics.DOCKER_SECONDS.Remove(operation, image)
+
+    def Collect(self, containers, keeper=None):
+        """Removes orphaned containers, then unused images.
+
+        Failures are logged, not raised: garbage is only ever left for the
+        next time.
+        """
+        self.CollectMetrics(containers)
+        with tracing.Span('collect_garbage') as span:
+            try:
+                span.Set('containers',
+                         len(self.CollectContainers(containers, keeper)))
+                span.Set('images', len(self.CollectImages(containers)))
+            except (docker_backend.DockerError, OSError) as e:
+                LogError('garbage collection failed: %s' % (e))
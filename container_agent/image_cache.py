@@ -0,0 +1,169 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Know which images are local, and pull each one only when needed.
+
+Every container has an image pull policy:
+
+  Always: pull the image whenever the container is (re)created.
+  IfNotPresent: pull the image only if the docker daemon does not have it.
+  Never: never pull; the image must already be present.
+
+As in Kubernetes, images tagged 'latest' (or not tagged at all) default to
+Always, and every other image to IfNotPresent.
+
+An ImageCache remembers which images are present, and their IDs, for a while,
+so that deciding whether to pull costs nothing on the common path.  It also
+coalesces concurrent pulls of the same image into one.
+"""
+
+import threading
+import time
+
+from container_agent import docker_backend
+
+
+PULL_ALWAYS = 'Always'
+PULL_IF_NOT_PRESENT = 'IfNotPresent'
+PULL_NEVER = 'Never'
+VALID_PULL_POLICIES = [PULL_ALWAYS, PULL_IF_NOT_PRESENT, PULL_NEVER]
+
+# How long, in seconds, to trust what the docker daemon said about an image.
+PRESENCE_TTL = 300
+
+
+def DefaultPullPolicy(image):
+    """Returns the pull policy for an image whose container names none."""
+    _, tag = docker_backend.SplitImage(image)
+    if tag == 'latest':
+        return PULL_ALWAYS
+    return PULL_IF_NOT_PRESENT
+
+
+def StrongerPullPolicy(a, b):
+    """Returns whichever of two pull policies pulls more often.
+
+    Either may be None.
+    """
+    for policy in VALID_PULL_POLICIES:
+        if policy in (a, b):
+            return policy
+    return None
+
+
+class _Flight(object):
+
+    """One pull in progress, which other callers can wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ImageCache(object):
+
+    """Caches image presence and IDs, and de-duplicates pulls.
+
+    Args:
+      backend: a docker backend
+      ttl: how long, in seconds, a lookup stays fresh
+      clock: a callable returning the current time
+    """
+
+    def __init__(self, backend, ttl=PRESENCE_TTL, clock=time.time):
+        self.backend = backend
+        self.ttl = ttl
+        self.clock = clock
+        self.ids = {}       # image -> (image ID or None, when looked up)
+        self.flights = {}   # image -> _Flight
+        self.lock = threading.Lock()
+
+    def Lookup(self, image):
+        """Returns (True, the image ID or None) if what is known about an
+        image is fresh, else (False, None), without asking docker."""
+        now = self.clock()
+        with self.lock:
+            entry = self.ids.get(image)
+        if entry is not None and now - entry[1] < self.ttl:
+            return True, entry[0]
+        return False, None
+
+    def Remember(self, image, image_id):
+        """Records what docker said the ID of an image is (None if the image
+        is not present)."""
+        now = self.clock()
+        with self.lock:
+            self.ids[image] = (image_id, now)
+
+    def ImageId(self, image):
+        """Returns the ID of a local image, or None if it is not present."""
+        fresh, image_id = self.Lookup(image)
+        if fresh:
+            return image_id
+        image_id = self.backend.ImageId(image)
+        self.Remember(image, image_id)
+        return image_id
+
+    def Invalidate(self, image):
+        """Forgets what is known about an image, e.g. once it is removed."""
+        with self.lock:
+            self.ids.pop(image, None)
+
+    def InvalidateId(self, image_id):
+        """Forgets every image known to have an ID, e.g. once it is
+        removed."""
+        with self.lock:
+            for image, entry in list(self.ids.items()):
+                if entry[0] == image_id:
+                    del self.ids[image]
+
+    def NeedsPull(self, image, policy):
+        """Says whether an image should be pulled, given its pull policy."""
+        if policy == PULL_ALWAYS:
+            return True
+        if policy == PULL_IF_NOT_PRESENT:
+            return self.ImageId(image) is None
+        return False
+
+    def Pull(self, image, pull):
+        """Calls pull() to pull an image, unless a pull of it is already
+        going, in which case this waits for that one instead.
+
+        Returns what pull() returned, and raises what it raised, to every
+        caller.
+        """
+        with self.lock:
+            flight = self.flights.get(image)
+            leader = flight is None
+            if leader:
+                flight = self.flights[image] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = pull()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            # Whatever happened, the old ID is no longer to be trusted.
+            self.Invalidate(image)
+            with self.lock:
+                del self.flights[image]
+            flight.done.set()
+        return flight.result
@@ -0,0 +1,271 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Collect the output of containers into rotating files.
+
+A container whose manifest entry has a "logs" section has its stdout and
+stderr copied into <log dir>/<container name>/stdout.log and stderr.log.
+When a file would grow past maxBytes it becomes stdout.log.1 (the old .1
+becomes .2, and so on), and only maxFiles files are kept per stream, so a
+container's collected output never takes more than 2 * maxFiles * maxBytes
+of disk.
+
+Output is copied at most docker_backend.LOG_READ_SIZE bytes at a time, and
+nothing more is read from docker until that has been written: a slow disk
+slows the stream down rather than making the agent buffer it.
+
+Each collected container has a thread following its output; containers
+without a "logs" section cost nothing.
+"""
+
+import errno
+import os
+import threading
+
+from container_agent import docker_backend
+from container_agent.agent_log import LogError
+from container_agent.agent_log import LogInfo
+
+
+DEFAULT_LOG_DIR = '/var/log/containers'
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_MAX_FILES = 5
+
+STREAM_NAMES = {
+    docker_backend.STDOUT: 'stdout',
+    docker_backend.STDERR: 'stderr',
+}
+
+# Seconds between checks on whether a stopped container is running again.
+REATTACH_DELAY = 1
+# How long to wait for a stopped follower to finish, in seconds.
+STOP_TIMEOUT = 10
+
+
+class LogConfig(object):
+
+    """How much of a container's output to keep."""
+
+    __slots__ = ('max_bytes', 'max_files')
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES,
+                 max_files=DEFAULT_MAX_FILES):
+        self.max_bytes = max_bytes  # int, the size of each file
+        self.max_files = max_files  # int, files kept per stream
+
+    def __eq__(self, other):
+        return (isinstance(other, LogConfig) and
+                (self.max_bytes, self.max_files) ==
+                (other.max_bytes, other.max_files))
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class RotatingFile(object):
+
+    """A file that is rotated before it grows past max_bytes."""
+
+    def __init__(self, path, max_bytes, max_files):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.f = open(path, 'ab')
+        self.size = self.f.tell()
+
+    def _Rotate(self):
+        self.f.close()
+        for i in range(self.max_files - 1, 0, -1):
+            older = '%s.%d' % (self.path, i)
+            if i == self.max_files - 1:
+                _RemoveIfPresent(older)
+            elif os.path.exists(older):
+                os.rename(older, '%s.%d' % (self.path, i + 1))
+        if self.max_files > 1:
+            os.rename(self.path, self.path + '.1')
+        else:
+            _RemoveIfPresent(self.path)
+        self.f = open(self.path, 'ab')
+        self.size = 0
+
+    def Write(self, data):
+        while data:
+            room = self.max_bytes - self.size
+            if room <= 0:
+                self._Rotate()
+                continue
+            self.f.write(data[:room])
+            self.size += len(data[:room])
+            data = data[room:]
+        self.f.flush()
+
+    def Close(self):
+        self.f.close()
+
+
+def _RemoveIfPresent(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+class _Follower(object):
+
+    """Copies the output of one container until it is removed or Stop()."""
+
+    def __init__(self, backend, name, ctr_id, config, directory):
+        self.backend = backend
+        self.name = name
+        self.ctr_id = ctr_id
+        self.config = config
+        self.directory = directory
+        self.stream = None
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._Run)
+        self.thread.daemon = True
+
+    def _Since(self):
+        """Returns when output was last collected, so that following again
+        (after a restart of the container, or of the agent) does not copy
+        it all twice.
+
+        Docker only goes by whole seconds: output from the second of the
+        last write may be copied again, but none is lost.
+        """
+        since = 0
+        for stream_name in STREAM_NAMES.values():
+            path = os.path.join(self.directory, '%s.log' % (stream_name))
+            try:
+                if os.path.getsize(path):
+                    since = max(since, int(os.path.getmtime(path)))
+            except OSError:
+                pass
+        return since
+
+    def _Run(self):
+        files = {}
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            for stream, stream_name in STREAM_NAMES.items():
+                files[stream] = RotatingFile(
+                    os.path.join(self.directory, '%s.log' % (stream_name)),
+                    self.config.max_bytes, self.config.max_files)
+            while not self.stopped.is_set():
+                self._Follow(files)
+                # It stopped; wait for it to be restarted, or removed.
+                while not self.stopped.wait(REATTACH_DELAY):
+                    info = self.backend.Inspect(self.ctr_id)
+                    if info is None:
+                        return
+                    if info['State']['Running']:
+                        break
+        except (docker_backend.DockerError, IOError, OSError) as e:
+            LogError("stopped collecting the output of container '%s': %s"
+                     % (self.name, e))
+        finally:
+            for f in files.values():
+                f.Close()
+
+    def _Follow(self, files):
+        with self.lock:
+            if self.stopped.is_set():
+                return
+            self.stream = self.backend.Logs(self.ctr_id, self._Since())
+        try:
+            for stream, data in self.stream:
+                files[stream].Write(data)
+        finally:
+            with self.lock:
+                self.stream = None
+
+    def Start(self):
+        self.thread.start()
+        return self
+
+    def Stop(self):
+        with self.lock:
+            self.stopped.set()
+            if self.stream is not None:
+                self.stream.Close()
+
+    def Join(self, timeout=None):
+        """Returns whether the follower has finished."""
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+
+def _Abandon(follower):
+    """Waits for a stopped follower, but not for a stuck stream."""
+    if not follower.Join(STOP_TIMEOUT):
+        LogError("the output of container '%s' did not stop within %ds; "
+                 "leaving it" % (follower.name, STOP_TIMEOUT))
+
+
+class LogCollector(object):
+
+    """Copies the output of the containers it watches into files.
+
+    Args:
+      backend: a docker backend
+      log_dir: where each container gets a directory of its own
+    """
+
+    def __init__(self, backend, log_dir=DEFAULT_LOG_DIR):
+        self.backend = backend
+        self.log_dir = log_dir
+        self.followers = {}     # name -> _Follower
+        self.lock = threading.Lock()
+
+    def Directory(self, name):
+        """Returns the directory of a container's output files."""
+        return os.path.join(self.log_dir, name)
+
+    def Watch(self, name, ctr_id, config):
+        """Starts collecting a container's output, or carries on if it is
+        already being collected with this config."""
+        with self.lock:
+            old = self.followers.get(name)
+            if (old is not None and old.ctr_id == ctr_id and
+                    old.config == config):
+                return
+            follower = self.followers[name] = _Follower(
+                self.backend, name, ctr_id, config, self.Directory(name))
+        if old is not None:
+            old.Stop()
+            _Abandon(old)
+        LogInfo("collecting the output of container '%s' in %s"
+                % (name, follower.directory))
+        follower.Start()
+
+    def Unwatch(self, name):
+        """Stops collecting a container's output; its files are kept."""
+        with self.lock:
+            follower = self.followers.pop(name, None)
+        if follower is not None:
+            follower.Stop()
+            _Abandon(follower)
+
+    def Watched(self):
+        """Returns a dict of name -> (container ID, LogConfig)."""
+        with self.lock:
+            return dict((name, (f.ctr_id, f.config))
+                        for name, f in self.followers.items())
+
+    def Stop(self):
+        for name in list(self.Watched()):
+            self.Unwatch(name)
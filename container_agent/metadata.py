@@ -0,0 +1,203 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Read the manifest from the GCE metadata server.
+
+On a container VM the manifest is the google-container-manifest instance
+attribute.  MetadataClient fetches it over one persistent HTTP connection,
+and can long-poll for changes with wait_for_change and the ETag of the last
+value seen, so updates arrive within seconds without busy polling.
+MetadataSource runs that long-poll on a thread and offers the same interface
+as daemon.ManifestFile.
+"""
+
+import os
+import select
+import socket
+import threading
+
+from container_agent import restart_policy
+from container_agent.agent_log import LogError
+from container_agent.agent_log import LogInfo
+
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+
+METADATA_HOST = 'metadata.google.internal'
+METADATA_PORT = 80
+MANIFEST_PATH = ('/computeMetadata/v1/instance/attributes/'
+                 'google-container-manifest')
+
+# How long the server may hold a wait_for_change request, in seconds.  The
+# socket is allowed a little longer than that.
+WAIT_TIMEOUT = 60
+SOCKET_SLACK = 10
+
+# Without an ETag (say, while the attribute does not exist) there is nothing
+# to wait for a change to, so then the attribute is fetched this often, in
+# seconds.
+ABSENT_POLL_INTERVAL = 10
+
+
+class MetadataError(Exception):
+
+    """The metadata server could not be reached or gave a bad answer."""
+
+
+class MetadataClient(object):
+
+    """Fetches one metadata value, reusing a single HTTP connection."""
+
+    def __init__(self, host=METADATA_HOST, port=METADATA_PORT,
+                 path=MANIFEST_PATH, wait_timeout=WAIT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.wait_timeout = wait_timeout
+        self.etag = None
+        self.conn = None
+
+    def _Connection(self):
+        if self.conn is None:
+            self.conn = httplib.HTTPConnection(
+                self.host, self.port,
+                timeout=self.wait_timeout + SOCKET_SLACK)
+        return self.conn
+
+    def Close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def Fetch(self, wait=False):
+        """Returns (changed, value).
+
+        Args:
+          wait: if True, and a value has been fetched before, block until it
+              changes or the server's wait times out
+
+        value is None when the attribute does not exist.
+        """
+        query = {'alt': 'text'}
+        if wait and self.etag:
+            query['wait_for_change'] = 'true'
+            query['last_etag'] = self.etag
+            query['timeout_sec'] = str(self.wait_timeout)
+        url = '%s?%s' % (self.path, urlencode(sorted(query.items())))
+
+        conn = self._Connection()
+        try:
+            conn.request('GET', url, headers={'Metadata-Flavor': 'Google'})
+            resp = conn.getresponse()
+            body = resp.read()
+        except (httplib.HTTPException, socket.error) as e:
+            self.Close()
+            raise MetadataError('GET %s: %s' % (url, e))
+        if resp.will_close:
+            self.Close()
+
+        if resp.status == 404:
+            changed = self.etag != ''
+            self.etag = ''
+            return changed, None
+        if resp.status != 200:
+            raise MetadataError('GET %s: HTTP %d' % (url, resp.status))
+        etag = resp.getheader('ETag')
+        changed = etag is None or etag != self.etag
+        self.etag = etag
+        return changed, body.decode('utf-8')
+
+
+class MetadataSource(object):
+
+    """A manifest source that long-polls the metadata server.
+
+    Args:
+      client: a MetadataClient
+      backoff: a restart_policy.Backoff, for retrying after errors
+    """
+
+    def __init__(self, client=None, backoff=None):
+        self.client = client or MetadataClient()
+        self.backoff = backoff or restart_policy.Backoff()
+        self.lock = threading.Lock()
+        self.value = None
+        self.stopped = threading.Event()
+        self.ready_r, self.ready_w = os.pipe()
+        self.thread = None
+
+    def __str__(self):
+        return 'metadata server %s:%s' % (self.client.host, self.client.port)
+
+    def Start(self):
+        """Fetches the current value, then keeps long-polling for changes.
+
+        Returns self.  Errors fetching the first value are raised.
+        """
+        _, self.value = self.client.Fetch()
+        self.thread = threading.Thread(target=self._Poll)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def _Poll(self):
+        errors = 0
+        while not self.stopped.is_set():
+            try:
+                changed, value = self.client.Fetch(wait=True)
+                errors = 0
+            except MetadataError as e:
+                delay = self.backoff.Delay(errors)
+                errors += 1
+                LogError('could not fetch the manifest, retrying in %.1fs: '
+                         '%s' % (delay, e))
+                self.stopped.wait(delay)
+                continue
+            if changed and not self.stopped.is_set():
+                LogInfo('the manifest in the metadata server changed')
+                with self.lock:
+                    self.value = value
+                os.write(self.ready_w, b'x')
+            if not self.client.etag:
+                self.stopped.wait(ABSENT_POLL_INTERVAL)
+
+    def Read(self):
+        with self.lock:
+            return self.value
+
+    def fileno(self):
+        return self.ready_r
+
+    def Timeout(self):
+        return None
+
+    def Changed(self):
+        """Says whether the long-poll has seen a change since last asked."""
+        ready, _, _ = select.select([self.ready_r], [], [], 0)
+        if not ready:
+            return False
+        os.read(self.ready_r, 4096)
+        return True
+
+    def Close(self):
+        self.stopped.set()
+        self.client.Close()
@@ -0,0 +1,364 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Export the agent's metrics for Prometheus.
+
+The agent keeps a few counters, gauges and histograms (the ones below
+REGISTRY) and, when asked to, serves them on /metrics in the Prometheus text
+format.  Across a fleet they show which registries are slow to pull from,
+which containers keep restarting, and which agents have not managed to apply
+their manifest for a while.
+
+Only the standard library is needed.
+"""
+
+import threading
+import time
+
+try:
+    import http.server as BaseHTTPServer
+except ImportError:
+    import BaseHTTPServer
+
+try:
+    import socketserver as SocketServer
+except ImportError:
+    import SocketServer
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds, in seconds, of the buckets of a histogram; from a quick
+# docker kill to a large pull from a slow registry.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 120, 300)
+
+
+def FormatValue(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value == int(value):
+        return '%d' % (value)
+    return repr(value)
+
+
+def EscapeLabelValue(value):
+    return (str(value).replace('\\', r'\\').replace('\n', r'\n')
+            .replace('"', r'\"'))
+
+
+def FormatLabels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % (','.join('%s="%s"' % (name, EscapeLabelValue(value))
+                              for name, value in zip(names, values)))
+
+
+class _Metric(object):
+
+    """A metric, with one value per combination of label values."""
+
+    kind = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values = {}    # label values -> value
+        self.lock = threading.Lock()
+
+    def _Key(self, labels):
+        if len(labels) != len(self.label_names):
+            raise ValueError('%s needs labels %s, got %r'
+                             % (self.name, ', '.join(self.label_names),
+                                labels))
+        return tuple(str(label) for label in labels)
+
+    def Remove(self, *labels):
+        """Stops exporting the value for some labels."""
+        with self.lock:
+            self.values.pop(self._Key(labels), None)
+
+    def Labels(self):
+        """Returns the sorted label values that have a value."""
+        with self.lock:
+            return sorted(self.values)
+
+    def _Samples(self):
+        """Returns a list of (suffix, label names, label values, value)."""
+        with self.lock:
+            return [('', self.label_names, key, value)
+                    for key, value in sorted(self.values.items())]
+
+    def Render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help_text),
+                 '# TYPE %s %s' % (self.name, self.kind)]
+        for suffix, names, values, value in self._Samples():
+            lines.append('%s%s%s %s' % (self.name, suffix,
+                                        FormatLabels(names, values),
+                                        FormatValue(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(_Metric):
+
+    """A count that only goes up, such as the number of restarts."""
+
+    kind = 'counter'
+
+    def Inc(self, *labels, **kwargs):
+        amount = kwargs.get('amount', 1)
+        key = self._Key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def Value(self, *labels):
+        with self.lock:
+            return self.values.get(self._Key(labels), 0)
+
+
+class Gauge(_Metric):
+
+    """A value that can go up and down.
+
+    A gauge without labels may instead be computed when it is exported, by
+    a callable passed as func.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, label_names=(), func=None):
+        _Metric.__init__(self, name, help_text, label_names)
+        self.func = func
+
+    def Set(self, value, *labels):
+        key = self._Key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def Value(self, *labels):
+        if self.func is not None:
+            return self.func()
+        with self.lock:
+            return self.values.get(self._Key(labels))
+
+    def _Samples(self):
+        if self.func is None:
+            return _Metric._Samples(self)
+        value = self.func()
+        if value is None:
+            return []
+        return [('', (), (), value)]
+
+
+class _Timer(object):
+
+    """Observes how long its with block takes."""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.Observe(time.time() - self.start, *self.labels)
+        return False
+
+
+class Histogram(_Metric):
+
+    """Counts observations, such as durations, in buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(),
+                 buckets=DEFAULT_BUCKETS):
+        _Metric.__init__(self, name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def Observe(self, value, *labels):
+        key = self._Key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # [count per bucket..., sum]
+                entry = self.values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-1] += value
+
+    def Time(self, *labels):
+        """Returns a context manager that observes how long it runs for."""
+        self._Key(labels)
+        return _Timer(self, labels)
+
+    def Count(self, *labels):
+        """Returns the number of observations."""
+        with self.lock:
+            entry = self.values.get(self._Key(labels))
+            return sum(entry[:-1]) if entry is not None else 0
+
+    def Sum(self, *labels):
+        """Returns the sum of the observations."""
+        with self.lock:
+            entry = self.values.get(self._Key(labels))
+            return entry[-1] if entry is not None else 0.0
+
+    def _Samples(self):
+        names = self.label_names + ('le',)
+        samples = []
+        with self.lock:
+            for key, entry in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry):
+                    cumulative += count
+                    samples.append(('_bucket', names,
+                                    key + (FormatValue(bound),), cumulative))
+                samples.append(('_sum', self.label_names, key, entry[-1]))
+                samples.append(('_count', self.label_names, key, cumulative))
+        return samples
+
+
+class Registry(object):
+
+    """The metrics exported together."""
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def Register(self, metric):
+        with self.lock:
+            if any(m.name == metric.name for m in self.metrics):
+                raise ValueError('metric %s is already registered'
+                                 % (metric.name))
+            self.metrics.append(metric)
+        return metric
+
+    def Render(self):
+        """Returns every metric in the Prometheus text format."""
+        with self.lock:
+            metrics = list(self.metrics)
+        return ''.join(metric.Render() for metric in metrics)
+
+
+REGISTRY = Registry()
+
+DOCKER_SECONDS = REGISTRY.Register(Histogram(
+    'container_agent_docker_operation_seconds',
+    'How long docker operations took, by operation (pull, kill, rm, run) '
+    'and image.  Pulls include retries.',
+    ('operation', 'image')))
+
+RESTARTS = REGISTRY.Register(Counter(
+    'container_agent_container_restarts_total',
+    'How many times the supervisor restarted a container.',
+    ('container',)))
+
+LAST_APPLY = REGISTRY.Register(Gauge(
+    'container_agent_last_apply_success_timestamp_seconds',
+    'When a manifest was last applied successfully, in seconds since the '
+    'epoch.'))
+
+
+def _SecondsSinceLastApply():
+    last = LAST_APPLY.Value()
+    if last is None:
+        return None
+    return max(time.time() - last, 0.0)
+
+
+SINCE_LAST_APPLY = REGISTRY.Register(Gauge(
+    'container_agent_seconds_since_last_apply',
+    'Seconds since a manifest was last applied successfully.',
+    func=_SecondsSinceLastApply))
+
+LOG_LINES_DROPPED = REGISTRY.Register(Counter(
+    'container_agent_log_lines_dropped_total',
+    'Log lines dropped because syslog could not keep up.'))
+
+VALIDATION_SECONDS = REGISTRY.Register(Histogram(
+    'container_agent_manifest_validation_seconds',
+    'How long parsing and validating a manifest took, by result (valid or '
+    'invalid).',
+    ('result',)))
+
+
+TMPFS_BYTES = REGISTRY.Register(Gauge(
+    'container_agent_tmpfs_volume_bytes',
+    'Memory committed to the tmpfs volumes of each group, in bytes.  The '
+    'group of a manifest without groups is "".',
+    ('group',)))
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.partition('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.Render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        # Scrapes are too frequent to log.
+        pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MetricsServer(object):
+
+    """Serves a registry on /metrics, from a thread of its own.
+
+    Args:
+      host: the address to listen on; empty for every address
+      port: the port to listen on; 0 picks a free one (see Address())
+      registry: the Registry to serve
+    """
+
+    def __init__(self, host, port, registry=REGISTRY):
+        self.server = _Server((host, port), _Handler)
+        self.server.registry = registry
+        self.thread = None
+
+    def Address(self):
+        """Returns the (host, port) being served on."""
+        return self.server.server_address[:2]
+
+    def Start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def Stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread is not None:
+            self.thread.join()
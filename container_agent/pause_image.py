@@ -0,0 +1,111 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The image of the infrastructure containers, built by the agent itself.
+
+An infrastructure container only holds its group's network namespace open,
+so its image needs nothing but a process that sleeps forever.  The agent
+makes that image itself, with 'docker import' of a tarball holding a single
+static x86-64 binary, /pause, which calls pause(2) in a loop.  The image is
+never pulled: a group's network comes up even when no registry can be
+reached.
+
+The binary is written out byte by byte below rather than shipped as a file,
+so that the image is the same wherever the agent was installed from.  It is
+an ELF header, one program header and 9 bytes of code.
+
+Hosts that are not x86-64 cannot run it; there, infrastructure containers
+run busybox instead, pulled if docker does not have it.
+"""
+
+import io
+import platform
+import struct
+import tarfile
+
+from container_agent.agent_log import LogInfo
+
+
+# Bumped whenever the image changes, so that an old one is not used.
+PAUSE_VERSION = 1
+IMAGE = 'container-agent/pause:%d' % (PAUSE_VERSION)
+COMMAND = ['/pause']
+
+# What platform.machine() calls the hosts the binary runs on.
+MACHINES = ('x86_64', 'amd64')
+
+FALLBACK_IMAGE = 'busybox'
+FALLBACK_COMMAND = ['sh', '-c', 'rm -f nap && mkfifo nap && exec cat nap']
+
+# Where the binary is loaded, as for any static x86-64 executable.
+LOAD_ADDRESS = 0x400000
+
+ELF_HEADER = struct.Struct('<16sHHIQQQIHHHHHH')
+PROGRAM_HEADER = struct.Struct('<IIQQQQQQ')
+
+# loop: mov $34, %eax  (__NR_pause)
+#       syscall
+#       jmp loop
+CODE = b'\xb8\x22\x00\x00\x00\x0f\x05\xeb\xf7'
+
+
+def Supported(machine=None):
+    """Says whether the /pause binary runs on this host (or on 'machine')."""
+    if machine is None:
+        machine = platform.machine()
+    return machine.lower() in MACHINES
+
+
+def PauseBinary():
+    """Returns the bytes of the /pause executable."""
+    headers = ELF_HEADER.size + PROGRAM_HEADER.size
+    size = headers + len(CODE)
+    elf_header = ELF_HEADER.pack(
+        b'\x7fELF\x02\x01\x01',     # 64-bit, little-endian, version 1
+        2,                          # ET_EXEC
+        62,                         # EM_X86_64
+        1,                          # EV_CURRENT
+        LOAD_ADDRESS + headers,     # entry point: the code
+        ELF_HEADER.size,            # program headers follow this one
+        0,                          # no section headers
+        0,                          # flags
+        ELF_HEADER.size, PROGRAM_HEADER.size, 1,
+        0, 0, 0)
+    program_header = PROGRAM_HEADER.pack(
+        1,                          # PT_LOAD: map the whole file
+        5,                          # readable and executable
+        0, LOAD_ADDRESS, LOAD_ADDRESS, size, size,
+        0x1000)
+    return elf_header + program_header + CODE
+
+
+def Tarball():
+    """Returns the tarball to import: /pause, and nothing else."""
+    binary = PauseBinary()
+    info = tarfile.TarInfo('pause')
+    info.size = len(binary)
+    info.mode = 0o755
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode='w') as tar:
+        tar.addfile(info, io.BytesIO(binary))
+    return data.getvalue()
+
+
+def Import(backend):
+    """Imports the image into docker.
+
+    Raises docker_backend.DockerError if that fails.
+    """
+    LogInfo('importing the infrastructure image %s' % (IMAGE))
+    backend.ImportImage(IMAGE, Tarball())
@@ -0,0 +1,116 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pin containers to the host's cores.
+
+A container may name its cores itself (cpuset), or, when the agent runs
+with --cpu-placement spread, be given some: a container asking for
+cpuShares gets one core per SHARES_PER_CPU shares (at least one), and each
+container goes onto the cores with the fewest shares already on them.
+Containers that ask for nothing are not pinned, and can use every core.
+
+The placement depends only on the manifest and the number of cores, so
+applying the same manifest again pins every container the same way.
+"""
+
+import multiprocessing
+import os
+import re
+
+
+PLACEMENT_NONE = 'none'
+PLACEMENT_SPREAD = 'spread'
+VALID_PLACEMENTS = [PLACEMENT_NONE, PLACEMENT_SPREAD]
+
+# Docker's default, and what a container asks for with one whole core.
+SHARES_PER_CPU = 1024
+
+RE_CPU_RANGE = re.compile(r'^(\d+)(?:-(\d+))?$')
+
+
+def ParseCpuList(text):
+    """Parses a cpuset such as '0-2,5' into a sorted list of core numbers.
+
+    Raises ValueError if it is not one.
+    """
+    cpus = set()
+    for part in str(text).split(','):
+        m = RE_CPU_RANGE.match(part.strip())
+        if not m:
+            raise ValueError('not a list of cores: %s' % (text))
+        first = int(m.group(1))
+        last = int(m.group(2) or first)
+        if last < first:
+            raise ValueError('not a list of cores: %s' % (text))
+        cpus.update(range(first, last + 1))
+    return sorted(cpus)
+
+
+def FormatCpuList(cpus):
+    """The inverse of ParseCpuList()."""
+    parts = []
+    for cpu in sorted(cpus):
+        if parts and parts[-1][1] == cpu - 1:
+            parts[-1][1] = cpu
+        else:
+            parts.append([cpu, cpu])
+    return ','.join('%d' % (first) if first == last
+                    else '%d-%d' % (first, last)
+                    for first, last in parts)
+
+
+def NumCpus():
+    """Returns how many cores the agent may use."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return multiprocessing.cpu_count()
+
+
+def CpusWanted(shares, num_cpus):
+    """Returns how many cores a container asking for shares should get."""
+    return max(1, min(num_cpus, -(-shares // SHARES_PER_CPU)))
+
+
+def Spread(containers, num_cpus):
+    """Pins the containers that ask for cpuShares but name no cpuset.
+
+    Sets ctr.cpuset on each container it places, and returns the list of
+    containers.
+
+    Args:
+      containers: a list of run_containers.Container
+      num_cpus: how many cores there are to spread over
+    """
+    load = [0] * num_cpus
+
+    # Containers that pinned themselves are where they said.
+    for ctr in containers:
+        if ctr.cpuset is None:
+            continue
+        cpus = [cpu for cpu in ParseCpuList(ctr.cpuset) if cpu < num_cpus]
+        for cpu in cpus:
+            load[cpu] += float(ctr.cpu_shares or SHARES_PER_CPU) / len(cpus)
+
+    # The largest go first, while there is the most room for them.
+    unplaced = sorted((ctr for ctr in containers
+                       if ctr.cpuset is None and ctr.cpu_shares is not None),
+                      key=lambda ctr: (-ctr.cpu_shares, ctr.name))
+    for ctr in unplaced:
+        wanted = CpusWanted(ctr.cpu_shares, num_cpus)
+        cpus = sorted(range(num_cpus), key=lambda cpu: (load[cpu], cpu))
+        cpus = cpus[:wanted]
+        for cpu in cpus:
+            load[cpu] += float(ctr.cpu_shares) / wanted
+        ctr.cpuset = FormatCpuList(cpus)
+    return containers
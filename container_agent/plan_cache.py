@@ -0,0 +1,106 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Remember the containers a manifest compiles to.
+
+Parsing and validating a manifest gives the same containers every time, so
+the result (the plan) is kept on disk, keyed by a hash of the manifest text.
+When the agent sees a manifest again, after a reboot or a reload, it takes
+the plan from here and skips parsing and validation altogether.
+
+Only valid manifests have plans.  A plan that cannot be read is treated as
+missing.
+"""
+
+import hashlib
+import json
+import os
+
+from container_agent.agent_log import LogError
+
+
+DEFAULT_CACHE_DIR = '/var/cache/container-agent/plans'
+
+# Bumped whenever the plan format, or what a manifest compiles to, changes,
+# so that plans from another version of the agent are never used.
+PLAN_FORMAT = 7
+
+# Plans beyond this many, least recently used first, are removed.
+MAX_PLANS = 16
+
+
+def ManifestHash(text):
+    """Returns the key for the plan of a manifest."""
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    header = ('%d\n' % PLAN_FORMAT).encode('ascii')
+    return hashlib.sha256(header + text).hexdigest()
+
+
+class PlanCache(object):
+
+    """Stores compiled plans, as JSON, in a directory."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_plans=MAX_PLANS):
+        self.cache_dir = cache_dir
+        self.max_plans = max_plans
+
+    def _Path(self, text):
+        return os.path.join(self.cache_dir,
+                            '%s.json' % (ManifestHash(text)))
+
+    def Get(self, text):
+        """Returns the plan for a manifest, or None."""
+        path = self._Path(text)
+        try:
+            with open(path, 'r') as f:
+                plan = json.load(f)
+        except (IOError, OSError):
+            return None
+        except ValueError as e:
+            LogError('ignoring corrupt plan %s: %s' % (path, e))
+            return None
+        try:
+            # Mark it as recently used.
+            os.utime(path, None)
+        except OSError:
+            pass
+        return plan
+
+    def Put(self, text, plan):
+        """Stores the plan (anything JSON can encode) for a manifest."""
+        path = self._Path(text)
+        tmp_path = path + '.tmp'
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(tmp_path, 'w') as f:
+                json.dump(plan, f, sort_keys=True)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            LogError('could not store plan %s: %s' % (path, e))
+            return
+        self._Prune()
+
+    def _Prune(self):
+        try:
+            names = [name for name in os.listdir(self.cache_dir)
+                     if name.endswith('.json')]
+            paths = sorted((os.path.join(self.cache_dir, name)
+                            for name in names),
+                           key=os.path.getmtime, reverse=True)
+            for path in paths[self.max_plans:]:
+                os.remove(path)
+        except OSError as e:
+            LogError('could not prune plans in %s: %s' % (self.cache_dir, e))
@@ -0,0 +1,77 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Decide whether a running container already matches its manifest entry.
+
+Every container the agent starts carries a label holding a fingerprint of the
+configuration it was started with.  When the agent runs again, a container
+whose label matches the fingerprint of its desired configuration, and which is
+still running, is left alone instead of being killed and recreated.
+"""
+
+import hashlib
+import json
+
+
+FINGERPRINT_LABEL = 'com.google.container-agent.fingerprint'
+
+
+def Fingerprint(ctr, image_id):
+    """Returns a hex digest of everything that shapes a running container.
+
+    Args:
+      ctr: a run_containers.Container
+      image_id: the ID of the local image that ctr.image resolves to
+
+    Returns:
+      a string which changes whenever the container would need recreating
+    """
+    config = {
+        'name': ctr.name,
+        'image': ctr.image,
+        'image_id': image_id,
+        'command': ctr.command,
+        'hostname': ctr.hostname,
+        'working_dir': ctr.working_dir,
+        'ports': [list(p) for p in ctr.ports],
+        'mounts': ctr.mounts,
+        'env_vars': ctr.env_vars,
+        'network_from': ctr.network_from,
+    }
+    # Added only when set, so that containers without limits or tmpfs
+    # volumes keep the fingerprints they had before those could be set.
+    for name in ('cpu_shares', 'cpuset', 'memory'):
+        if getattr(ctr, name) is not None:
+            config[name] = getattr(ctr, name)
+    if ctr.tmpfs:
+        config['tmpfs'] = ctr.tmpfs
+    blob = json.dumps(config, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(blob).hexdigest()
+
+
+def RunningFingerprint(info):
+    """Returns the fingerprint label of a running container, or None.
+
+    Args:
+      info: the result of inspecting a container, or None if there is none
+    """
+    if not info or not info.get('State', {}).get('Running'):
+        return None
+    labels = (info.get('Config') or {}).get('Labels') or {}
+    return labels.get(FINGERPRINT_LABEL)
+
+
+def IsUpToDate(info, fingerprint):
+    """Whether an inspected container is running with this fingerprint."""
+    return RunningFingerprint(info) == fingerprint
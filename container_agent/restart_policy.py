@@ -0,0 +1,188 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""When, and how soon, to restart a container that exited.
+
+A container's RestartPolicy says whether it is restarted at all.  Restarts
+back off exponentially, with jitter, while a container keeps exiting soon
+after it starts; a container that does that several times in a row is
+considered to be crash-looping until it manages a stable run.
+"""
+
+import random
+
+
+POLICY_ALWAYS = 'always'
+POLICY_ON_FAILURE = 'on-failure'
+POLICY_NEVER = 'never'
+VALID_POLICIES = [POLICY_ALWAYS, POLICY_ON_FAILURE, POLICY_NEVER]
+
+# Restart delays start at BACKOFF_INITIAL seconds and double up to
+# BACKOFF_MAX, each randomly stretched or shrunk by up to BACKOFF_JITTER.
+BACKOFF_INITIAL = 1.0
+BACKOFF_MAX = 300.0
+BACKOFF_JITTER = 0.2
+
+# A run at least this many seconds long resets the backoff.
+STABLE_RUN_SECS = 60
+# This many short runs in a row is a crash loop.
+CRASHLOOP_THRESHOLD = 3
+
+STATE_RUNNING = 'running'
+STATE_BACKOFF = 'backoff'
+STATE_CRASHLOOP = 'crashloop'
+STATE_STOPPED = 'stopped'
+STATE_FAILED = 'failed'
+
+
+class RestartPolicy(object):
+
+    """Whether a container should be restarted when it exits."""
+
+    __slots__ = ('name', 'max_attempts')
+
+    def __init__(self, name=POLICY_ALWAYS, max_attempts=0):
+        self.name = name                  # one of VALID_POLICIES
+        self.max_attempts = max_attempts  # int, 0 for no limit
+
+    def __eq__(self, other):
+        return (isinstance(other, RestartPolicy) and
+                (self.name, self.max_attempts) ==
+                (other.name, other.max_attempts))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def ShouldRestart(self, exit_code):
+        if self.name == POLICY_NEVER:
+            return False
+        if self.name == POLICY_ON_FAILURE:
+            return exit_code != 0
+        return True
+
+
+class Backoff(object):
+
+    """Computes jittered exponential restart delays."""
+
+    def __init__(self, initial=BACKOFF_INITIAL, maximum=BACKOFF_MAX,
+                 jitter=BACKOFF_JITTER, rng=None):
+        self.initial = initial
+        self.maximum = maximum
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+
+    def Delay(self, attempt):
+        """Returns the delay before restart number 'attempt' (from 0)."""
+        delay = min(self.maximum, self.initial * (2 ** min(attempt, 32)))
+        return delay * (1 + self.jitter * self.rng.uniform(-1, 1))
+
+
+class RestartState(object):
+
+    """The restart history of one container."""
+
+    def __init__(self, policy, started_at):
+        self.policy = policy
+        self.started_at = started_at
+        self.attempts = 0           # restarts since the last stable run
+        self.restarts = 0           # restarts, ever
+        self.short_runs = 0         # consecutive runs shorter than stable
+        self.last_exit_code = None
+        self.next_restart = None    # when the pending restart is due
+        self.state = STATE_RUNNING
+
+    def OnExit(self, now, exit_code, backoff):
+        """Records an exit and returns the restart delay, or None."""
+        self.last_exit_code = exit_code
+        if now - self.started_at >= STABLE_RUN_SECS:
+            self.attempts = 0
+            self.short_runs = 0
+        else:
+            self.short_runs += 1
+
+        if not self.policy.ShouldRestart(exit_code):
+            self.state = STATE_STOPPED
+            self.next_restart = None
+            return None
+        delay = self._NextAttempt(now, backoff)
+        if delay is None:
+            return None
+        if self.short_runs >= CRASHLOOP_THRESHOLD:
+            self.state = STATE_CRASHLOOP
+        else:
+            self.state = STATE_BACKOFF
+        return delay
+
+    def OnRestartFailed(self, now, backoff):
+        """Records a restart that failed and returns the delay before the
+        next one, or None if the attempts have run out."""
+        return self._NextAttempt(now, backoff)
+
+    def _NextAttempt(self, now, backoff):
+        if self.policy.max_attempts and \
+                self.attempts >= self.policy.max_attempts:
+            self.state = STATE_FAILED
+            self.next_restart = None
+            return None
+        delay = backoff.Delay(self.attempts)
+        self.attempts += 1
+        self.next_restart = now + delay
+        return delay
+
+    def OnStart(self, now):
+        self.started_at = now
+        self.restarts += 1
+        self.next_restart = None
+        if self.state != STATE_CRASHLOOP:
+            self.state = STATE_RUNNING
+
+    def ToDict(self):
+        """Returns the history to keep across restarts of the agent."""
+        return {
+            'started_at': self.started_at,
+            'attempts': self.attempts,
+            'restarts': self.restarts,
+            'short_runs': self.short_runs,
+            'last_exit_code': self.last_exit_code,
+            'state': self.state,
+        }
+
+    @classmethod
+    def FromDict(cls, policy, d):
+        """The inverse of ToDict(), for a container that is running."""
+        state = cls(policy, d['started_at'])
+        state.attempts = d['attempts']
+        state.restarts = d['restarts']
+        state.short_runs = d['short_runs']
+        state.last_exit_code = d['last_exit_code']
+        # A pending restart happened (or was overtaken) while the agent was
+        # away.
+        if d['state'] == STATE_CRASHLOOP:
+            state.state = STATE_CRASHLOOP
+        return state
+
+    def Status(self, now):
+        """Returns a dict describing this container, for the agent status."""
+        state = self.state
+        if (state == STATE_CRASHLOOP and self.next_restart is None and
+                now - self.started_at >= STABLE_RUN_SECS):
+            state = STATE_RUNNING
+        return {
+            'state': state,
+            'restarts': self.restarts,
+            'attempts': self.attempts,
+            'last_exit_code': self.last_exit_code,
+            'next_restart': self.next_restart,
+        }
@@ -22,30 +22,81 @@ with the -r=false flag, otherwise the docker daemon itself will try to do
 restarts whenever it gets a signal itself.
 
 This will read one file, specified on the commandline, or stdin if no file is
-provided.
+provided.  With --daemon, it keeps watching the file and applies each new
+version of it, touching only the containers that were added, removed or
+changed.
 
 This will log to syslog's LOCAL3 facility.
 
-On networking:  This program assumes that all of the containers in the manifest
-constitute a group.  For simplicity, a group shares a network namespace (via
---net=container:<name>).  This means that all containers can see each other as
-"localhost", but it also means that the set of ports they use must be unique
-across the group.  We want to revisit this.
+Once the containers are started, this keeps running and restarts any of them
+that exit (see supervisor.py).
+
+On networking:  The containers in a manifest constitute a group, or, if the
+manifest lists several named groups, each of those does.  For simplicity, a
+group shares a network namespace (via --net=container:<name>).  This means
+that all containers in a group can see each other as "localhost", but it also
+means that the set of ports they use must be unique across the group.  Host
+ports must of course be unique across the VM.  A group with hostNetwork
+shares the host's network namespace instead (--net=host): it needs no
+infrastructure container, and its ports bypass docker's NAT and proxy.
+
+Each named group has its own infrastructure container, '.net.<group>', and its
+own volumes, under VOLUMES_ROOT_DIR/<group>.  Its containers are called
+'<group>.<name>' in docker, and keep <name> as their hostname.
 
 Environmental requirements:
   - Docker 0.11 or higher (for the --net flag)
+  - Docker 1.6 or higher (for the --label flag)
   - Docker daemon runs with =r=false (for safer restart behavior)
 
 """
 
+import argparse
+import json
 import os
 import re
-import subprocess
+import signal
 import sys
-import syslog
+import threading
 import time
 import yaml
 
+from container_agent import agent_log
+from container_agent import agent_state
+from container_agent import daemon
+from container_agent import docker_backend
+from container_agent import garbage_collector
+from container_agent import image_cache
+from container_agent import log_collector
+from container_agent import metadata
+from container_agent import metrics
+from container_agent import pause_image
+from container_agent import placement
+from container_agent import plan_cache
+from container_agent import reconcile
+from container_agent import restart_policy
+from container_agent import scheduler
+from container_agent import supervisor
+from container_agent import tracing
+from container_agent import validation
+from container_agent import volumes
+from container_agent.agent_log import LogError
+from container_agent.agent_log import LogInfo
+# FlagList and FlagOrNothing predate docker_backend; keep them reachable here.
+from container_agent.docker_backend import FlagList  # noqa
+from container_agent.docker_backend import FlagOrNothing  # noqa
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Manifest strings are unicode on Python 2 when they come from JSON.
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
 
 PROGNAME = 'containervm-agent'
 
@@ -59,34 +110,36 @@ RE_RFC1035_NAME = re.compile(r"^[a-z]([-a-z0-9]*[a-z0-9])*$")
 RE_C_TOKEN = re.compile(r"[A-Za-z_]\w*$")
 MAX_PATH_LEN = 512
 
-DOCKER_CMD = 'docker'
+DOCKER_CMD = docker_backend.DOCKER_CMD
 VOLUMES_ROOT_DIR = '/export'
-LOG_CMD = 'logger -p local3.info -t %s --' % (PROGNAME)
 
-KEEPALIVE_SCRIPT = """
-  while true; do
-    read PID </proc/self/stat; PID=$(echo $PID | cut -f1 -d' ');
-    %(log)s "keepalive for container '%(name)s' (%(id)s) running as PID $PID";
-    STATUS=$(%(docker)s wait '%(id)s' 2>/dev/null);
-    %(log)s "container '%(name)s' (%(id)s) exited with status " $STATUS;
-    if ! %(docker)s inspect '%(id)s' >/dev/null 2>&1; then
-      %(log)s "container '%(name)s' (%(id)s) no longer exists: " \
-          "halting keepalive (PID $PID)";
-      break;
-    fi;
-    sleep 1;
-    %(log)s "container '%(name)s' (%(id)s) restarting";
-    %(docker)s restart '%(id)s' >/dev/null 2>&1;
-  done &
-  """
+# The smallest resource limits docker accepts.
+MIN_CPU_SHARES = 2
+MIN_MEMORY = 4 * 1024 * 1024
+
+# The smallest tmpfs volume: one page.
+MIN_TMPFS_SIZE = 4096
+
+# Image pulls are retried this many times, this many seconds apart.
+PULL_ATTEMPTS = 10
+PULL_RETRY_DELAY = 3
+DEFAULT_PULL_CONCURRENCY = 4
 
+# At most this many containers are (re)created at once.
+DEFAULT_START_CONCURRENCY = 8
 
-def LogInfo(msg):
-    syslog.syslog(syslog.LOG_LOCAL3 | syslog.LOG_INFO, msg)
+# How docker operations are run: from threads that block on each one, or as
+# coroutines on an asyncio event loop (Python 3 only; see async_engine.py).
+ENGINE_THREADS = 'threads'
+ENGINE_ASYNCIO = 'asyncio'
+VALID_ENGINES = [ENGINE_THREADS, ENGINE_ASYNCIO]
 
+# Images served by a registry on the VM itself (see manifests/README.md) can
+# only be pulled once the registry container in this group is running.
+RE_LOCAL_REGISTRY_IMAGE = re.compile(r"^(localhost|127\.0\.0\.1)(:\d+)?/")
 
-def LogError(msg):
-    syslog.syslog(syslog.LOG_LOCAL3 | syslog.LOG_ERR, msg)
+# libyaml's loader is many times faster than the pure Python one.
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
 
 
 def Fatal(*args):
@@ -94,6 +147,7 @@ def Fatal(*args):
     err_str = 'FATAL: ' + ' '.join(map(str, args))
     sys.stderr.write(err_str + '\n')
     LogError(err_str)
+    agent_log.Flush()
     # TODO(thockin): It would probably be cleaner to raise an exception.
     sys.exit(1)
 
@@ -109,40 +163,146 @@ def ProtocolString(proto):
 
 
 def IsValidPort(port):
-    return 0 < port <= 65535
+    return isinstance(port, int) and 0 < port <= 65535
 
 
 def IsRfc1035Name(name):
-    return RE_RFC1035_NAME.match(name)
+    return isinstance(name, string_types) and RE_RFC1035_NAME.match(name)
 
 
 def IsCToken(name):
-    return RE_C_TOKEN.match(name)
+    return isinstance(name, string_types) and RE_C_TOKEN.match(name)
 
 
 def IsValidPath(path):
-    return path[0] == '/' and len(path) <= MAX_PATH_LEN
+    return (isinstance(path, string_types) and path.startswith('/') and
+            len(path) <= MAX_PATH_LEN)
+
+
+class FatalErrors(object):
+
+    """Reports a manifest error by exiting, through Fatal().
+
+    The Load* functions report errors this way unless they are handed a
+    validation.ErrorList, which collects every error instead.
+    """
+
+    def Add(self, message):
+        Fatal(message)
+
+
+FATAL_ERRORS = FatalErrors()
+
+
+def LoadList(value, field, errors=FATAL_ERRORS):
+    """Returns a field that should be a list; [] if it is missing (None) or,
+    reporting an error, not a list."""
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        errors.Add('%s is not a list: %s' % (field, value))
+        return []
+    return value
+
+
+def LoadDict(value, field, errors=FATAL_ERRORS):
+    """Returns a field that should be an object; {} if it is missing (None)
+    or, reporting an error, not an object."""
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        errors.Add('%s is not an object: %s' % (field, value))
+        return {}
+    return value
 
 
-def LoadVolumes(volumes):
+def IsDict(value, field, errors=FATAL_ERRORS):
+    """Says whether a list item is an object, reporting it if not."""
+    if not isinstance(value, dict):
+        errors.Add('%s is not an object: %s' % (field, value))
+        return False
+    return True
+
+
+def LoadVolumes(volumes, errors=FATAL_ERRORS):
     """Process a "volumes" block of config and return a list of volumes."""
 
     # TODO(thockin): could be a map of name -> Volume
     all_vol_names = []
+    seen_vol_names = set()
     for vol_index, vol in enumerate(volumes):
+        if not IsDict(vol, 'volumes[%d]' % (vol_index), errors):
+            continue
         # Get the container name.
         if 'name' not in vol:
-            Fatal('volumes[%d] has no name' % (vol_index))
+            errors.Add('volumes[%d] has no name' % (vol_index))
+            continue
         vol_name = vol['name']
         if not IsRfc1035Name(vol_name):
-            Fatal('volumes[%d].name is invalid: %s' % (vol_index, vol_name))
-        if vol_name in all_vol_names:
-            Fatal('volumes[%d].name is not unique: %s' % (vol_index, vol_name))
+            errors.Add('volumes[%d].name is invalid: %s'
+                       % (vol_index, vol_name))
+            continue
+        if vol_name in seen_vol_names:
+            errors.Add('volumes[%d].name is not unique: %s'
+                       % (vol_index, vol_name))
+            continue
+        seen_vol_names.add(vol_name)
         all_vol_names.append(vol_name)
 
     return all_vol_names
 
 
+def LoadVolumeSource(source_spec, vol_name, errors=FATAL_ERRORS):
+    """Process the "source" of a volume and return a VolumeSource."""
+
+    if not isinstance(source_spec, dict) or len(source_spec) != 1:
+        errors.Add('volumes[%s].source must be exactly one of: %s'
+                   % (vol_name, ', '.join(volumes.VALID_SOURCES)))
+        return volumes.VolumeSource()
+    kind, spec = list(source_spec.items())[0]
+    spec = LoadDict(spec, 'volumes[%s].source.%s' % (vol_name, kind), errors)
+
+    if kind == volumes.SOURCE_EMPTY_DIR:
+        return volumes.VolumeSource()
+    if kind == volumes.SOURCE_TMPFS:
+        size = spec.get('sizeBytes')
+        if not IsIntAtLeast(size, MIN_TMPFS_SIZE):
+            errors.Add('volumes[%s].source.tmpfs.sizeBytes is invalid: %s'
+                       % (vol_name, size))
+        return volumes.VolumeSource(kind, size=size)
+    if kind == volumes.SOURCE_HOST_DIR:
+        path = spec.get('path')
+        if path is None or not IsValidPath(path):
+            errors.Add('volumes[%s].source.hostDir.path is invalid: %s'
+                       % (vol_name, path))
+        return volumes.VolumeSource(kind, path=path)
+    errors.Add('volumes[%s].source is invalid: %s' % (vol_name, kind))
+    return volumes.VolumeSource()
+
+
+def LoadVolumeSources(volumes_spec, errors=FATAL_ERRORS):
+    """Process the "source" of each volume in a "volumes" block of config
+    and return a dict of volume name -> VolumeSource.
+
+    Volumes without a valid, unique name are left to LoadVolumes().
+    """
+
+    sources = {}
+    for vol in volumes_spec:
+        if not isinstance(vol, dict):
+            continue
+        vol_name = vol.get('name')
+        if (vol_name is None or not IsRfc1035Name(vol_name) or
+                vol_name in sources):
+            continue
+        if 'source' in vol:
+            sources[vol_name] = LoadVolumeSource(vol['source'], vol_name,
+                                                 errors)
+        else:
+            sources[vol_name] = volumes.VolumeSource()
+    return sources
+
+
 # TODO(thockin): We should probably fail on unknown fields in JSON objects.
 class Container(object):
 
@@ -150,7 +310,10 @@ class Container(object):
 
     # Only allow the supported params.
     __slots__ = ('name', 'image', 'command', 'hostname', 'working_dir',
-                 'ports', 'mounts', 'env_vars', 'network_from')
+                 'ports', 'mounts', 'env_vars', 'network_from', 'labels',
+                 'restart_policy', 'image_pull_policy', 'depends_on',
+                 'group', 'log_config', 'cpu_shares', 'cpuset', 'memory',
+                 'tmpfs')
 
     def __init__(self, name, image):
         self.name = name          # required str
@@ -162,14 +325,118 @@ class Container(object):
         self.mounts = []          # [str]
         self.env_vars = []        # [str]
         self.network_from = None  # str
+        self.labels = {}          # {str: str}
+        self.restart_policy = restart_policy.RestartPolicy()
+        self.image_pull_policy = image_cache.DefaultPullPolicy(image)
+        self.depends_on = []      # [str], names of containers to start first
+        self.group = None         # str, None for an unnamed group
+        self.log_config = None    # log_collector.LogConfig, if collected
+        self.cpu_shares = None    # int, relative CPU weight
+        self.cpuset = None        # str, the cores to run on, e.g. '0-1,3'
+        self.memory = None        # int, the memory limit in bytes
+        self.tmpfs = []           # [[str, int]], tmpfs volumes' dir and size
+
+    def ToDict(self):
+        """Returns the container as a dict that JSON can encode."""
+        d = dict((name, getattr(self, name)) for name in self.__slots__)
+        d['restart_policy'] = {
+            'name': self.restart_policy.name,
+            'max_attempts': self.restart_policy.max_attempts,
+        }
+        if self.log_config is not None:
+            d['log_config'] = {
+                'max_bytes': self.log_config.max_bytes,
+                'max_files': self.log_config.max_files,
+            }
+        return d
+
+    @classmethod
+    def FromDict(cls, d):
+        """The inverse of ToDict()."""
+        ctr = cls(d['name'], d['image'])
+        for name in cls.__slots__:
+            setattr(ctr, name, d[name])
+        ctr.ports = [tuple(port) for port in ctr.ports]
+        ctr.restart_policy = restart_policy.RestartPolicy(
+            d['restart_policy']['name'], d['restart_policy']['max_attempts'])
+        if ctr.log_config is not None:
+            ctr.log_config = log_collector.LogConfig(
+                d['log_config']['max_bytes'], d['log_config']['max_files'])
+        return ctr
+
+
+def InfraName(group):
+    """Returns the name of a group's network container."""
+    if group is None:
+        return '.net'
+    return '.net.%s' % (group)
+
+
+def QualifiedName(group, name):
+    """Returns the docker name of a container in a group."""
+    if group is None:
+        return name
+    return '%s.%s' % (group, name)
+
+
+def VolumesDir(group):
+    """Returns the directory holding a group's volumes."""
+    if group is None:
+        return VOLUMES_ROOT_DIR
+    return os.path.join(VOLUMES_ROOT_DIR, group)
+
+
+def LoadHostNetwork(group_spec, errors=FATAL_ERRORS, group=None):
+    """Process the "hostNetwork" field of a group and return it."""
+    host_network = group_spec.get('hostNetwork', False)
+    if not isinstance(host_network, bool):
+        if group is None:
+            errors.Add('hostNetwork is invalid: %s' % (host_network))
+        else:
+            errors.Add('groups[%s].hostNetwork is invalid: %s'
+                       % (group, host_network))
+        return False
+    return host_network
+
 
+def UseHostNetwork(user_containers, errors=FATAL_ERRORS):
+    """Puts a group's containers in the host's network namespace, and
+    returns them; such a group needs no infrastructure container.
 
-def LoadInfraContainers(user_containers):
+    Their ports are not published (see docker_backend.PublishedPorts): a
+    container listens on the host's ports itself, so its ports only reserve
+    those, and each hostPort must be its containerPort.
+    """
+    for ctr in user_containers:
+        ctr.network_from = docker_backend.NETWORK_HOST
+        # Docker refuses a hostname for a container sharing the host's
+        # network; it gets the host's.
+        ctr.hostname = None
+        for host_port, ctr_port, proto in ctr.ports:
+            if host_port != ctr_port:
+                errors.Add('containers[%s] uses hostNetwork, so its hostPort '
+                           '%d must be its containerPort %d'
+                           % (ctr.name, host_port, ctr_port))
+    return user_containers
+
+
+def LoadInfraContainers(user_containers, group=None):
     """Return a list of infrastructural containers required for this group."""
 
     # Shared network namespace.
-    net_ctr = Container('.net', 'busybox')
-    net_ctr.command = ['sh', '-c', 'rm -f nap && mkfifo nap && exec cat nap']
+    if pause_image.Supported():
+        net_ctr = Container(InfraName(group), pause_image.IMAGE)
+        net_ctr.command = list(pause_image.COMMAND)
+        # The agent imports the image itself (see ImportInfraImage); no
+        # registry stands between a group and its network.
+        net_ctr.image_pull_policy = image_cache.PULL_NEVER
+    else:
+        net_ctr = Container(InfraName(group), pause_image.FALLBACK_IMAGE)
+        net_ctr.command = list(pause_image.FALLBACK_COMMAND)
+        # Any busybox will do; there is no need to ask the registry every
+        # time.
+        net_ctr.image_pull_policy = image_cache.PULL_IF_NOT_PRESENT
+    net_ctr.group = group
     for user_ctr in user_containers:
         # The port flags must be on the shared network container.
         # This seems like a bug in Docker.
@@ -180,171 +447,442 @@ def LoadInfraContainers(user_containers):
     return [net_ctr]
 
 
-def LoadUserContainers(containers, all_volumes):
+def LoadUserContainers(containers, all_volumes, errors=FATAL_ERRORS,
+                       group=None, sources=None):
     """Process a "containers" block of config and return a list of
-    containers."""
+    containers.
+
+    sources is a dict of volume name -> VolumeSource, from
+    LoadVolumeSources(); volumes not in it are emptyDir volumes.
+    """
+
+    with tracing.Span('load_user_containers', group=group,
+                      containers=len(containers)):
+        return _LoadUserContainers(containers, all_volumes, errors, group,
+                                   sources or {})
+
+
+def _LoadUserContainers(containers, all_volumes, errors, group, sources):
+    # Membership checks against a set stay cheap for big groups.
+    all_volumes = set(all_volumes)
+    tmpfs_sizes = TmpfsSizes(sources, group)
 
     # TODO(thockin): could be a dict of name -> Container
     all_ctrs = []
-    all_ctr_names = []
+    all_ctr_names = set()
     for ctr_index, ctr_spec in enumerate(containers):
+        if not IsDict(ctr_spec, 'containers[%d]' % (ctr_index), errors):
+            continue
         # Verify the container name.
         if 'name' not in ctr_spec:
-            Fatal('containers[%d] has no name' % (ctr_index))
+            errors.Add('containers[%d] has no name' % (ctr_index))
+            continue
         if not IsRfc1035Name(ctr_spec['name']):
-            Fatal('containers[%d].name is invalid: %s'
-                  % (ctr_index, ctr_spec['name']))
+            errors.Add('containers[%d].name is invalid: %s'
+                       % (ctr_index, ctr_spec['name']))
+            continue
         if ctr_spec['name'] in all_ctr_names:
-            Fatal('containers[%d].name is not unique: %s'
-                  % (ctr_index, ctr_spec['name']))
-        all_ctr_names.append(ctr_spec['name'])
+            errors.Add('containers[%d].name is not unique: %s'
+                       % (ctr_index, ctr_spec['name']))
+            continue
+        all_ctr_names.add(ctr_spec['name'])
 
         # Verify the container image.
         if 'image' not in ctr_spec:
-            Fatal('containers[%s] has no image' % (ctr_spec['name']))
+            errors.Add('containers[%s] has no image' % (ctr_spec['name']))
+            continue
+        if not isinstance(ctr_spec['image'], string_types) or \
+                not ctr_spec['image']:
+            errors.Add('containers[%s].image is invalid: %s'
+                       % (ctr_spec['name'], ctr_spec['image']))
+            continue
 
         # The current accumulation of parameters.
-        current_ctr = Container(ctr_spec['name'], ctr_spec['image'])
+        current_ctr = Container(QualifiedName(group, ctr_spec['name']),
+                                ctr_spec['image'])
+        current_ctr.group = group
+
+        # Get the image pull policy.
+        current_ctr.image_pull_policy = ctr_spec.get(
+            'imagePullPolicy', current_ctr.image_pull_policy)
+        if current_ctr.image_pull_policy not in \
+                image_cache.VALID_PULL_POLICIES:
+            errors.Add('containers[%s].imagePullPolicy is invalid: %s'
+                       % (current_ctr.name, current_ctr.image_pull_policy))
 
         # Always set the hostname for user containers.
-        current_ctr.hostname = current_ctr.name
+        current_ctr.hostname = ctr_spec['name']
 
         # Get the commandline.
-        current_ctr.command = ctr_spec.get('command', [])
+        current_ctr.command = LoadList(
+            ctr_spec.get('command'),
+            'containers[%s].command' % (current_ctr.name), errors)
+        if not all(isinstance(arg, string_types)
+                   for arg in current_ctr.command):
+            errors.Add('containers[%s].command is invalid: %s'
+                       % (current_ctr.name, current_ctr.command))
+            current_ctr.command = []
 
         # Get the initial working directory.
         current_ctr.working_dir = ctr_spec.get('workingDir', None)
         if current_ctr.working_dir is not None:
             if not IsValidPath(current_ctr.working_dir):
-                Fatal('containers[%s].workingDir is invalid: %s'
-                      % (current_ctr.name, current_ctr.working_dir))
+                errors.Add('containers[%s].workingDir is invalid: %s'
+                           % (current_ctr.name, current_ctr.working_dir))
 
         # Get the list of port mappings.
         current_ctr.ports = LoadPorts(
-            ctr_spec.get('ports', []), current_ctr.name)
+            LoadList(ctr_spec.get('ports'),
+                     'containers[%s].ports' % (current_ctr.name), errors),
+            current_ctr.name, errors)
 
         # Get the list of volumes to mount.
         current_ctr.mounts = LoadVolumeMounts(
-            ctr_spec.get('volumeMounts', []), all_volumes, current_ctr.name)
+            LoadList(ctr_spec.get('volumeMounts'),
+                     'containers[%s].volumeMounts' % (current_ctr.name),
+                     errors),
+            all_volumes, current_ctr.name, errors, group, sources)
+        current_ctr.tmpfs = TmpfsVolumes(current_ctr.mounts, tmpfs_sizes)
 
         # Get the list of environment variables.
         current_ctr.env_vars = LoadEnvVars(
-            ctr_spec.get('env', []), current_ctr.name)
+            LoadList(ctr_spec.get('env'),
+                     'containers[%s].env' % (current_ctr.name), errors),
+            current_ctr.name, errors)
+
+        # Get the restart policy.
+        current_ctr.restart_policy = LoadRestartPolicy(
+            LoadDict(ctr_spec.get('restartPolicy'),
+                     'containers[%s].restartPolicy' % (current_ctr.name),
+                     errors),
+            current_ctr.name, errors)
+
+        # Get where to keep the container's output, if anywhere.
+        if 'logs' in ctr_spec:
+            current_ctr.log_config = LoadLogConfig(
+                LoadDict(ctr_spec['logs'],
+                         'containers[%s].logs' % (current_ctr.name), errors),
+                current_ctr.name, errors)
+
+        # Get the resource limits.
+        (current_ctr.cpu_shares, current_ctr.cpuset,
+         current_ctr.memory) = LoadResources(ctr_spec, current_ctr.name,
+                                             errors)
+
+        # Get the containers to start first.
+        current_ctr.depends_on = [
+            QualifiedName(group, dep_name) for dep_name in LoadDependsOn(
+                LoadList(ctr_spec.get('dependsOn'),
+                         'containers[%s].dependsOn' % (current_ctr.name),
+                         errors),
+                current_ctr.name, errors)]
 
         # Set the network linkage.
-        current_ctr.network_from = 'container:.net'
+        current_ctr.network_from = 'container:%s' % (InfraName(group))
 
         all_ctrs.append(current_ctr)
 
+    AddRegistryDependencies(all_ctrs)
+    CheckDependencies(all_ctrs, errors)
+
     return all_ctrs
 
 
-def LoadPorts(ports_spec, ctr_name):
+def LoadPorts(ports_spec, ctr_name, errors=FATAL_ERRORS):
     """Process a "ports" block of config and return a list of ports."""
 
     # TODO(thockin): could be a dict of name -> Port
     all_ports = []
-    all_port_names = []
-    all_host_port_nums = []
+    all_port_names = set()
+    all_host_port_nums = set()
 
     for port_index, port_spec in enumerate(ports_spec):
+        if not IsDict(port_spec, 'containers[%s].ports[%d]'
+                      % (ctr_name, port_index), errors):
+            continue
         if 'name' in port_spec:
             port_name = port_spec['name']
             if not IsRfc1035Name(port_name):
-                Fatal('containers[%s].ports[%d].name is invalid: %s'
-                      % (ctr_name, port_index, port_name))
-            if port_name in all_port_names:
-                Fatal('containers[%s].ports[%d].name is not unique: %s'
-                      % (ctr_name, port_index, port_name))
-            all_port_names.append(port_name)
+                errors.Add('containers[%s].ports[%d].name is invalid: %s'
+                           % (ctr_name, port_index, port_name))
+            elif port_name in all_port_names:
+                errors.Add('containers[%s].ports[%d].name is not unique: %s'
+                           % (ctr_name, port_index, port_name))
+            all_port_names.add(port_name)
         else:
             port_name = str(port_index)
 
         if 'containerPort' not in port_spec:
-            Fatal('containers[%s].ports[%s] has no containerPort'
-                  % (ctr_name, port_name))
+            errors.Add('containers[%s].ports[%s] has no containerPort'
+                       % (ctr_name, port_name))
+            continue
         ctr_port = port_spec['containerPort']
         if not IsValidPort(ctr_port):
-            Fatal('containers[%s].ports[%s].containerPort is invalid: %d'
-                  % (ctr_name, port_name, ctr_port))
+            errors.Add('containers[%s].ports[%s].containerPort is invalid: %s'
+                       % (ctr_name, port_name, ctr_port))
+            continue
 
         host_port = port_spec.get('hostPort', ctr_port)
         if not IsValidPort(host_port):
-            Fatal('containers[%s].ports[%s].hostPort is invalid: %d'
-                  % (ctr_name, port_name, host_port))
+            errors.Add('containers[%s].ports[%s].hostPort is invalid: %s'
+                       % (ctr_name, port_name, host_port))
+            continue
         if host_port in all_host_port_nums:
-            Fatal('containers[%s].ports[%s].hostPort is not unique: %d'
-                  % (ctr_name, port_name, host_port))
-        all_host_port_nums.append(host_port)
+            errors.Add('containers[%s].ports[%s].hostPort is not unique: %d'
+                       % (ctr_name, port_name, host_port))
+            continue
+        all_host_port_nums.add(host_port)
 
         proto = port_spec.get('protocol', 'TCP')
         if not IsValidProtocol(proto):
-            Fatal('containers[%s].ports[%s].protocol is invalid: %s'
-                  % (ctr_name, port_name, proto))
+            errors.Add('containers[%s].ports[%s].protocol is invalid: %s'
+                       % (ctr_name, port_name, proto))
+            continue
 
         all_ports.append((host_port, ctr_port, ProtocolString(proto)))
 
     return all_ports
 
 
-def LoadVolumeMounts(mounts_spec, all_volumes, ctr_name):
-    """Process a "volumeMounts" block of config and return a list of mounts."""
+def LoadVolumeMounts(mounts_spec, all_volumes, ctr_name,
+                     errors=FATAL_ERRORS, group=None, sources=None):
+    """Process a "volumeMounts" block of config and return a list of mounts.
+
+    A hostDir volume (see LoadVolumeSources) is mounted from its host
+    directory; every other volume from its directory under VolumesDir().
+    """
 
     # TODO(thockin): Could be a dict of name -> Mount
     all_mounts = []
     for vol_index, vol_spec in enumerate(mounts_spec):
+        if not IsDict(vol_spec, 'containers[%s].volumeMounts[%d]'
+                      % (ctr_name, vol_index), errors):
+            continue
         if 'name' not in vol_spec:
-            Fatal('containers[%s].volumeMounts[%d] has no name'
-                  % (ctr_name, vol_index))
+            errors.Add('containers[%s].volumeMounts[%d] has no name'
+                       % (ctr_name, vol_index))
+            continue
         vol_name = vol_spec['name']
         if not IsRfc1035Name(vol_name):
-            Fatal('containers[%s].volumeMounts[%d].name'
-                  'is invalid: %s'
-                  % (ctr_name, vol_index, vol_name))
+            errors.Add('containers[%s].volumeMounts[%d].name '
+                       'is invalid: %s'
+                       % (ctr_name, vol_index, vol_name))
+            continue
         if vol_name not in all_volumes:
-            Fatal('containers[%s].volumeMounts[%d].name'
-                  'is not a known volume: %s'
-                  % (ctr_name, vol_index, vol_name))
+            errors.Add('containers[%s].volumeMounts[%d].name '
+                       'is not a known volume: %s'
+                       % (ctr_name, vol_index, vol_name))
+            continue
 
         if 'path' not in vol_spec:
-            Fatal('containers[%s].volumeMounts[%s] has no path'
-                  % (ctr_name, vol_name))
+            errors.Add('containers[%s].volumeMounts[%s] has no path'
+                       % (ctr_name, vol_name))
+            continue
         vol_path = vol_spec['path']
         if not IsValidPath(vol_path):
-            Fatal('containers[%s].volumeMounts[%s].path is invalid: %s'
-                  % (ctr_name, vol_name, vol_path))
+            errors.Add('containers[%s].volumeMounts[%s].path is invalid: %s'
+                       % (ctr_name, vol_name, vol_path))
+            continue
 
         read_mode = 'ro' if vol_spec.get('readOnly', False) else 'rw'
 
-        all_mounts.append(
-            '%s/%s:%s:%s' % (VOLUMES_ROOT_DIR, vol_name, vol_path, read_mode))
+        source = (sources or {}).get(vol_name)
+        if source is not None and source.kind == volumes.SOURCE_HOST_DIR:
+            host_dir = source.path
+        else:
+            host_dir = '%s/%s' % (VolumesDir(group), vol_name)
+        all_mounts.append('%s:%s:%s' % (host_dir, vol_path, read_mode))
 
     return all_mounts
 
 
-def LoadEnvVars(env_spec, ctr_name):
+def TmpfsSizes(sources, group=None):
+    """Returns a dict of directory -> size of a group's tmpfs volumes."""
+    return dict(('%s/%s' % (VolumesDir(group), vol_name), source.size)
+                for vol_name, source in sources.items()
+                if source.kind == volumes.SOURCE_TMPFS)
+
+
+def TmpfsVolumes(mounts, tmpfs_sizes):
+    """Returns the [directory, size] of each tmpfs volume among a
+    container's mounts, for volumes.TmpfsMounter.
+
+    tmpfs_sizes is the group's TmpfsSizes(), built once per group.
+    """
+    if not tmpfs_sizes:
+        return []
+    host_dirs = set(mount.split(':')[0] for mount in mounts)
+    return [[host_dir, tmpfs_sizes[host_dir]]
+            for host_dir in sorted(host_dirs) if host_dir in tmpfs_sizes]
+
+
+def LoadEnvVars(env_spec, ctr_name, errors=FATAL_ERRORS):
     """Process an "env" block of config and return a list of env vars."""
 
     # TODO(thockin): could be a dict of key -> value
     all_env_vars = []
     for env_index, env_spec in enumerate(env_spec):
+        if not IsDict(env_spec, 'containers[%s].env[%d]'
+                      % (ctr_name, env_index), errors):
+            continue
         if 'key' not in env_spec:
-            Fatal('containers[%s].env[%d] has no key' % (ctr_name, env_index))
+            errors.Add('containers[%s].env[%d] has no key'
+                       % (ctr_name, env_index))
+            continue
         env_key = env_spec['key']
         if not IsCToken(env_key):
-            Fatal('containers[%s].env[%d].key is invalid: %s'
-                  % (ctr_name, env_index, env_key))
+            errors.Add('containers[%s].env[%d].key is invalid: %s'
+                       % (ctr_name, env_index, env_key))
+            continue
 
         if 'value' not in env_spec:
-            Fatal('containers[%s].env[%s] has no value' % (ctr_name, env_key))
+            errors.Add('containers[%s].env[%s] has no value'
+                       % (ctr_name, env_key))
+            continue
         env_val = env_spec['value']
+        if isinstance(env_val, (dict, list)) or env_val is None:
+            errors.Add('containers[%s].env[%s].value is invalid: %s'
+                       % (ctr_name, env_key, env_val))
+            continue
 
         all_env_vars.append('%s=%s' % (env_key, env_val))
 
     return all_env_vars
 
 
-def CheckGroupWideConflicts(containers):
+def LoadRestartPolicy(policy_spec, ctr_name, errors=FATAL_ERRORS):
+    """Process a "restartPolicy" block of config and return a
+    RestartPolicy."""
+
+    policy_name = policy_spec.get('name', restart_policy.POLICY_ALWAYS)
+    if policy_name not in restart_policy.VALID_POLICIES:
+        errors.Add('containers[%s].restartPolicy.name is invalid: %s'
+                   % (ctr_name, policy_name))
+        policy_name = restart_policy.POLICY_ALWAYS
+
+    max_attempts = policy_spec.get('maxAttempts', 0)
+    if not isinstance(max_attempts, int) or max_attempts < 0:
+        errors.Add('containers[%s].restartPolicy.maxAttempts is invalid: %s'
+                   % (ctr_name, max_attempts))
+        max_attempts = 0
+
+    return restart_policy.RestartPolicy(policy_name, max_attempts)
+
+
+def IsIntAtLeast(value, least):
+    return (isinstance(value, int) and not isinstance(value, bool) and
+            value >= least)
+
+
+def LoadResources(ctr_spec, ctr_name, errors=FATAL_ERRORS):
+    """Process the "cpuShares", "cpuset" and "memory" fields of a container
+    and return (cpu shares, cpuset, memory), each None if not given."""
+
+    cpu_shares = ctr_spec.get('cpuShares')
+    if cpu_shares is not None and not IsIntAtLeast(cpu_shares,
+                                                   MIN_CPU_SHARES):
+        errors.Add('containers[%s].cpuShares is invalid: %s'
+                   % (ctr_name, cpu_shares))
+        cpu_shares = None
+
+    cpuset = ctr_spec.get('cpuset')
+    if cpuset is not None:
+        try:
+            cpuset = placement.FormatCpuList(placement.ParseCpuList(cpuset))
+        except ValueError:
+            errors.Add('containers[%s].cpuset is invalid: %s'
+                       % (ctr_name, cpuset))
+            cpuset = None
+
+    memory = ctr_spec.get('memory')
+    if memory is not None and not IsIntAtLeast(memory, MIN_MEMORY):
+        errors.Add('containers[%s].memory is invalid: %s'
+                   % (ctr_name, memory))
+        memory = None
+
+    return cpu_shares, cpuset, memory
+
+
+def LoadLogConfig(logs_spec, ctr_name, errors=FATAL_ERRORS):
+    """Process a "logs" block of config and return a LogConfig."""
+
+    limits = {}
+    for key, default in (('maxBytes', log_collector.DEFAULT_MAX_BYTES),
+                         ('maxFiles', log_collector.DEFAULT_MAX_FILES)):
+        value = logs_spec.get(key, default)
+        if not IsIntAtLeast(value, 1):
+            errors.Add('containers[%s].logs.%s is invalid: %s'
+                       % (ctr_name, key, value))
+            value = default
+        limits[key] = value
+
+    return log_collector.LogConfig(limits['maxBytes'], limits['maxFiles'])
+
+
+def LoadDependsOn(depends_spec, ctr_name, errors=FATAL_ERRORS):
+    """Process a "dependsOn" block of config and return a list of names."""
+
+    all_names = []
+    seen_names = set()
+    for dep_index, dep_name in enumerate(depends_spec):
+        if not isinstance(dep_name, string_types) or \
+                not IsRfc1035Name(dep_name):
+            errors.Add('containers[%s].dependsOn[%d] is invalid: %s'
+                       % (ctr_name, dep_index, dep_name))
+            continue
+        if dep_name not in seen_names:
+            seen_names.add(dep_name)
+            all_names.append(dep_name)
+    return all_names
+
+
+def RegistryPort(image):
+    """Returns the port of the on-VM registry an image comes from, or
+    None."""
+    m = RE_LOCAL_REGISTRY_IMAGE.match(image)
+    if m is None:
+        return None
+    if m.group(2) is None:
+        return 80
+    return int(m.group(2)[1:])
+
+
+def AddRegistryDependencies(containers):
+    """Makes containers whose images come from a registry in this group
+    depend on the container serving that registry."""
+
+    by_host_port = {}
+    for ctr in containers:
+        for host_port, _, proto in ctr.ports:
+            if proto == ProtocolString(PROTOCOL_TCP):
+                by_host_port[host_port] = ctr.name
+
+    for ctr in containers:
+        registry = by_host_port.get(RegistryPort(ctr.image))
+        if registry is not None and registry != ctr.name and \
+                registry not in ctr.depends_on:
+            ctr.depends_on.append(registry)
+
+
+def CheckDependencies(containers, errors=FATAL_ERRORS):
+    """Fails unless every dependency names a container in the group, and
+    there are no cycles."""
+
+    names = set(ctr.name for ctr in containers)
+    for ctr in containers:
+        for dep_name in ctr.depends_on:
+            if dep_name not in names:
+                errors.Add('containers[%s].dependsOn is not a known '
+                           'container: %s' % (ctr.name, dep_name))
+    cycle = scheduler.FindCycle(
+        dict((ctr.name, [name for name in ctr.depends_on if name in names])
+             for ctr in containers))
+    if cycle is not None:
+        errors.Add('containers[%s].dependsOn has a cycle: %s'
+                   % (cycle[0], ' -> '.join(cycle)))
+
+
+def CheckGroupWideConflicts(containers, errors=FATAL_ERRORS):
     # TODO(thockin): we could put other uniqueness checks (e.g. name) here.
     # Make sure not two containers have conflicting host or container ports.
     host_ports = set()
@@ -353,141 +891,928 @@ def CheckGroupWideConflicts(containers):
         for port in ctr.ports:
             h = '%s%s' % (port[0], port[2])
             if h in host_ports:
-                Fatal('host port %s is not unique group-wide' % (h))
+                errors.Add('host port %s is not unique group-wide' % (h))
             host_ports.add(h)
             c = '%s%s' % (port[1], port[2])
             if c in ctr_ports:
-                Fatal('container port %s is not unique group-wide' % (c))
+                errors.Add('container port %s is not unique group-wide' % (c))
             ctr_ports.add(c)
 
 
-def FlagList(values, flag):
-    """Turns a list of values into a list of flags.
-
-    This takes a list of strings, and produces a new list with an extra string
-    ('flag') between each value.
+def ParallelMap(func, items, concurrency):
+    """Calls func on each item, using at most 'concurrency' threads.
 
     Args:
-      values: a list of strings
-      flag: a string
+      func: a callable taking one argument
+      items: a list of arguments for func
+      concurrency: the maximum number of concurrent calls
 
     Returns:
-      the expanded list of strings
+      the list of results, in the same order as items
 
-    Example:
-      FlagList(["a", "b", "c"], "-x") => ["-x", "a", "-x", "b", "-x", "c"]
+    If any call raises (including SystemExit from Fatal()), the first such
+    exception, in item order, is re-raised once all calls have finished.
 
     """
 
-    result = []
-    for v in values:
-        result.extend([flag, v])
-    return result
+    results = [None] * len(items)
+    errors = [None] * len(items)
+    work = queue.Queue()
+    for index in range(len(items)):
+        work.put(index)
 
+    def Worker():
+        while True:
+            try:
+                index = work.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[index] = func(items[index])
+            except BaseException as e:
+                errors[index] = e
 
-def FlagOrNothing(value, flag):
-    """Turns a value into a flag list iff value is not None."""
-    if value is not None:
-        return [flag, value]
-    return []
+    threads = [threading.Thread(target=Worker)
+               for _ in range(min(max(concurrency, 1), len(items)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
 
+    for e in errors:
+        if e is not None:
+            raise e
+    return results
 
-def RunContainers(containers):
-    # TODO(thockin): This does not remove containers which used to be in the
-    # config but are not any more.
-    for ctr in containers:
-        # Log and run the container, with a keepalive if needed.
-        # TODO(thockin): We would have a distinct log file per-group,
-        # but we only support one group.
-        LogInfo("starting container '%s'" % (ctr.name))
-
-        # Pull the image.  Retry for up to 30 seconds.
-        for pulls_left in range(9, -1, -1):
-            proc = subprocess.Popen(
-                [DOCKER_CMD, 'pull', ctr.image],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT)
-            o, _ = proc.communicate()
-            if proc.returncode == 0:
+
+def IsLocalRegistryImage(image):
+    return RE_LOCAL_REGISTRY_IMAGE.match(image) is not None
+
+
+def PullImage(backend, image):
+    """Pulls an image, retrying for up to 30 seconds.
+
+    Returns the number of seconds spent pulling, including retries.
+    """
+
+    start = time.time()
+    with tracing.Span('pull', image=image) as span:
+        for pulls_left in range(PULL_ATTEMPTS - 1, -1, -1):
+            attempt = PULL_ATTEMPTS - pulls_left
+            span.Set('attempts', attempt)
+            try:
+                with tracing.Span('pull_attempt', image=image,
+                                  attempt=attempt):
+                    backend.Pull(image)
                 break
-            else:
-                LogInfo(o)
+            except docker_backend.DockerError as e:
+                LogInfo(str(e))
                 if pulls_left == 0:
-                    Fatal('failed to pull %s' % (ctr.image))
+                    Fatal('failed to pull %s' % (image))
                 LogInfo('could not pull %s, will retry %d more time%s'
-                        % (ctr.image, pulls_left, 's'
-                           if pulls_left > 1 else ''))
-                time.sleep(3)
-
-        # Unilaterally destroy any extant container that is already running
-        # with the same name.
-        # TODO(thockin): If this was smart, it would actually check the config
-        # of the running container and leave it alone if it was correct.
-        subprocess.call(
-            [DOCKER_CMD, 'kill', ctr.name],
-            stdout=open('/dev/null', 'w'),
-            stderr=open('/dev/null', 'w'))
-        subprocess.call(
-            [DOCKER_CMD, 'rm', '-f', ctr.name],
-            stdout=open('/dev/null', 'w'),
-            stderr=open('/dev/null', 'w'))
-
-        proc = subprocess.Popen(
-            [DOCKER_CMD, 'run', '-d'] +
-            ['--name', ctr.name] +
-            FlagOrNothing(ctr.hostname, '--hostname') +
-            FlagOrNothing(ctr.working_dir, '--workdir') +
-            FlagOrNothing(ctr.network_from, '--net') +
-            FlagList(['%s:%s%s' % (p[0], p[1], p[2])
-                      for p in ctr.ports], '-p') +
-            FlagList(ctr.mounts, '-v') +
-            FlagList(ctr.env_vars, '-e') +
-            [ctr.image] +
-            ctr.command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT)
-        o, _ = proc.communicate()
-        if proc.returncode == 0:
-            ctr_id = o.strip()
+                        % (image, pulls_left, 's' if pulls_left > 1 else ''))
+                with tracing.Span('pull_retry_delay', image=image,
+                                  attempt=attempt):
+                    time.sleep(PULL_RETRY_DELAY)
+    seconds = time.time() - start
+    metrics.DOCKER_SECONDS.Observe(seconds, 'pull', image)
+    return seconds
+
+
+def PullImages(backend, images, concurrency=DEFAULT_PULL_CONCURRENCY,
+               cache=None):
+    """Pulls every distinct image, at most 'concurrency' at a time.
+
+    With an image_cache.ImageCache, a pull of an image that is already being
+    pulled waits for that pull rather than starting another.
+
+    Returns a dict of image -> seconds spent pulling it.
+    """
+
+    distinct = []
+    for image in images:
+        if image not in distinct:
+            distinct.append(image)
+
+    def Pull(image):
+        if cache is None:
+            return PullImage(backend, image)
+        return cache.Pull(image, lambda: PullImage(backend, image))
+
+    start = time.time()
+    timings = dict(zip(distinct, ParallelMap(Pull, distinct, concurrency)))
+    for image in distinct:
+        LogInfo('pulled %s in %.1fs' % (image, timings[image]))
+    if distinct:
+        LogInfo('pulled %d image%s in %.1fs'
+                % (len(distinct), 's' if len(distinct) > 1 else '',
+                   time.time() - start))
+    return timings
+
+
+def PullPolicies(containers):
+    """Returns a dict of image -> the strongest pull policy any of the
+    containers has for it."""
+    policies = {}
+    for ctr in containers:
+        policies[ctr.image] = image_cache.StrongerPullPolicy(
+            policies.get(ctr.image), ctr.image_pull_policy)
+    return policies
+
+
+def NetworkOwner(ctr):
+    """Returns the name of the container whose network ctr joins, or
+    None."""
+    owner = (ctr.network_from or '').partition('container:')[2]
+    return owner or None
+
+
+def StartupDependencies(ctr):
+    """Returns the names of the containers that must be running before ctr
+    is started."""
+    deps = list(ctr.depends_on)
+    owner = NetworkOwner(ctr)
+    if owner is not None and owner not in deps:
+        deps.append(owner)
+    return deps
+
+
+def RunContainers(backend, containers,
+                  pull_concurrency=DEFAULT_PULL_CONCURRENCY, cache=None,
+                  start_concurrency=DEFAULT_START_CONCURRENCY, pulled=None):
+    """Makes sure every container is running with its current config.
+
+    Each container is started as soon as the containers it depends on are
+    (see StartupDependencies), and independent ones are started
+    concurrently.
+
+    Args:
+      backend: a docker backend
+      containers: the list of Containers to run
+      pull_concurrency: how many images to pull at once
+      cache: an image_cache.ImageCache to share between calls
+      start_concurrency: how many containers to start at once
+      pulled: a dict of image -> seconds, of images already pulled for
+          these containers (see PrefetchImages); they are not pulled again
+
+    Returns a dict of container name -> container ID, for supervision.
+    """
+
+    if cache is None:
+        cache = image_cache.ImageCache(backend)
+
+    ImportInfraImage(backend, containers, cache)
+
+    # Pull everything that needs pulling up front, once per image, so that
+    # no container is started (or torn down) until its image is local.
+    # Images that come from a registry running inside this group are pulled
+    # just before their container runs.
+    policies = PullPolicies(containers)
+    pulled = dict(pulled or {})
+    pulled.update(PullImages(
+        backend,
+        [ctr.image for ctr in containers
+         if ctr.image not in pulled and
+         not IsLocalRegistryImage(ctr.image) and
+         cache.NeedsPull(ctr.image, policies[ctr.image])],
+        pull_concurrency, cache))
+
+    # Containers which used to be in the config but are not any more are
+    # left to ApplyContainers and the garbage_collector.
+    recreated = set()
+
+    def Start(ctr):
+        with tracing.Span('start_container', container=ctr.name,
+                          image=ctr.image) as span:
+            # Log and run the container.
+            # TODO(thockin): We would have a distinct log file per-group.
+            LogInfo("starting container '%s'" % (ctr.name))
+
+            if (ctr.image not in pulled and
+                    cache.NeedsPull(ctr.image, policies[ctr.image])):
+                pulled[ctr.image] = cache.Pull(
+                    ctr.image, lambda: PullImage(backend, ctr.image))
+            image_id = cache.ImageId(ctr.image)
+            if image_id is None and \
+                    ctr.image_pull_policy == image_cache.PULL_NEVER:
+                Fatal("image %s for container '%s' is not present, and its "
+                      'imagePullPolicy is Never' % (ctr.image, ctr.name))
+
+            # Leave a running container alone if it was started from exactly
+            # this config and image, and the namespace it joins was not just
+            # recreated underneath it.
+            fingerprint = reconcile.Fingerprint(ctr, image_id)
+            ctr.labels[reconcile.FINGERPRINT_LABEL] = fingerprint
+            info = backend.Inspect(ctr.name)
+            if (NetworkOwner(ctr) not in recreated and
+                    reconcile.IsUpToDate(info, fingerprint)):
+                LogInfo("container '%s' is up to date, leaving it alone"
+                        % (ctr.name))
+                span.Set('up_to_date', True)
+                return info['Id']
+            recreated.add(ctr.name)
+
+            # Destroy any extant container that is already running with the
+            # same name.
+            with metrics.DOCKER_SECONDS.Time('kill', ctr.image):
+                backend.Kill(ctr.name)
+            with metrics.DOCKER_SECONDS.Time('rm', ctr.image):
+                backend.Remove(ctr.name)
+
+            try:
+                with metrics.DOCKER_SECONDS.Time('run', ctr.image):
+                    return backend.Run(ctr)
+            except docker_backend.DockerError as e:
+                LogInfo(str(e))
+                Fatal("failed to run container '%s'" % (ctr.name))
+
+    # Dependencies on containers outside this batch are already running.
+    by_name = dict((ctr.name, ctr) for ctr in containers)
+    deps = dict((ctr, [by_name[name] for name in StartupDependencies(ctr)
+                       if name in by_name])
+                for ctr in containers)
+    ctr_ids = scheduler.RunGraph(Start, containers, deps, start_concurrency)
+    return dict(zip([ctr.name for ctr in containers], ctr_ids))
+
+
+def PrefetchImages(backend, containers, changed,
+                   concurrency=DEFAULT_PULL_CONCURRENCY, cache=None):
+    """Pulls the images of containers that are about to be (re)created,
+    while the containers they replace are still running.
+
+    An image from a registry served by a container in this group is pulled
+    only if that container is not itself about to be recreated.
+
+    Args:
+      backend: a docker backend
+      containers: the Containers about to be (re)created
+      changed: the names of every container about to be (re)created
+      concurrency: how many images to pull at once
+      cache: an image_cache.ImageCache
+
+    Returns a dict of image -> seconds spent pulling it.
+    """
+
+    if cache is None:
+        cache = image_cache.ImageCache(backend)
+    policies = PullPolicies(containers)
+    images = [ctr.image for ctr in containers
+              if (not IsLocalRegistryImage(ctr.image) or
+                  not changed.intersection(ctr.depends_on)) and
+              cache.NeedsPull(ctr.image, policies[ctr.image])]
+    with tracing.Span('prefetch', images=len(set(images))):
+        return PullImages(backend, images, concurrency, cache)
+
+
+def ImportInfraImage(backend, containers, cache):
+    """Makes sure the image of the infrastructure containers is local,
+    importing it if need be; it is never pulled."""
+    if (not any(ctr.image == pause_image.IMAGE for ctr in containers) or
+            cache.ImageId(pause_image.IMAGE) is not None):
+        return
+    try:
+        pause_image.Import(backend)
+    except docker_backend.DockerError as e:
+        LogInfo(str(e))
+        Fatal('failed to import %s' % (pause_image.IMAGE))
+    cache.Invalidate(pause_image.IMAGE)
+
+
+def MountVolumes(containers, mounter=None):
+    """Mounts the tmpfs volumes of containers about to be run."""
+    if mounter is None:
+        mounter = volumes.TmpfsMounter(VOLUMES_ROOT_DIR)
+    try:
+        mounter.SetUp(containers)
+    except volumes.VolumeError as e:
+        Fatal('could not set up volumes: %s' % (e))
+
+
+def NetworkJoiners(containers, name):
+    """Returns the names of the containers that join name's network."""
+    return [ctr.name for ctr in containers if NetworkOwner(ctr) == name]
+
+
+def ApplyContainers(backend, keeper, applied, containers,
+                    pull_concurrency=DEFAULT_PULL_CONCURRENCY, cache=None,
+                    start_concurrency=DEFAULT_START_CONCURRENCY, engine=None,
+                    collector=None):
+    """Changes the running group from 'applied' to 'containers'.
+
+    Only containers that were added, removed or changed are touched, and
+    those whose image was replaced by a pull this apply made.
+
+    Args:
+      backend: a docker backend
+      keeper: the supervisor.Supervisor watching the group
+      applied: a dict of name -> Container, as last applied
+      containers: the list of Containers to apply
+      pull_concurrency: how many images to pull at once
+      cache: an image_cache.ImageCache to share between calls
+      start_concurrency: how many containers to start at once
+      engine: an async_engine.Engine to start containers with, in place of
+          RunContainers
+      collector: a log_collector.LogCollector for the output of containers
+          that ask for it
+
+    Returns:
+      a dict of name -> Container, to pass as 'applied' next time
+    """
+
+    if cache is None:
+        cache = image_cache.ImageCache(backend)
+    wanted = dict((ctr.name, ctr) for ctr in containers)
+    running = keeper.Watched()
+
+    # Containers the supervisor lost track of are checked again, too.
+    changed = set()
+    for ctr in containers:
+        old = applied.get(ctr.name)
+        if (old is None or ctr.name not in running or
+                reconcile.Fingerprint(old, None) !=
+                reconcile.Fingerprint(ctr, None)):
+            changed.add(ctr.name)
+    # Anything in the network namespace of a changed container has to
+    # follow it into the new one.
+    for name in list(changed):
+        changed.update(NetworkJoiners(containers, name))
+
+    to_run = [ctr for ctr in containers if ctr.name in changed]
+
+    # The old containers keep serving until every new image is local.
+    pulled = PrefetchImages(backend, to_run, changed, pull_concurrency, cache)
+
+    # A container left alone whose image was just pulled for another one
+    # follows it onto the new image, if the pull brought one.
+    renewed = [ctr.name for ctr in containers
+               if ctr.name not in changed and ctr.image in pulled and
+               not reconcile.IsUpToDate(
+                   backend.Inspect(ctr.name),
+                   reconcile.Fingerprint(ctr, cache.ImageId(ctr.image)))]
+    for name in renewed:
+        LogInfo("container '%s' runs an old %s; recreating it"
+                % (name, wanted[name].image))
+        changed.add(name)
+        changed.update(NetworkJoiners(containers, name))
+    to_run = [ctr for ctr in containers if ctr.name in changed]
+
+    for name in sorted(set(applied) - set(wanted)):
+        LogInfo("removing container '%s'" % (name))
+        if name in running:
+            keeper.Unwatch(running[name])
+        if collector is not None:
+            collector.Unwatch(name)
+        with metrics.DOCKER_SECONDS.Time('kill', applied[name].image):
+            backend.Kill(name)
+        with metrics.DOCKER_SECONDS.Time('rm', applied[name].image):
+            backend.Remove(name)
+
+    for ctr in to_run:
+        if ctr.name in running:
+            keeper.Unwatch(running[ctr.name])
+    MountVolumes(containers)
+    if engine is None:
+        ctr_ids = RunContainers(backend, to_run, pull_concurrency, cache,
+                                start_concurrency, pulled)
+    else:
+        ctr_ids = engine.RunContainers(to_run, pull_concurrency, cache,
+                                       start_concurrency, pulled)
+
+    for ctr in containers:
+        if ctr.name in ctr_ids:
+            keeper.Watch(ctr.name, ctr_ids[ctr.name], ctr.restart_policy,
+                         ctr.labels.get(reconcile.FINGERPRINT_LABEL))
+        elif applied[ctr.name].restart_policy != ctr.restart_policy:
+            # Only the restart policy changed; the container can stay, with
+            # its restart history.
+            keeper.ChangePolicy(running[ctr.name], ctr.restart_policy)
+            ctr.labels = applied[ctr.name].labels
+        if collector is None:
+            continue
+        if ctr.log_config is None:
+            collector.Unwatch(ctr.name)
         else:
-            LogInfo(o)
-            Fatal("failed to run container '%s'" % (ctr.name))
+            collector.Watch(ctr.name,
+                            ctr_ids.get(ctr.name) or running[ctr.name],
+                            ctr.log_config)
+
+    LogInfo('applied manifest: %d changed, %d removed, %d unchanged'
+            % (len(to_run), len(set(applied) - set(wanted)),
+               len(containers) - len(to_run)))
+    metrics.LAST_APPLY.Set(time.time())
+    return wanted
 
-        os.system(KEEPALIVE_SCRIPT %
-                  {'docker': DOCKER_CMD, 'log': LOG_CMD,
-                   'name': ctr.name, 'id': ctr_id})
 
+def AdoptContainers(backend, keeper, containers, records):
+    """Takes over the containers a previous run of the agent left running.
 
-def CheckVersion(config):
+    A container is adopted if its record matches its config, and it is
+    still running with the same fingerprint; the keeper supervises it again,
+    carrying on from its recorded restart history.  A container joining the
+    network of one that was not adopted is not adopted either, since it must
+    follow that one into its new network.
+
+    Args:
+      backend: a docker backend
+      keeper: the supervisor.Supervisor to watch adopted containers
+      containers: the list of Containers to run
+      records: a dict of name -> record, from agent_state.StateFile.Load()
+
+    Returns:
+      a dict of name -> Container, for the containers adopted
+    """
+
+    adopted = {}
+    for ctr in containers:
+        record = records.get(ctr.name)
+        if record is None:
+            continue
+        info = backend.Inspect(record['id'])
+        if info is None:
+            continue
+        fingerprint = reconcile.Fingerprint(ctr, info.get('Image'))
+        if (fingerprint != record['fingerprint'] or
+                not reconcile.IsUpToDate(info, fingerprint)):
+            continue
+        ctr.labels[reconcile.FINGERPRINT_LABEL] = fingerprint
+        adopted[ctr.name] = (ctr, info['Id'], record)
+
+    # Drop joiners of networks that are about to be recreated, until none
+    # are left.
+    dropped = True
+    while dropped:
+        dropped = False
+        for name, (ctr, _, _) in list(adopted.items()):
+            owner = NetworkOwner(ctr)
+            if owner is not None and owner not in adopted:
+                del adopted[name]
+                dropped = True
+
+    for name, (ctr, ctr_id, record) in sorted(adopted.items()):
+        LogInfo("adopting container '%s' (%s)" % (name, ctr_id))
+        keeper.Watch(name, ctr_id, ctr.restart_policy,
+                     ctr.labels[reconcile.FINGERPRINT_LABEL],
+                     restart_policy.RestartState.FromDict(
+                         ctr.restart_policy, record['restart']))
+    return dict((name, ctr) for name, (ctr, _, _) in adopted.items())
+
+
+def CheckVersion(config, errors=FATAL_ERRORS):
     if 'version' not in config:
-        Fatal('config has no version field')
-    if config['version'] not in SUPPORTED_CONFIG_VERSIONS:
-        Fatal("config version '%s' is not supported" % config['version'])
+        errors.Add('config has no version field')
+    elif config['version'] not in SUPPORTED_CONFIG_VERSIONS:
+        errors.Add("config version '%s' is not supported"
+                   % config['version'])
+
+
+def LoadGroup(group_spec, errors=FATAL_ERRORS, group=None):
+    """Process the "containers", "volumes" and "hostNetwork" of a group and
+    return the list of containers to run, infrastructure containers (if
+    any) first."""
+
+    prefix = '' if group is None else 'groups[%s].' % (group)
+    volumes_spec = LoadList(group_spec.get('volumes'), prefix + 'volumes',
+                            errors)
+    all_volumes = LoadVolumes(volumes_spec, errors)
+    sources = LoadVolumeSources(volumes_spec, errors)
+    user_containers = LoadUserContainers(
+        LoadList(group_spec.get('containers'), prefix + 'containers',
+                 errors),
+        all_volumes, errors, group, sources)
+    CheckGroupWideConflicts(user_containers, errors)
+
+    if not user_containers:
+        return []
+    if LoadHostNetwork(group_spec, errors, group):
+        return UseHostNetwork(user_containers, errors)
+    return LoadInfraContainers(user_containers, group) + user_containers
+
+
+def LoadGroups(groups_spec, errors=FATAL_ERRORS):
+    """Process a "groups" block of config and return the list of containers
+    to run, each group's infrastructure containers first."""
+
+    all_ctrs = []
+    all_group_names = set()
+    for group_index, group_spec in enumerate(groups_spec):
+        if not IsDict(group_spec, 'groups[%d]' % (group_index), errors):
+            continue
+        if 'name' not in group_spec:
+            errors.Add('groups[%d] has no name' % (group_index))
+            continue
+        group_name = group_spec['name']
+        if not IsRfc1035Name(group_name):
+            errors.Add('groups[%d].name is invalid: %s'
+                       % (group_index, group_name))
+            continue
+        if group_name in all_group_names:
+            errors.Add('groups[%d].name is not unique: %s'
+                       % (group_index, group_name))
+            continue
+        all_group_names.add(group_name)
+        all_ctrs.extend(LoadGroup(group_spec, errors, group_name))
+
+    # Every group has a network namespace of its own, but they all share the
+    # VM's ports.
+    host_ports = {}
+    for ctr in all_ctrs:
+        for port in ctr.ports:
+            h = '%s%s' % (port[0], port[2])
+            if h in host_ports and host_ports[h] != ctr.group:
+                errors.Add('host port %s is not unique VM-wide: it is used '
+                           'by groups %s and %s'
+                           % (h, host_ports[h], ctr.group))
+            host_ports[h] = ctr.group
 
+    return all_ctrs
 
-def main():
-    if len(sys.argv) > 2:
-        Fatal('usage: %s [containers.yaml]' % sys.argv[0])
 
-    if len(sys.argv) == 2:
-        with open(sys.argv[1], 'r') as fp:
-            config = yaml.load(fp)
-    else:
-        config = yaml.load(sys.stdin)
+def LoadConfig(config, errors=FATAL_ERRORS):
+    """Validates a parsed manifest and returns the list of containers to run,
+    infrastructure containers first."""
+
+    CheckVersion(config, errors)
+
+    if 'groups' not in config:
+        return LoadGroup(config, errors)
+    if 'containers' in config or 'volumes' in config:
+        errors.Add('config has groups, so it cannot have containers or '
+                   'volumes outside them')
+    if 'hostNetwork' in config:
+        errors.Add('config has groups, so hostNetwork must be set on each '
+                   'group')
+    return LoadGroups(LoadList(config['groups'], 'groups', errors), errors)
+
+
+def ValidateConfig(config):
+    """Validates a parsed manifest, finding every error rather than exiting
+    at the first.
+
+    Returns a validation.ValidationResult.
+    """
+    errors = validation.ErrorList()
+    containers = LoadConfig(config, errors)
+    if errors.errors:
+        containers = []
+    return validation.ValidationResult(containers, errors.errors)
+
+
+def ParseManifest(text):
+    """Parses manifest text, as JSON if it looks like JSON, else as YAML.
+
+    Raises yaml.YAMLError if it is neither.
+    """
+    with tracing.Span('parse_manifest', size=len(text)):
+        return _ParseManifest(text)
+
 
-    syslog.openlog(PROGNAME)
-    LogInfo('processing container manifest')
+def _ParseManifest(text):
+    if text.lstrip().startswith('{'):
+        try:
+            return json.loads(text)
+        except ValueError:
+            # Could still be a YAML flow mapping.
+            pass
+    return yaml.load(text, Loader=YAML_LOADER)
 
-    CheckVersion(config)
 
-    all_volumes = LoadVolumes(config.get('volumes', []))
-    user_containers = LoadUserContainers(config.get('containers', []),
-                                         all_volumes)
-    CheckGroupWideConflicts(user_containers)
+def ValidateManifest(text):
+    """Parses and validates manifest text (JSON or YAML).
+
+    Returns a validation.ValidationResult.
+    """
+    start = time.time()
+    with tracing.Span('validate_manifest') as span:
+        result = _ValidateManifest(text)
+        span.Set('errors', len(result.errors))
+    metrics.VALIDATION_SECONDS.Observe(
+        time.time() - start, 'valid' if result.IsValid() else 'invalid')
+    return result
+
+
+def _ValidateManifest(text):
+    try:
+        config = ParseManifest(text)
+    except yaml.YAMLError as e:
+        return validation.ValidationResult(
+            [], ['manifest is not valid YAML or JSON: %s' % (e)])
+    if not isinstance(config, dict):
+        return validation.ValidationResult(
+            [], ['manifest is not a YAML or JSON object'])
+    return ValidateConfig(config)
+
+
+def LoadManifest(text, plans=None):
+    """Parses and validates manifest text (JSON or YAML).
+
+    Every error in the manifest is reported before exiting.
+
+    Args:
+      text: the manifest
+      plans: a plan_cache.PlanCache; a manifest with a plan there is neither
+          parsed nor validated again
+
+    Returns:
+      the list of containers to run, infrastructure containers first
+    """
+    with tracing.Span('load_manifest') as span:
+        return _LoadManifest(text, plans, span)
+
+
+def _LoadManifest(text, plans, span):
+    if plans is not None:
+        plan = plans.Get(text)
+        span.Set('cached', plan is not None)
+        if plan is not None:
+            try:
+                return [Container.FromDict(d) for d in plan]
+            except (KeyError, TypeError, ValueError) as e:
+                LogError('ignoring unusable plan: %s' % (e))
+
+    result = ValidateManifest(text)
+    if not result.IsValid():
+        for error in result.errors:
+            sys.stderr.write('ERROR: %s\n' % (error))
+            LogError(error)
+        Fatal('manifest has %d error%s'
+              % (len(result.errors), 's' if len(result.errors) > 1 else ''))
+
+    if plans is not None:
+        plans.Put(text, [ctr.ToDict() for ctr in result.containers])
+    return result.containers
+
+
+def ParseArgs(argv):
+    parser = argparse.ArgumentParser(prog=PROGNAME)
+    parser.add_argument('manifest', nargs='?',
+                        help='the manifest to run (default: stdin)')
+    parser.add_argument('--pull-concurrency', type=int,
+                        default=DEFAULT_PULL_CONCURRENCY,
+                        help='how many images to pull at once')
+    parser.add_argument('--start-concurrency', type=int,
+                        default=DEFAULT_START_CONCURRENCY,
+                        help='how many containers to start at once')
+    parser.add_argument('--engine', choices=VALID_ENGINES,
+                        default=ENGINE_THREADS,
+                        help='how to run docker operations while applying: '
+                        'from threads, or from an asyncio event loop with a '
+                        'timeout on each (Python 3 only)')
+    parser.add_argument('--docker-backend',
+                        choices=docker_backend.VALID_BACKENDS,
+                        default=docker_backend.BACKEND_AUTO,
+                        help='how to talk to docker: the Remote API on '
+                        'its unix socket, or the docker CLI (default: the '
+                        'API if the socket exists)')
+    parser.add_argument('--metadata', action='store_true',
+                        help='read the manifest from the %s attribute in '
+                        'the GCE metadata server' % (
+                            metadata.MANIFEST_PATH.rpartition('/')[2]))
+    parser.add_argument('--metadata-host', default=metadata.METADATA_HOST,
+                        help='the metadata server, as host[:port]')
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep running, and apply the manifest again '
+                        'whenever it changes or on SIGHUP')
+    parser.add_argument('--plan-cache-dir',
+                        default=plan_cache.DEFAULT_CACHE_DIR,
+                        help='where to keep the containers each manifest '
+                        'compiles to, so that a manifest seen before is not '
+                        'parsed again; empty to disable')
+    parser.add_argument('--metrics-address', default='',
+                        help='serve Prometheus metrics on /metrics at '
+                        'this [host]:port (default: do not serve them)')
+    parser.add_argument('--trace-file',
+                        help='append a trace of every apply here, one JSON '
+                        'span per line: parsing, validation, each pull '
+                        'attempt and each docker call, with their timings')
+    parser.add_argument('--status-file',
+                        help='keep a JSON description of every supervised '
+                        'container, including its restart state, here')
+    parser.add_argument('--state-file',
+                        default=agent_state.DEFAULT_STATE_PATH,
+                        help='where to remember the supervised containers, '
+                        'so that a restarted agent adopts those still '
+                        'running rather than recreating them; empty to '
+                        'disable')
+    parser.add_argument('--docker-root',
+                        default=garbage_collector.DEFAULT_DOCKER_ROOT,
+                        help='where docker keeps its images, to watch the '
+                        'disk usage of')
+    parser.add_argument('--image-gc-high-water', type=int,
+                        default=garbage_collector.DEFAULT_HIGH_WATER,
+                        help='remove unused images, least recently used '
+                        'first, once the docker root is this full (percent)')
+    parser.add_argument('--image-gc-low-water', type=int,
+                        default=garbage_collector.DEFAULT_LOW_WATER,
+                        help='stop removing images once the docker root is '
+                        'this full (percent)')
+    parser.add_argument('--cpu-placement',
+                        choices=placement.VALID_PLACEMENTS,
+                        default=placement.PLACEMENT_NONE,
+                        help='how to pin containers that ask for cpuShares '
+                        'but name no cpuset: not at all, or spread over the '
+                        'least loaded cores')
+    parser.add_argument('--container-log-dir',
+                        default=log_collector.DEFAULT_LOG_DIR,
+                        help='where to keep the output of containers with a '
+                        'logs section, one directory per container')
+    args = parser.parse_args(argv)
+    if args.pull_concurrency < 1:
+        parser.error('--pull-concurrency must be at least 1')
+    if args.start_concurrency < 1:
+        parser.error('--start-concurrency must be at least 1')
+    if args.metadata and args.manifest is not None:
+        parser.error('--metadata and a manifest file are exclusive')
+    if args.daemon and args.manifest is None and not args.metadata:
+        parser.error('--daemon needs a manifest file or --metadata')
+    if not 0 <= args.image_gc_low_water <= args.image_gc_high_water <= 100:
+        parser.error('--image-gc-low-water must be between 0 and '
+                     '--image-gc-high-water, which must be at most 100')
+    if args.metrics_address and \
+            not args.metrics_address.rpartition(':')[2].isdigit():
+        parser.error('--metrics-address must be [host]:port')
+    return args
+
+
+def NewMetadataClient(args):
+    host, _, port = args.metadata_host.partition(':')
+    return metadata.MetadataClient(host, int(port or metadata.METADATA_PORT))
+
+
+def StartMetricsServer(args):
+    """Serves /metrics if --metrics-address says where."""
+    if not args.metrics_address:
+        return None
+    host, _, port = args.metrics_address.rpartition(':')
+    try:
+        server = metrics.MetricsServer(host, int(port)).Start()
+    except (IOError, OSError) as e:
+        Fatal('could not serve metrics on %s: %s' % (args.metrics_address, e))
+    LogInfo('serving metrics on %s' % (args.metrics_address))
+    return server
+
+
+def NewEngine(args):
+    """Returns the async_engine.Engine that --engine asks for, or None."""
+    if args.engine == ENGINE_THREADS:
+        return None
+    try:
+        from container_agent import async_engine
+    except (ImportError, SyntaxError):
+        Fatal('--engine %s needs Python 3' % (args.engine))
+    return async_engine.Engine(async_engine.NewBackend(
+        args.docker_backend, DOCKER_CMD))
+
+
+def PlaceContainers(args, containers):
+    """Pins containers to cores as --cpu-placement says."""
+    if args.cpu_placement == placement.PLACEMENT_SPREAD:
+        placement.Spread(containers, placement.NumCpus())
+    return containers
+
+
+def NewGarbageCollector(args, backend, cache):
+    return garbage_collector.GarbageCollector(
+        backend, cache, args.docker_root, args.image_gc_high_water,
+        args.image_gc_low_water, args.start_concurrency)
+
+
+def NewStateFile(args):
+    if not args.state_file:
+        return None
+    return agent_state.StateFile(args.state_file)
+
+
+def LoadRecords(state_file):
+    """Returns what the last run of the agent left in its state file."""
+    if state_file is None:
+        return {}
+    return state_file.Load()
+
+
+def NewPlanCache(args):
+    if not args.plan_cache_dir:
+        return None
+    return plan_cache.PlanCache(args.plan_cache_dir)
+
+
+def RunDaemon(args, backend, keeper, cache, engine=None, collector=None,
+              records=None, gc=None):
+    """Applies the manifest, and every change to it, forever."""
+
+    if args.metadata:
+        try:
+            source = metadata.MetadataSource(NewMetadataClient(args)).Start()
+        except metadata.MetadataError as e:
+            Fatal('could not fetch the manifest: %s' % (e))
+    else:
+        source = daemon.ManifestFile(args.manifest)
+
+    # The supervisor gets its own thread; this one waits for changes.
+    supervising = threading.Thread(target=keeper.Run)
+    supervising.daemon = True
+    supervising.start()
+
+    state = {'applied': {}, 'records': records or {}}
+
+    def Apply(containers):
+        if state['records']:
+            # The first manifest may have been running all along.
+            state['applied'] = AdoptContainers(backend, keeper, containers,
+                                               state['records'])
+            state['records'] = None
+        try:
+            state['applied'] = ApplyContainers(
+                backend, keeper, state['applied'], containers,
+                args.pull_concurrency, cache, args.start_concurrency, engine,
+                collector)
+        except SystemExit:
+            LogError('failed to apply the new manifest; will try again on '
+                     'the next change or SIGHUP')
+            return
+        if gc is not None:
+            gc.Collect(containers, keeper)
+
+    plans = NewPlanCache(args)
+    watcher = daemon.Daemon(
+        source,
+        lambda text: PlaceContainers(args, LoadManifest(text, plans)),
+        Apply)
+    signal.signal(signal.SIGHUP, lambda signum, frame: watcher.Wake())
+    watcher.Run()
+
+
+def ReadManifest(args):
+    """Returns the text of the manifest, from wherever args say."""
+    if args.metadata:
+        try:
+            _, text = NewMetadataClient(args).Fetch()
+        except metadata.MetadataError as e:
+            Fatal('could not fetch the manifest: %s' % (e))
+        if text is None:
+            Fatal('there is no manifest in the metadata server')
+        return text
+    if args.manifest is not None:
+        with open(args.manifest, 'r') as fp:
+            return fp.read()
+    return sys.stdin.read()
+
+
+def main():
+    args = ParseArgs(sys.argv[1:])
+
+    agent_log.Open(PROGNAME)
+    if args.trace_file:
+        try:
+            tracing.TRACER.Open(args.trace_file)
+        except (IOError, OSError) as e:
+            Fatal('could not open the trace file: %s' % (e))
+    backend = docker_backend.NewBackend(args.docker_backend, DOCKER_CMD)
+    state_file = NewStateFile(args)
+    keeper = supervisor.Supervisor(backend, status_path=args.status_file,
+                                   state_file=state_file)
+    records = LoadRecords(state_file)
+    cache = image_cache.ImageCache(backend)
+    StartMetricsServer(args)
+
+    engine = NewEngine(args)
+    collector = log_collector.LogCollector(backend, args.container_log_dir)
+
+    if args.daemon:
+        RunDaemon(args, backend, keeper, cache, engine, collector, records,
+                  NewGarbageCollector(args, backend, cache))
+        return
+
+    # Everything up to supervision is one trace.
+    with tracing.Span('main'):
+        text = ReadManifest(args)
+        LogInfo('processing container manifest')
+        containers = PlaceContainers(
+            args, LoadManifest(text, NewPlanCache(args)))
+        adopted = AdoptContainers(backend, keeper, containers, records)
+        to_run = [ctr for ctr in containers if ctr.name not in adopted]
+        MountVolumes(containers)
+        if to_run and engine is not None:
+            ctr_ids = engine.RunContainers(to_run, args.pull_concurrency,
+                                           cache, args.start_concurrency)
+            engine.Close()
+        elif to_run:
+            ctr_ids = RunContainers(backend, to_run, args.pull_concurrency,
+                                    cache, args.start_concurrency)
+        if containers:
+            metrics.LAST_APPLY.Set(time.time())
+
+    if containers:
+        # Keep everything running from here on.
+        for ctr in to_run:
+            keeper.Watch(ctr.name, ctr_ids[ctr.name], ctr.restart_policy,
+                         ctr.labels.get(reconcile.FINGERPRINT_LABEL))
+        ctr_ids = keeper.Watched()
+        for ctr in containers:
+            if ctr.log_config is not None:
+                collector.Watch(ctr.name, ctr_ids[ctr.name], ctr.log_config)
+        NewGarbageCollector(args, backend, cache).Collect(containers, keeper)
+        keeper.Run()
 
-    if user_containers:
-        infra_containers = LoadInfraContainers(user_containers)
-        RunContainers(infra_containers + user_containers)
 
 if __name__ == '__main__':
     main()
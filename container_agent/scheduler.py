@@ -0,0 +1,146 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run a set of dependent steps, each as soon as it can be.
+
+The agent uses this to start a group: every container waits only for the
+containers it depends on (the .net container whose network it joins, the
+ones named in its dependsOn, and the registry its image comes from), and
+everything else starts at the same time.  Starting a group then takes as
+long as its longest chain of dependencies, not as long as all of it.
+"""
+
+import collections
+import threading
+
+
+def FindCycle(deps):
+    """Finds a dependency cycle.
+
+    Args:
+      deps: a dict of item -> the items it depends on
+
+    Returns:
+      a list of items [a, b, ..., a] where each depends on the next, or None
+      if there is no cycle.  Dependencies on items that are not keys of deps
+      are ignored.
+    """
+
+    done = set()
+    for root in deps:
+        if root in done:
+            continue
+        path = [root]
+        on_path = set(path)
+        stack = [iter(deps[root])]
+        while stack:
+            for dep in stack[-1]:
+                if dep in on_path:
+                    return path[path.index(dep):] + [dep]
+                if dep in deps and dep not in done:
+                    path.append(dep)
+                    on_path.add(dep)
+                    stack.append(iter(deps[dep]))
+                    break
+            else:
+                stack.pop()
+                done.add(path[-1])
+                on_path.discard(path.pop())
+    return None
+
+
+def RunGraph(func, items, deps, concurrency):
+    """Calls func on each item once everything it depends on is done.
+
+    Args:
+      func: a callable taking one argument
+      items: a list of arguments for func
+      deps: a dict of item -> the items it depends on; dependencies on
+          anything not in items are taken to be satisfied already
+      concurrency: the maximum number of concurrent calls
+
+    Returns:
+      the list of results, in the same order as items
+
+    Raises:
+      ValueError: if the dependencies have a cycle
+
+    An item whose dependency raised is not run at all.  As with
+    run_containers.ParallelMap, the first exception, in item order, is
+    re-raised once all calls have finished.
+    """
+
+    cycle = FindCycle(dict((item, deps.get(item, ())) for item in items))
+    if cycle is not None:
+        raise ValueError('dependency cycle: %s'
+                         % (' -> '.join(map(str, cycle))))
+
+    index = dict((item, i) for i, item in enumerate(items))
+    waiting = [set() for _ in items]      # index -> unfinished dependencies
+    dependents = [[] for _ in items]      # index -> indexes waiting on it
+    for i, item in enumerate(items):
+        for dep in deps.get(item, ()):
+            if dep in index:
+                waiting[i].add(index[dep])
+                dependents[index[dep]].append(i)
+
+    results = [None] * len(items)
+    errors = [None] * len(items)
+    ready = collections.deque(i for i in range(len(items)) if not waiting[i])
+    skipped = set()
+    state = {'running': 0}
+    cond = threading.Condition()
+
+    def Skip(i):
+        # Everything downstream of a failure is abandoned.
+        for j in dependents[i]:
+            if j not in skipped:
+                skipped.add(j)
+                Skip(j)
+
+    def Worker():
+        while True:
+            with cond:
+                while not ready:
+                    if not state['running']:
+                        return
+                    cond.wait()
+                i = ready.popleft()
+                state['running'] += 1
+            try:
+                results[i] = func(items[i])
+            except BaseException as e:
+                errors[i] = e
+            with cond:
+                state['running'] -= 1
+                if errors[i] is not None:
+                    Skip(i)
+                else:
+                    for j in dependents[i]:
+                        waiting[j].discard(i)
+                        if not waiting[j] and j not in skipped:
+                            ready.append(j)
+                cond.notify_all()
+
+    threads = [threading.Thread(target=Worker)
+               for _ in range(min(max(concurrency, 1), len(items)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for e in errors:
+        if e is not None:
+            raise e
+    return results
@@ -0,0 +1,369 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Keep the agent's containers running, from a single place.
+
+One Supervisor watches every container the agent started.  A reader thread
+follows the Docker events stream and hands events to the supervisor's loop,
+which restarts containers that die, as their restart policies allow (see
+restart_policy.py).  Neither the number of threads nor the number of processes
+grows with the number of containers.
+
+The supervisor can keep a JSON status file describing every container it
+watches, including whether it is crash-looping, and a state file from which
+the next run of the agent adopts them (see agent_state.py).
+"""
+
+import heapq
+import json
+import os
+import threading
+import time
+
+from container_agent import docker_backend
+from container_agent import metrics
+from container_agent import restart_policy
+from container_agent.agent_log import LogError
+from container_agent.agent_log import LogInfo
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+# Seconds between losing the events stream and reconnecting.
+RECONNECT_DELAY = 1
+
+# Sent through the inbox in place of an event.
+_RESYNC = object()
+
+
+class _Recheck(object):
+
+    """Sent through the inbox to have Recheck() look at one container."""
+
+    def __init__(self, ctr_id):
+        self.ctr_id = ctr_id
+
+
+class Supervisor(object):
+
+    """Restarts watched containers when they exit.
+
+    Watch() and Unwatch() may be called from other threads while Run() is
+    going.
+    """
+
+    def __init__(self, backend, backoff=None, status_path=None,
+                 state_file=None):
+        self.backend = backend
+        self.backoff = backoff or restart_policy.Backoff()
+        self.status_path = status_path
+        self.state_file = state_file  # agent_state.StateFile, or None
+        self.saved_records = None
+        self.names = {}             # container ID -> name
+        self.states = {}            # container ID -> RestartState
+        self.fingerprints = {}      # container ID -> fingerprint, or None
+        self.pending = []           # heap of (when, container ID)
+        self.inbox = queue.Queue()  # events, or _RESYNC
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def Watch(self, name, ctr_id, policy=None, fingerprint=None,
+              restart_state=None):
+        """Starts supervising a container.
+
+        Args:
+          name: the container's name
+          ctr_id: the container's ID
+          policy: its restart_policy.RestartPolicy
+          fingerprint: the fingerprint it was started with, for the state
+              file
+          restart_state: the restart_policy.RestartState to carry on from,
+              for an adopted container
+        """
+        state = restart_state or restart_policy.RestartState(
+            policy or restart_policy.RestartPolicy(), time.time())
+        with self.lock:
+            self.names[ctr_id] = name
+            self.states[ctr_id] = state
+            self.fingerprints[ctr_id] = fingerprint
+        LogInfo("supervising container '%s' (%s)" % (name, ctr_id))
+        # Have the loop save the state file.
+        self.inbox.put(None)
+
+    def ChangePolicy(self, ctr_id, policy):
+        """Gives a watched container a new restart policy, keeping its
+        restart history; the loop then rechecks it, in case it is down."""
+        with self.lock:
+            state = self.states.get(ctr_id)
+            if state is None:
+                return
+            state.policy = policy
+        self.inbox.put(_Recheck(ctr_id))
+
+    def Recheck(self, ctr_id):
+        """Handles a container that is down, but has no restart pending
+        (as after a restart policy that said not to), as if it had just
+        exited."""
+        with self.lock:
+            state = self.states.get(ctr_id)
+        if state is None or state.next_restart is not None:
+            return
+        info = self.backend.Inspect(ctr_id)
+        if info is None:
+            self._Forget(ctr_id)
+        elif not info['State']['Running']:
+            self._OnExit(ctr_id, info['State'].get('ExitCode'), time.time())
+
+    def Unwatch(self, ctr_id):
+        with self.lock:
+            self.states.pop(ctr_id, None)
+            self.fingerprints.pop(ctr_id, None)
+            name = self.names.pop(ctr_id, None)
+        if name is not None:
+            metrics.RESTARTS.Remove(name)
+        self.inbox.put(None)
+        return name
+
+    def Watched(self):
+        """Returns a dict of name -> container ID."""
+        with self.lock:
+            return dict((name, ctr_id)
+                        for ctr_id, name in self.names.items())
+
+    def _Lookup(self, ctr_id):
+        """Returns the full ID of a watched container, which may be
+        abbreviated, or None."""
+        with self.lock:
+            if ctr_id in self.names:
+                return ctr_id
+            for full_id in self.names:
+                if full_id.startswith(ctr_id):
+                    return full_id
+        return None
+
+    def _Schedule(self, ctr_id, when):
+        heapq.heappush(self.pending, (when, ctr_id))
+
+    def Resync(self):
+        """Catches up with containers whose events may have been missed."""
+        now = time.time()
+        for ctr_id in list(self.Watched().values()):
+            info = self.backend.Inspect(ctr_id)
+            state = self.states.get(ctr_id)
+            if info is None:
+                self._Forget(ctr_id)
+            elif (not info['State']['Running'] and state is not None and
+                  state.state in (restart_policy.STATE_RUNNING,
+                                  restart_policy.STATE_CRASHLOOP) and
+                  state.next_restart is None):
+                self._OnExit(ctr_id, info['State'].get('ExitCode'), now)
+
+    def _Forget(self, ctr_id):
+        name = self.Unwatch(ctr_id)
+        if name is not None:
+            LogInfo("container '%s' (%s) no longer exists: halting keepalive"
+                    % (name, ctr_id))
+
+    def _OnExit(self, ctr_id, exit_code, now):
+        with self.lock:
+            name = self.names.get(ctr_id)
+            state = self.states.get(ctr_id)
+        if name is None or state is None:
+            return
+        was_crashlooping = state.state == restart_policy.STATE_CRASHLOOP
+        delay = state.OnExit(now, exit_code, self.backoff)
+        LogInfo("container '%s' (%s) exited with status %s"
+                % (name, ctr_id, exit_code))
+        if state.state == restart_policy.STATE_STOPPED:
+            LogInfo("container '%s' (%s) will not be restarted: "
+                    "restart policy is '%s'"
+                    % (name, ctr_id, state.policy.name))
+        elif state.state == restart_policy.STATE_FAILED:
+            LogError("container '%s' (%s) will not be restarted: "
+                     'gave up after %d attempts'
+                     % (name, ctr_id, state.attempts))
+        else:
+            if (state.state == restart_policy.STATE_CRASHLOOP and
+                    not was_crashlooping):
+                LogError("container '%s' (%s) is crash-looping"
+                         % (name, ctr_id))
+            LogInfo("container '%s' (%s) will restart in %.1fs"
+                    % (name, ctr_id, delay))
+            self._Schedule(ctr_id, state.next_restart)
+
+    def HandleEvent(self, event):
+        ctr_id = self._Lookup(event.get('id') or '')
+        if ctr_id is None:
+            return
+        if event['status'] == 'die':
+            info = self.backend.Inspect(ctr_id)
+            if info is None:
+                self._Forget(ctr_id)
+            else:
+                self._OnExit(ctr_id, info['State'].get('ExitCode'),
+                             time.time())
+        elif event['status'] == 'destroy':
+            self._Forget(ctr_id)
+
+    def RestartDue(self, now):
+        """Restarts every container whose restart delay has passed."""
+        due = []
+        while self.pending and self.pending[0][0] <= now:
+            due.append(heapq.heappop(self.pending))
+        for when, ctr_id in due:
+            with self.lock:
+                name = self.names.get(ctr_id)
+                state = self.states.get(ctr_id)
+            if state is None or state.next_restart != when:
+                continue
+            try:
+                info = self.backend.Inspect(ctr_id)
+            except docker_backend.DockerError as e:
+                LogError("could not inspect container '%s' (%s): %s"
+                         % (name, ctr_id, e))
+                state.next_restart = now + RECONNECT_DELAY
+                self._Schedule(ctr_id, state.next_restart)
+                continue
+            if info is None:
+                self._Forget(ctr_id)
+                continue
+            if info['State']['Running']:
+                state.OnStart(now)
+                continue
+            LogInfo("container '%s' (%s) restarting" % (name, ctr_id))
+            try:
+                self.backend.Restart(ctr_id)
+                state.OnStart(now)
+                metrics.RESTARTS.Inc(name)
+            except docker_backend.DockerError as e:
+                LogError("could not restart container '%s' (%s): %s"
+                         % (name, ctr_id, e))
+                if state.OnRestartFailed(now, self.backoff) is None:
+                    LogError("container '%s' (%s) will not be restarted: "
+                             'gave up after %d attempts'
+                             % (name, ctr_id, state.attempts))
+                else:
+                    self._Schedule(ctr_id, state.next_restart)
+
+    def Status(self):
+        """Returns a dict of name -> the state of that container."""
+        now = time.time()
+        with self.lock:
+            status = {}
+            for ctr_id, name in self.names.items():
+                status[name] = self.states[ctr_id].Status(now)
+                status[name]['id'] = ctr_id
+            return status
+
+    def WriteStatus(self):
+        """Replaces the status file, if there is one."""
+        if self.status_path is None:
+            return
+        tmp_path = self.status_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.Status(), f, indent=2, sort_keys=True)
+            os.rename(tmp_path, self.status_path)
+        except (IOError, OSError) as e:
+            LogError('could not write status file %s: %s'
+                     % (self.status_path, e))
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def Records(self):
+        """Returns a dict of name -> the record of that container, for the
+        state file."""
+        with self.lock:
+            return dict((name, {'id': ctr_id,
+                                'fingerprint': self.fingerprints[ctr_id],
+                                'restart': self.states[ctr_id].ToDict()})
+                        for ctr_id, name in self.names.items())
+
+    def WriteState(self):
+        """Saves the state file, if there is one and it changed."""
+        if self.state_file is None:
+            return
+        records = self.Records()
+        if records != self.saved_records:
+            self.state_file.Save(records)
+            self.saved_records = records
+
+    def _NextTimeout(self, now):
+        if not self.pending:
+            return None
+        return max(self.pending[0][0] - now, 0)
+
+    def _ReadEvents(self):
+        while not self.stopped.is_set():
+            try:
+                for event in self.backend.Events():
+                    self.inbox.put(event)
+            except docker_backend.DockerError as e:
+                LogError('lost the docker events stream: %s' % (e))
+            except Exception as e:
+                # Anything else must not end the only thread listening
+                # for containers dying.
+                LogError('reading docker events failed: %r' % (e))
+            if self.stopped.is_set():
+                return
+            time.sleep(RECONNECT_DELAY)
+            self.inbox.put(_RESYNC)
+
+    def Run(self):
+        """Supervises until Stop() is called."""
+        reader = threading.Thread(target=self._ReadEvents)
+        reader.daemon = True
+        reader.start()
+
+        resync_at = time.time()     # when to catch up with docker, or None
+        while not self.stopped.is_set():
+            now = time.time()
+            event = None
+            if resync_at is None or resync_at > now:
+                timeout = self._NextTimeout(now)
+                if resync_at is not None and (timeout is None or
+                                              resync_at - now < timeout):
+                    timeout = resync_at - now
+                try:
+                    event = self.inbox.get(timeout=timeout)
+                except queue.Empty:
+                    pass
+            if event is _RESYNC:
+                resync_at = time.time()
+                event = None
+            try:
+                if resync_at is not None and resync_at <= time.time():
+                    resync_at = None
+                    self.Resync()
+                if isinstance(event, _Recheck):
+                    self.Recheck(event.ctr_id)
+                elif event is not None:
+                    self.HandleEvent(event)
+                self.RestartDue(time.time())
+            except Exception as e:
+                # Most likely docker is down, or restarting; whatever was
+                # missed meanwhile is caught up with by the next resync.
+                LogError('supervising failed, will resync: %r' % (e))
+                resync_at = time.time() + RECONNECT_DELAY
+            self.WriteStatus()
+            self.WriteState()
+
+    def Stop(self):
+        self.stopped.set()
+        self.inbox.put(None)
@@ -0,0 +1,213 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Trace where the time of an apply goes.
+
+Each apply is a trace: a tree of timed spans for parsing, validation, every
+pull attempt, every container start and every call to docker.  When tracing
+is on (see Tracer.Open), each span is appended to a file as one line of
+JSON once it ends:
+
+  {"trace_id": ..., "span_id": ..., "parent_id": ..., "name": "pull_attempt",
+   "start": 1400000000.25, "duration": 12.5, "status": "ok",
+   "attributes": {"image": "google/busybox", "attempt": 1}}
+
+A span that ends with an exception has status "error" and the exception in
+its "error" attribute.
+
+Spans nest within a thread, or within an asyncio task.  A span started on a
+thread that has none open (say, a pull on one of ParallelMap's threads)
+becomes a child of the root span of the apply in progress.  When tracing is
+off, spans cost next to nothing.
+"""
+
+import binascii
+import json
+import os
+import threading
+import time
+
+from container_agent.agent_log import LogError
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+
+def NewId(num_bytes):
+    return binascii.hexlify(os.urandom(num_bytes)).decode('ascii')
+
+
+class _NoSpan(object):
+
+    """Stands in for a span when tracing is off."""
+
+    def Set(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _ThreadCurrent(object):
+
+    """The innermost open span of each thread."""
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def get(self):
+        return getattr(self.local, 'span', None)
+
+    def set(self, span):
+        self.local.span = span
+
+
+def _NewCurrent():
+    """Returns a holder for the innermost open span.
+
+    Where there are context variables, every asyncio task has a context of
+    its own (and so does every thread), so spans nest within tasks too.
+    """
+    if contextvars is None:
+        return _ThreadCurrent()
+    return contextvars.ContextVar('span', default=None)
+
+
+class _Span(object):
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = None
+        self.span_id = NewId(8)
+        self.parent_id = None
+        self.outer = None       # the span this one is nested in, if any
+        self.start = None
+
+    def Set(self, key, value):
+        """Adds an attribute to the span."""
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.tracer._Push(self)
+        self.start = self.tracer.clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        end = self.tracer.clock()
+        self.tracer._Pop(self)
+        record = {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start,
+            'duration': end - self.start,
+            'status': 'ok',
+            'attributes': self.attributes,
+        }
+        if exc_type is not None:
+            record['status'] = 'error'
+            message = str(exc_value)
+            self.attributes['error'] = (
+                '%s: %s' % (exc_type.__name__, message) if message
+                else exc_type.__name__)
+        self.tracer._Write(record)
+        return False
+
+
+class Tracer(object):
+
+    """Writes spans to a file, if one is open.
+
+    Args:
+      clock: a callable returning the current time
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.out = None
+        self.root = None        # the outermost open span, if any
+        self.current = _NewCurrent()
+        self.lock = threading.Lock()
+
+    def Open(self, path):
+        """Starts appending spans to a file."""
+        out = open(path, 'a')
+        with self.lock:
+            self.out = out
+
+    def Close(self):
+        with self.lock:
+            out, self.out = self.out, None
+        if out is not None:
+            out.close()
+
+    def Span(self, name, **attributes):
+        """Returns a span to time a with block.
+
+        Args:
+          name: what is being done
+          attributes: what it is done to, say container or image
+        """
+        if self.out is None:
+            return _NO_SPAN
+        return _Span(self, name, attributes)
+
+    def _Push(self, span):
+        span.outer = self.current.get()
+        with self.lock:
+            parent = span.outer or self.root
+            if parent is None:
+                self.root = span
+                span.trace_id = NewId(16)
+            else:
+                span.parent_id = parent.span_id
+                span.trace_id = parent.trace_id
+        self.current.set(span)
+
+    def _Pop(self, span):
+        if self.current.get() is span:
+            self.current.set(span.outer)
+        with self.lock:
+            if self.root is span:
+                self.root = None
+
+    def _Write(self, record):
+        line = json.dumps(record, sort_keys=True, default=str) + '\n'
+        with self.lock:
+            if self.out is None:
+                return
+            try:
+                self.out.write(line)
+                self.out.flush()
+            except (IOError, OSError) as e:
+                LogError('could not write a trace span: %s' % (e))
+
+
+TRACER = Tracer()
+
+
+def Span(name, **attributes):
+    """Returns a span of the agent's tracer; see Tracer.Span."""
+    return TRACER.Span(name, **attributes)
@@ -0,0 +1,46 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The outcome of checking a manifest, with every problem found in it.
+
+The Load* functions in run_containers report each problem to an error
+collector.  By default that exits at the first one; an ErrorList instead
+keeps going and gathers them all, so that run_containers.ValidateConfig can
+describe everything wrong with a manifest in one pass.
+"""
+
+
+class ErrorList(object):
+
+    """Collects manifest errors, rather than exiting at the first."""
+
+    def __init__(self):
+        self.errors = []  # [str], in manifest order
+
+    def Add(self, message):
+        self.errors.append(message)
+
+
+class ValidationResult(object):
+
+    """What validating a manifest found."""
+
+    __slots__ = ('containers', 'errors')
+
+    def __init__(self, containers, errors):
+        self.containers = containers  # [Container], empty unless valid
+        self.errors = errors          # [str]
+
+    def IsValid(self):
+        return not self.errors
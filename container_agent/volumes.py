@@ -0,0 +1,208 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Where volumes live, and the tmpfs mounts of memory-backed ones.
+
+A volume has one of three sources (see manifests/README.md): a directory
+under the group's export dir (emptyDir, the default), a directory of the
+host (hostDir), or a tmpfs (tmpfs).  Docker bind-mounts all of them into
+containers alike.  A tmpfs volume is mounted by the agent itself, on the
+volume's directory under the export dir and capped at its size, before any
+container using it is started; every container of the group that mounts
+the volume then shares the same memory.
+
+Memory committed to tmpfs volumes is not available to anything else, so it
+is reported per group (see metrics.TMPFS_BYTES), and the volumes are not
+mounted at all if together they would commit more than the host has.
+"""
+
+import os
+import re
+import subprocess
+
+from container_agent import metrics
+from container_agent.agent_log import LogInfo
+
+
+SOURCE_EMPTY_DIR = 'emptyDir'
+SOURCE_TMPFS = 'tmpfs'
+SOURCE_HOST_DIR = 'hostDir'
+VALID_SOURCES = [SOURCE_EMPTY_DIR, SOURCE_TMPFS, SOURCE_HOST_DIR]
+
+MOUNT_CMD = 'mount'
+UMOUNT_CMD = 'umount'
+PROC_MOUNTS = '/proc/mounts'
+
+RE_SIZE_OPTION = re.compile(r'^size=(\d+)([kmg]?)$')
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+
+class VolumeError(Exception):
+    pass
+
+
+class VolumeSource(object):
+
+    """Where a volume lives."""
+
+    __slots__ = ('kind', 'path', 'size')
+
+    def __init__(self, kind=SOURCE_EMPTY_DIR, path=None, size=None):
+        self.kind = kind    # str, one of VALID_SOURCES
+        self.path = path    # str, the host directory of a hostDir volume
+        self.size = size    # int, the size cap in bytes of a tmpfs volume
+
+    def __eq__(self, other):
+        return (isinstance(other, VolumeSource) and
+                (self.kind, self.path, self.size) ==
+                (other.kind, other.path, other.size))
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def HostMemory():
+    """Returns how many bytes of memory the host has."""
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def PageRound(size):
+    """Returns size rounded up to whole pages, as a tmpfs mount does."""
+    page = os.sysconf('SC_PAGE_SIZE')
+    return -(-size // page) * page
+
+
+def ReadTmpfsMounts(path=PROC_MOUNTS):
+    """Returns a dict of mount point -> size in bytes (None if unknown), for
+    every tmpfs mounted on the host."""
+    mounts = {}
+    try:
+        with open(path, 'r') as f:
+            lines = f.readlines()
+    except (IOError, OSError):
+        return mounts
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 4 or fields[2] != 'tmpfs':
+            continue
+        size = None
+        for option in fields[3].split(','):
+            m = RE_SIZE_OPTION.match(option)
+            if m:
+                size = int(m.group(1)) * SIZE_UNITS[m.group(2)]
+        # /proc/mounts escapes spaces and the like as octal.
+        mount_point = re.sub(r'\\([0-7]{3})',
+                             lambda m: chr(int(m.group(1), 8)), fields[1])
+        mounts[mount_point] = size
+    return mounts
+
+
+def TmpfsByGroup(containers):
+    """Returns a dict of group -> {directory: size} of the tmpfs volumes the
+    containers mount.  The unnamed group is ''."""
+    groups = {}
+    for ctr in containers:
+        for directory, size in ctr.tmpfs:
+            groups.setdefault(ctr.group or '', {})[directory] = size
+    return groups
+
+
+def RunCommand(args):
+    try:
+        subprocess.check_call(args)
+    except (subprocess.CalledProcessError, OSError) as e:
+        raise VolumeError('%s failed: %s' % (' '.join(args), e))
+
+
+class TmpfsMounter(object):
+
+    """Mounts the tmpfs volumes of the containers about to be run.
+
+    Args:
+      root: the directory holding every group's volumes; a tmpfs under it
+          that no volume wants any more is unmounted
+      run: a callable to run a command (a list of str) with, raising
+          VolumeError if it fails
+      proc_mounts: the file listing the host's mounts
+      host_memory: a callable returning the host's memory, in bytes
+    """
+
+    def __init__(self, root, run=RunCommand, proc_mounts=PROC_MOUNTS,
+                 host_memory=HostMemory):
+        self.root = root
+        self.run = run
+        self.proc_mounts = proc_mounts
+        self.host_memory = host_memory
+
+    def _UnderRoot(self, directory):
+        return directory.startswith(self.root.rstrip('/') + '/')
+
+    def SetUp(self, containers):
+        """Makes sure every tmpfs volume of the containers is mounted with
+        its size cap, and that their other export dir volumes are not on a
+        tmpfs left over from an earlier manifest.
+
+        Raises VolumeError if the volumes would commit more memory than the
+        host has, or a mount fails.
+        """
+        groups = TmpfsByGroup(containers)
+        for (group,) in metrics.TMPFS_BYTES.Labels():
+            if group not in groups:
+                metrics.TMPFS_BYTES.Remove(group)
+        wanted = {}
+        for group, dirs in sorted(groups.items()):
+            committed = sum(dirs.values())
+            LogInfo("%s commits %d bytes of memory to %d tmpfs volume%s"
+                    % ("group '%s'" % (group) if group else 'the manifest',
+                       committed, len(dirs), 's' if len(dirs) > 1 else ''))
+            metrics.TMPFS_BYTES.Set(committed, group)
+            wanted.update(dirs)
+
+        total = sum(wanted.values())
+        if total:
+            memory = self.host_memory()
+            if total > memory:
+                raise VolumeError(
+                    'tmpfs volumes would commit %d bytes of memory, but the '
+                    'host has %d' % (total, memory))
+
+        exported = set(mount.split(':')[0] for ctr in containers
+                       for mount in ctr.mounts)
+        exported = [directory for directory in exported
+                    if directory not in wanted and self._UnderRoot(directory)]
+        if not wanted and not exported:
+            return
+
+        mounted = ReadTmpfsMounts(self.proc_mounts)
+        for directory in sorted(exported):
+            if directory in mounted:
+                LogInfo('unmounting the tmpfs on %s' % (directory))
+                self.run([UMOUNT_CMD, directory])
+        for directory, size in sorted(wanted.items()):
+            if directory not in mounted:
+                try:
+                    if not os.path.isdir(directory):
+                        os.makedirs(directory)
+                except OSError as e:
+                    raise VolumeError('could not create %s: %s'
+                                      % (directory, e))
+                LogInfo('mounting a tmpfs of %d bytes on %s'
+                        % (size, directory))
+                self.run([MOUNT_CMD, '-t', 'tmpfs', '-o', 'size=%d' % (size),
+                          'tmpfs', directory])
+            elif mounted[directory] != PageRound(size):
+                LogInfo('resizing the tmpfs on %s to %d bytes'
+                        % (directory, size))
+                self.run([MOUNT_CMD, '-o', 'remount,size=%d' % (size),
+                          directory])
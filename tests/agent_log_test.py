@@ -0,0 +1,87 @@
+#!/usr/bin/python
+
+"""Tests for agent_log."""
+
+import os
+import re
+import shutil
+import socket
+import syslog
+import tempfile
+import unittest
+from container_agent import agent_log
+from container_agent import metrics
+
+
+INFO = syslog.LOG_LOCAL3 | syslog.LOG_INFO
+ERR = syslog.LOG_LOCAL3 | syslog.LOG_ERR
+
+
+class SyslogWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'log')
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.server.bind(self.path)
+        self.server.settimeout(5)
+        self.writer = agent_log.SyslogWriter('agent', self.path, ring_size=4)
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _Received(self, n):
+        return [self.server.recv(4096).decode('utf-8') for _ in range(n)]
+
+    def testFormat(self):
+        self.writer.Log(INFO, 'hello')
+        self.writer.Log(ERR, 'oops')
+        self.writer.Flush()
+        info, err = self._Received(2)
+        self.assertTrue(re.match(r'<158>\w{3} [ \d]\d \d\d:\d\d:\d\d '
+                                 r'agent\[%d\]: hello$' % os.getpid(), info),
+                        info)
+        self.assertTrue(err.startswith('<155>'))
+        self.assertTrue(err.endswith(': oops'))
+
+    def testOneSocket(self):
+        for i in range(10):
+            self.writer.Log(INFO, 'line %d' % i)
+            self.writer.Flush()
+        self.assertEqual(10, len(self._Received(10)))
+        sock = self.writer.sock
+        self.writer.Log(INFO, 'again')
+        self.writer.Flush()
+        self.assertIs(sock, self.writer.sock)
+
+    def testFullRingDropsOldest(self):
+        # A writer that cannot keep up.
+        ensure_thread = self.writer._EnsureThread
+        self.writer._EnsureThread = lambda: None
+        for i in range(6):
+            self.writer.Log(INFO, 'line %d' % i)
+        self.assertEqual(2, self.writer.dropped_total)
+
+        self.writer._EnsureThread = ensure_thread
+        self.writer.Log(INFO, 'line 6')
+        self.writer.Flush()
+        received = self._Received(5)
+        self.assertTrue(received[0].startswith('<155>'))
+        self.assertTrue(received[0].endswith(
+            'dropped 3 log lines: syslog was too slow'))
+        self.assertEqual(['line %d' % i for i in range(3, 7)],
+                         [line.rpartition(': ')[2] for line in received[1:]])
+
+    def testNoSyslogDoesNotBlock(self):
+        before = metrics.LOG_LINES_DROPPED.Value()
+        writer = agent_log.SyslogWriter('agent',
+                                        os.path.join(self.tmpdir, 'nope'))
+        writer.Log(INFO, 'lost')
+        writer.Flush()
+        self.assertEqual(1, writer.dropped_total)
+        self.assertGreater(metrics.LOG_LINES_DROPPED.Value(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/python
+
+"""Tests for agent_state."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from container_agent import agent_state
+
+
+class StateFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'lib', 'state.json')
+        self.state_file = agent_state.StateFile(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testLoadMissing(self):
+        self.assertEqual({}, self.state_file.Load())
+
+    def testSaveAndLoad(self):
+        records = {'abc123': {'id': 'aaa111', 'fingerprint': 'f00',
+                              'restart': {'restarts': 2}}}
+        self.state_file.Save(records)
+        self.assertEqual(records, self.state_file.Load())
+        self.assertEqual(['state.json'], os.listdir(os.path.dirname(
+            self.path)))
+
+    def testCorruptIsEmpty(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            f.write('{')
+        self.assertEqual({}, self.state_file.Load())
+
+    def testOtherFormatIsEmpty(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            json.dump({'format': agent_state.STATE_FORMAT + 1,
+                       'containers': {'abc123': {}}}, f)
+        self.assertEqual({}, self.state_file.Load())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,265 @@
+#!/usr/bin/python
+
+"""Tests for async_engine."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from benchmarks import apply_benchmark
+from container_agent import docker_backend
+from container_agent import image_cache
+from container_agent import pause_image
+from container_agent import run_containers
+from container_agent import supervisor
+from tests import fake_docker
+
+try:
+    import asyncio
+    from container_agent import async_engine
+except (ImportError, SyntaxError):
+    async_engine = None
+
+
+def LoadContainers(specs):
+    user = run_containers.LoadUserContainers(specs, [])
+    return run_containers.LoadInfraContainers(user) + user
+
+
+@unittest.skipIf(async_engine is None, 'needs Python 3')
+class AsyncEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = fake_docker.FakeDockerServer().Start()
+        self.state = self.server.state
+        self.backend = async_engine.AsyncApiBackend(self.server.socket_path)
+        self.engine = async_engine.Engine(self.backend)
+        self.sync_backend = docker_backend.ApiBackend(self.server.socket_path)
+
+    def tearDown(self):
+        self.engine.Close()
+        self.sync_backend.Close()
+        self.server.Stop()
+
+    def _Created(self):
+        return [path for method, path in self.state.requests
+                if (method, path) == ('POST', '/containers/create')]
+
+    def _Started(self):
+        return [self.state.containers[path.split('/')[2]]['Name']
+                for method, path in self.state.requests
+                if method == 'POST' and path.endswith('/start')]
+
+    def testRunContainers(self):
+        ctr_ids = self.engine.RunContainers(LoadContainers(
+            [{'name': 'abc123', 'image': 'foo/bar',
+              'ports': [{'containerPort': 80}]}]))
+        self.assertEqual(['.net', 'abc123'], sorted(ctr_ids))
+        self.assertIn(pause_image.IMAGE, self.state.imports)
+        self.assertIn('foo/bar:latest', self.state.images)
+        ctr = self.sync_backend.Inspect('abc123')
+        self.assertEqual(ctr_ids['abc123'], ctr['Id'])
+        self.assertTrue(ctr['State']['Running'])
+        self.assertEqual('container:.net', ctr['HostConfig']['NetworkMode'])
+
+    def testConnectionsAreReused(self):
+        self.engine.RunContainers(LoadContainers(
+            [{'name': 'abc123', 'image': 'foo/bar'}]))
+        self.assertLessEqual(self.state.connections,
+                             docker_backend.DEFAULT_POOL_SIZE)
+
+    def testUpToDateIsLeftAlone(self):
+        specs = [{'name': 'abc123', 'image': 'foo/bar:1.0'}]
+        cache = image_cache.ImageCache(None)
+        self.engine.RunContainers(LoadContainers(specs), cache=cache)
+        self.assertEqual(2, len(self._Created()))
+        self.engine.RunContainers(LoadContainers(specs), cache=cache)
+        self.assertEqual(2, len(self._Created()))
+
+    def testDependenciesFirst(self):
+        self.engine.RunContainers(LoadContainers(
+            [{'name': 'abc123', 'image': 'foo/bar', 'dependsOn': ['abc124']},
+             {'name': 'abc124', 'image': 'foo/bar'},
+             {'name': 'abc125', 'image': 'foo/bar'}]))
+        started = self._Started()
+        self.assertEqual('/.net', started[0])
+        self.assertTrue(started.index('/abc124') < started.index('/abc123'))
+        self.assertEqual(4, len(started))
+
+    def testStartsOverlap(self):
+        self.state.latency = {'start': 0.2}
+        start = time.time()
+        self.engine.RunContainers(LoadContainers(
+            [{'name': 'abc%d' % i, 'image': 'foo/bar'} for i in range(6)]))
+        # The .net container, then six at once.
+        self.assertLess(time.time() - start, 1.0)
+
+    def testBareNoContentReplies(self):
+        # Kill and rm get a 204 without Content-Length, as from docker.
+        self.backend.timeouts['kill'] = 2
+        self.backend.timeouts['rm'] = 2
+        self.sync_backend.Run(run_containers.Container('abc123', 'foo/bar'))
+        start = time.time()
+        self.engine.loop.run_until_complete(self.backend.Kill('abc123'))
+        self.engine.loop.run_until_complete(self.backend.Remove('abc123'))
+        self.assertLess(time.time() - start, 1)
+        self.assertNotIn('abc123', self.state.names)
+
+    def testPullNever(self):
+        with self.assertRaises(SystemExit):
+            self.engine.RunContainers(LoadContainers(
+                [{'name': 'abc123', 'image': 'foo/bar:1.0',
+                  'imagePullPolicy': 'Never'}]))
+
+    def testTimeoutCancelsTheRest(self):
+        self.backend.timeouts['run'] = 0.1
+        self.state.latency = {'start': 1}
+        start = time.time()
+        with self.assertRaises(SystemExit):
+            self.engine.RunContainers(LoadContainers(
+                [{'name': 'abc123', 'image': 'foo/bar'},
+                 {'name': 'abc124', 'image': 'foo/bar',
+                  'dependsOn': ['abc123']}]))
+        self.assertLess(time.time() - start, 1)
+        self.assertNotIn('abc124', self.state.names)
+
+    def testFailedPull(self):
+        self.state.pull_errors['foo/bar:latest'] = 'not found'
+        old_delay = run_containers.PULL_RETRY_DELAY
+        run_containers.PULL_RETRY_DELAY = 0
+        try:
+            with self.assertRaises(SystemExit):
+                self.engine.RunContainers(LoadContainers(
+                    [{'name': 'abc123', 'image': 'foo/bar'}]))
+        finally:
+            run_containers.PULL_RETRY_DELAY = old_delay
+        self.assertNotIn('abc123', self.state.names)
+
+    def testFailedPullStartsNothing(self):
+        self.state.pull_errors['baz/qux:latest'] = 'not found'
+        old_delay = run_containers.PULL_RETRY_DELAY
+        run_containers.PULL_RETRY_DELAY = 0.1
+        try:
+            with self.assertRaises(SystemExit):
+                self.engine.RunContainers(LoadContainers(
+                    [{'name': 'abc123', 'image': 'foo/bar'},
+                     {'name': 'abc124', 'image': 'baz/qux'}]))
+        finally:
+            run_containers.PULL_RETRY_DELAY = old_delay
+        # foo/bar was pulled, but nothing ran while baz/qux was retried.
+        self.assertIn('foo/bar:latest', self.state.images)
+        self.assertEqual([], self._Created())
+
+    def testApplyContainers(self):
+        keeper = supervisor.Supervisor(self.sync_backend)
+        applied = run_containers.ApplyContainers(
+            self.sync_backend, keeper, {},
+            LoadContainers([{'name': 'abc123', 'image': 'foo/bar'}]),
+            engine=self.engine)
+        self.assertEqual(['.net', 'abc123'], sorted(applied))
+        self.assertEqual(self.sync_backend.Inspect('abc123')['Id'],
+                         keeper.Watched()['abc123'])
+
+    def testCycle(self):
+        with self.assertRaises(ValueError):
+            self.engine.RunContainers([self._DependsOn('a', 'b'),
+                                       self._DependsOn('b', 'a')])
+
+    def _DependsOn(self, name, dep):
+        ctr = run_containers.Container(name, 'foo/bar')
+        ctr.depends_on = [dep]
+        return ctr
+
+
+@unittest.skipIf(async_engine is None, 'needs Python 3')
+class AsyncCliBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = fake_docker.FakeDockerServer().Start()
+        self.state = self.server.state
+        self.tmpdir = tempfile.mkdtemp()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        self.server.Stop()
+        shutil.rmtree(self.tmpdir)
+
+    def testLifecycle(self):
+        backend = async_engine.AsyncCliBackend(apply_benchmark.NewCliShim(
+            self.tmpdir, self.server.socket_path,
+            os.path.join(self.tmpdir, 'forks')))
+        engine = async_engine.Engine(backend)
+        ctr_ids = engine.RunContainers(LoadContainers(
+            [{'name': 'abc123', 'image': 'foo/bar'}]))
+        engine.Close()
+        self.assertEqual(['.net', 'abc123'], sorted(ctr_ids))
+        self.assertTrue(
+            self.state.containers[ctr_ids['abc123']]['State']['Running'])
+
+    def testTimeoutKillsTheProcess(self):
+        path = os.path.join(self.tmpdir, 'docker')
+        pid_path = os.path.join(self.tmpdir, 'pid')
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\necho $$ > %s\nexec sleep 10\n' % (pid_path))
+        os.chmod(path, 0o755)
+        backend = async_engine.AsyncCliBackend(path, {'pull': 0.5})
+        start = time.time()
+        with self.assertRaises(docker_backend.DockerError):
+            self.loop.run_until_complete(backend.Pull('foo/bar'))
+        self.assertLess(time.time() - start, 5)
+        with open(pid_path) as f:
+            pid = int(f.read())
+        with self.assertRaises(OSError):
+            os.kill(pid, 0)
+
+
+@unittest.skipIf(async_engine is None, 'needs Python 3')
+class ReadResponseTest(unittest.TestCase):
+
+    def _Read(self, data, method='GET'):
+        # No async syntax here: this file must still load on Python 2.
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            return loop.run_until_complete(
+                async_engine.ReadResponse(reader, method))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def testContentLength(self):
+        self.assertEqual(
+            (200, b'{}', True),
+            self._Read(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}'))
+
+    def testChunked(self):
+        self.assertEqual(
+            (200, b'abcdef', False),
+            self._Read(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n'
+                       b'Connection: close\r\n\r\n'
+                       b'3\r\nabc\r\n3;x=y\r\ndef\r\n0\r\n\r\n'))
+
+    def testNoContent(self):
+        # A bare 204 has no body, and the connection stays usable.
+        self.assertEqual(
+            (204, b'', True),
+            self._Read(b'HTTP/1.1 204 No Content\r\n\r\nHTTP/1.1 200'))
+
+    def testHead(self):
+        self.assertEqual((200, b'', True), self._Read(
+            b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n',
+            'HEAD'))
+
+    def testUntilClose(self):
+        self.assertEqual(
+            (500, b'oops', False),
+            self._Read(b'HTTP/1.0 500 Oops\r\n\r\noops'))
+
+
+if __name__ == '__main__':
+    unittest.main()
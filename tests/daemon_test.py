@@ -0,0 +1,414 @@
+#!/usr/bin/python
+
+"""Tests for daemon."""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from container_agent import agent_state
+from container_agent import daemon
+from container_agent import docker_backend
+from container_agent import log_collector
+from container_agent import metrics
+from container_agent import run_containers
+from container_agent import supervisor
+from tests import fake_docker
+
+
+MANIFEST = """
+version: v1beta1
+containers:
+  - name: one
+    image: foo/one
+  - name: two
+    image: foo/two
+    ports:
+      - containerPort: 80
+"""
+
+
+def WaitFor(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+class WatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'manifest.yaml')
+        self._Write('one')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _Write(self, text, path=None):
+        with open(path or self.path, 'w') as f:
+            f.write(text)
+
+    def testPollingWatcher(self):
+        watcher = daemon.PollingWatcher(self.path, 0.01)
+        self.assertFalse(watcher.Changed())
+        self._Write('something longer')
+        self.assertTrue(watcher.Changed())
+        self.assertFalse(watcher.Changed())
+        os.unlink(self.path)
+        self.assertTrue(watcher.Changed())
+
+    def testInotifyWatcher(self):
+        watcher = daemon.InotifyWatcher(self.path)
+        try:
+            self.assertFalse(watcher.Changed())
+            self._Write('two')
+            self.assertTrue(watcher.Changed())
+            self.assertFalse(watcher.Changed())
+            self._Write('other', os.path.join(self.tmpdir, 'other.yaml'))
+            self.assertFalse(watcher.Changed())
+            # Replacing the file by renaming over it counts, too.
+            new_path = os.path.join(self.tmpdir, 'new.yaml')
+            self._Write('three', new_path)
+            watcher.Changed()
+            os.rename(new_path, self.path)
+            self.assertTrue(watcher.Changed())
+        finally:
+            watcher.Close()
+
+    def testNewWatcherPrefersInotify(self):
+        watcher = daemon.NewWatcher(self.path)
+        watcher.Close()
+        self.assertIsInstance(watcher, daemon.InotifyWatcher)
+
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'manifest.yaml')
+        self._Write('good 1')
+        self.applied = []
+        self.daemon = daemon.Daemon(
+            daemon.ManifestFile(self.path,
+                                daemon.PollingWatcher(self.path, 0.01)),
+            self._Load, self.applied.append)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _Write(self, text):
+        with open(self.path, 'w') as f:
+            f.write(text)
+
+    def _Load(self, text):
+        if text == 'crash':
+            raise TypeError('unhashable type')
+        if not text.startswith('good'):
+            raise SystemExit(1)
+        return text
+
+    def testReloadAppliesOnlyChanges(self):
+        self.assertTrue(self.daemon.Reload())
+        self.assertFalse(self.daemon.Reload())
+        self._Write('good 2')
+        self.assertTrue(self.daemon.Reload())
+        self.assertEqual(['good 1', 'good 2'], self.applied)
+
+    def testReloadMissingFile(self):
+        os.unlink(self.path)
+        self.assertFalse(self.daemon.Reload())
+        self.assertEqual([], self.applied)
+
+    def testReloadForced(self):
+        self.daemon.Reload()
+        self.assertTrue(self.daemon.Reload(force=True))
+        self.assertEqual(['good 1', 'good 1'], self.applied)
+
+    def testReloadRejectsInvalid(self):
+        self.daemon.Reload()
+        self._Write('bad')
+        self.assertFalse(self.daemon.Reload())
+        self.assertEqual(['good 1'], self.applied)
+
+    def testReloadRejectsCrashingLoad(self):
+        self.daemon.Reload()
+        self._Write('crash')
+        self.assertFalse(self.daemon.Reload())
+        self.assertEqual(['good 1'], self.applied)
+
+    def testRun(self):
+        thread = threading.Thread(target=self.daemon.Run)
+        thread.start()
+        try:
+            self.assertTrue(WaitFor(lambda: len(self.applied) == 1))
+            self._Write('good 2 and then some')
+            self.assertTrue(WaitFor(lambda: len(self.applied) == 2))
+            self.daemon.Wake()
+            self.assertTrue(WaitFor(lambda: len(self.applied) == 3))
+        finally:
+            self.daemon.Stop()
+            thread.join()
+        self.assertEqual(['good 1', 'good 2 and then some',
+                          'good 2 and then some'], self.applied)
+
+
+class ApplyContainersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = fake_docker.FakeDockerServer().Start()
+        self.state = self.server.state
+        self.backend = docker_backend.ApiBackend(self.server.socket_path)
+        self.keeper = supervisor.Supervisor(self.backend)
+        self.applied = {}
+        self.collector = None
+
+    def tearDown(self):
+        if self.collector is not None:
+            self.collector.Stop()
+        self.backend.Close()
+        self.server.Stop()
+
+    def _Apply(self, text):
+        self.applied = run_containers.ApplyContainers(
+            self.backend, self.keeper, self.applied,
+            run_containers.LoadManifest(text), collector=self.collector)
+
+    def _Ids(self):
+        return dict((name, self.backend.Inspect(name)['Id'])
+                    for name in self.applied)
+
+    def testApply(self):
+        self._Apply(MANIFEST)
+        self.assertEqual(['.net', 'one', 'two'], sorted(self.applied))
+        self.assertEqual(self._Ids(), self.keeper.Watched())
+
+    def testApplyIsRecorded(self):
+        before = time.time()
+        self._Apply(MANIFEST)
+        self.assertGreaterEqual(metrics.LAST_APPLY.Value(), before)
+        self.assertLess(metrics.SINCE_LAST_APPLY.Value(), 60)
+
+    def testUnchangedIsUntouched(self):
+        self._Apply(MANIFEST)
+        before = len(self.state.requests)
+        self._Apply(MANIFEST)
+        self.assertEqual(before, len(self.state.requests))
+
+    def testChangedAddedRemoved(self):
+        self._Apply(MANIFEST)
+        ids = self._Ids()
+        self._Apply(MANIFEST.replace('foo/one', 'foo/uno').replace(
+            'name: two', 'name: three'))
+        self.assertEqual(['.net', 'one', 'three'], sorted(self.applied))
+        self.assertIsNone(self.backend.Inspect('two'))
+        self.assertNotEqual(ids['one'], self.backend.Inspect('one')['Id'])
+        self.assertEqual(ids['.net'], self.backend.Inspect('.net')['Id'])
+        self.assertEqual(self._Ids(), self.keeper.Watched())
+
+    def testLogsAreCollected(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.collector = log_collector.LogCollector(self.backend, tmpdir)
+        with_logs = MANIFEST.replace('image: foo/one', 'image: foo/one\n'
+                                     '    logs: {maxFiles: 2}')
+        self._Apply(with_logs)
+        self.assertEqual(
+            {'one': (self.backend.Inspect('one')['Id'],
+                     log_collector.LogConfig(max_files=2))},
+            self.collector.Watched())
+        self.state.AddOutput('one', docker_backend.STDOUT, b'hello\n')
+        path = os.path.join(tmpdir, 'one', 'stdout.log')
+        self.assertTrue(WaitFor(lambda: os.path.exists(path) and
+                                open(path, 'rb').read() == b'hello\n'))
+
+        # Only the logs section changed: the container stays.
+        ids = self._Ids()
+        self._Apply(MANIFEST)
+        self.assertEqual(ids, self._Ids())
+        self.assertEqual({}, self.collector.Watched())
+
+    def testImagesArePulledBeforeTeardown(self):
+        self._Apply(MANIFEST)
+        before = len(self.state.requests)
+        self._Apply(MANIFEST.replace('foo/one', 'foo/uno').replace(
+            'name: two', 'name: three'))
+        requests = self.state.requests[before:]
+        pull = requests.index(('POST', '/images/create'))
+        self.assertLess(pull, requests.index(('POST', '/containers/one/kill')))
+        self.assertLess(pull, requests.index(('DELETE', '/containers/two')))
+
+    def testPrefetchedImagesAreNotPulledAgain(self):
+        self._Apply(MANIFEST)
+        before = len(self.state.requests)
+        # foo/one is untagged, so its pull policy is Always.
+        self._Apply(MANIFEST.replace('image: foo/one', 'image: foo/one\n'
+                                     '    workingDir: /tmp'))
+        self.assertEqual(1, self.state.requests[before:].count(
+            ('POST', '/images/create')))
+
+    def testNewImageReplacesUnchangedContainer(self):
+        both = MANIFEST.replace('foo/two', 'foo/one')
+        self._Apply(both)
+        ids = self._Ids()
+        # A new foo/one is pulled for 'one', which 'two' shares.
+        self.state.images['foo/one:latest'] = 'sha256:%064x' % (99)
+        self._Apply(both.replace('image: foo/one', 'image: foo/one\n'
+                                 '    workingDir: /tmp', 1))
+        for name in ('one', 'two'):
+            info = self.backend.Inspect(name)
+            self.assertNotEqual(ids[name], info['Id'])
+            self.assertEqual('sha256:%064x' % (99), info['Image'])
+        self.assertEqual(ids['.net'], self.backend.Inspect('.net')['Id'])
+        self.assertEqual(self._Ids(), self.keeper.Watched())
+
+    def testFailedPrefetchLeavesTheGroupAlone(self):
+        self._Apply(MANIFEST)
+        ids = self._Ids()
+        self.state.pull_errors['foo/uno:latest'] = 'not found'
+        old_delay = run_containers.PULL_RETRY_DELAY
+        run_containers.PULL_RETRY_DELAY = 0
+        try:
+            with self.assertRaises(SystemExit):
+                self._Apply(MANIFEST.replace('foo/one', 'foo/uno').replace(
+                    'name: two', 'name: three'))
+        finally:
+            run_containers.PULL_RETRY_DELAY = old_delay
+        self.assertEqual(ids, self._Ids())
+        self.assertEqual(ids, self.keeper.Watched())
+        for name in ids:
+            self.assertTrue(
+                self.backend.Inspect(name)['State']['Running'])
+
+    def testNetworkChangeRecreatesJoiners(self):
+        self._Apply(MANIFEST)
+        ids = self._Ids()
+        self._Apply(MANIFEST.replace('80', '81'))
+        for name in ('.net', 'one', 'two'):
+            self.assertNotEqual(ids[name], self.backend.Inspect(name)['Id'])
+
+    def testRestartPolicyChangeKeepsContainer(self):
+        self._Apply(MANIFEST)
+        ids = self._Ids()
+        self._Apply(MANIFEST.replace('image: foo/one', '''image: foo/one
+    restartPolicy:
+      name: never'''))
+        self.assertEqual(ids, self._Ids())
+        self.assertEqual('never',
+                         self.keeper.states[ids['one']].policy.name)
+
+    def testRestartPolicyChangeRestartsDeadContainer(self):
+        never = MANIFEST.replace('image: foo/one', '''image: foo/one
+    restartPolicy:
+      name: never''')
+        self._Apply(never)
+        ids = self._Ids()
+        thread = threading.Thread(target=self.keeper.Run)
+        thread.start()
+        try:
+            self.backend.Kill('one')
+            self.assertTrue(WaitFor(
+                lambda: self.keeper.Status()['one']['state'] == 'stopped'))
+            self._Apply(MANIFEST)
+            self.assertTrue(WaitFor(
+                lambda: self.backend.Inspect('one')['State']['Running']))
+        finally:
+            self.keeper.Stop()
+            thread.join()
+        self.assertEqual(ids, self._Ids())
+        status = self.keeper.Status()['one']
+        self.assertEqual('always', self.keeper.states[ids['one']].policy.name)
+        self.assertEqual(1, status['restarts'])
+        self.assertEqual(137, status['last_exit_code'])
+
+    def testLostContainerIsRecreated(self):
+        self._Apply(MANIFEST)
+        self.keeper.Unwatch(self.backend.Inspect('one')['Id'])
+        self.backend.Remove('one')
+        self._Apply(MANIFEST)
+        self.assertIsNotNone(self.backend.Inspect('one'))
+        self.assertEqual(self._Ids(), self.keeper.Watched())
+
+    def testInvalidManifest(self):
+        with self.assertRaises(SystemExit):
+            run_containers.LoadManifest('version: v1beta1\ncontainers: [{}]')
+        with self.assertRaises(SystemExit):
+            run_containers.LoadManifest('- just a list')
+        with self.assertRaises(SystemExit):
+            run_containers.LoadManifest('{not yaml')
+
+
+class AdoptContainersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = fake_docker.FakeDockerServer().Start()
+        self.state = self.server.state
+        self.backend = docker_backend.ApiBackend(self.server.socket_path)
+        self.tmpdir = tempfile.mkdtemp()
+        self.state_file = agent_state.StateFile(
+            os.path.join(self.tmpdir, 'state.json'))
+        # The agent that ran before.
+        keeper = supervisor.Supervisor(self.backend,
+                                       state_file=self.state_file)
+        run_containers.ApplyContainers(self.backend, keeper, {},
+                                       run_containers.LoadManifest(MANIFEST))
+        keeper.WriteState()
+        self.records = self.state_file.Load()
+        self.ids = keeper.Watched()
+        self.keeper = supervisor.Supervisor(self.backend)
+
+    def tearDown(self):
+        self.backend.Close()
+        self.server.Stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _Adopt(self, text=MANIFEST):
+        return run_containers.AdoptContainers(
+            self.backend, self.keeper, run_containers.LoadManifest(text),
+            self.records)
+
+    def testAdoptsRunningContainers(self):
+        before = len(self.state.requests)
+        adopted = self._Adopt()
+        self.assertEqual(['.net', 'one', 'two'], sorted(adopted))
+        self.assertEqual(self.ids, self.keeper.Watched())
+        # One inspect each, and nothing else.
+        self.assertEqual(
+            sorted(('GET', '/containers/%s/json' % (ctr_id))
+                   for ctr_id in self.ids.values()),
+            sorted(self.state.requests[before:]))
+
+    def testRestartHistoryIsKept(self):
+        self.records['one']['restart']['restarts'] = 3
+        self._Adopt()
+        self.assertEqual(3, self.keeper.Status()['one']['restarts'])
+
+    def testChangedIsNotAdopted(self):
+        adopted = self._Adopt(MANIFEST.replace(
+            'image: foo/one', 'image: foo/one\n    workingDir: /tmp'))
+        self.assertEqual(['.net', 'two'], sorted(adopted))
+
+    def testStoppedIsNotAdopted(self):
+        self.backend.Kill('one')
+        self.assertEqual(['.net', 'two'], sorted(self._Adopt()))
+
+    def testJoinersOfAStoppedNetworkAreNotAdopted(self):
+        self.backend.Kill('.net')
+        self.assertEqual({}, self._Adopt())
+        self.assertEqual({}, self.keeper.Watched())
+
+    def testApplyAfterAdoption(self):
+        containers = run_containers.LoadManifest(MANIFEST)
+        adopted = run_containers.AdoptContainers(
+            self.backend, self.keeper, containers, self.records)
+        before = len(self.state.requests)
+        run_containers.ApplyContainers(self.backend, self.keeper, adopted,
+                                       containers)
+        self.assertEqual([], self.state.requests[before:])
+        self.assertEqual(self.ids, self.keeper.Watched())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,526 @@
+#!/usr/bin/python
+
+"""Tests for docker_backend."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from benchmarks import apply_benchmark
+from benchmarks import fake_docker_cli
+from container_agent import docker_backend
+from container_agent import image_cache
+from container_agent import metrics
+from container_agent import pause_image
+from container_agent import run_containers
+from container_agent import tracing
+from tests import fake_docker
+
+
+def NewContainer():
+    ctr = run_containers.Container('abc123', 'foo/bar:1.0')
+    ctr.command = ['one', 'two']
+    ctr.hostname = 'abc123'
+    ctr.working_dir = '/tmp'
+    ctr.ports = [(111, 2222, '/udp'), (80, 8080, '')]
+    ctr.mounts = ['/export/vol1:/mnt:ro']
+    ctr.env_vars = ['KEY=value str']
+    ctr.network_from = 'container:.net'
+    return ctr
+
+
+class DockerBackendTest(unittest.TestCase):
+
+    def testRunArgs(self):
+        self.assertEqual(
+            ['--name', 'abc123',
+             '--hostname', 'abc123',
+             '--workdir', '/tmp',
+             '--net', 'container:.net',
+             '-p', '111:2222/udp', '-p', '80:8080',
+             '-v', '/export/vol1:/mnt:ro',
+             '-e', 'KEY=value str',
+             'foo/bar:1.0', 'one', 'two'],
+            docker_backend.RunArgs(NewContainer()))
+
+    def testRunArgsLabels(self):
+        ctr = run_containers.Container('abc123', 'foo/bar')
+        ctr.labels = {'b': '2', 'a': '1'}
+        self.assertEqual(['--name', 'abc123',
+                          '--label', 'a=1', '--label', 'b=2', 'foo/bar'],
+                         docker_backend.RunArgs(ctr))
+
+    def testRunArgsResources(self):
+        ctr = run_containers.Container('abc123', 'foo/bar')
+        ctr.cpu_shares = 512
+        ctr.cpuset = '0-1'
+        ctr.memory = 64 * 1024 * 1024
+        self.assertEqual(['--name', 'abc123', '--cpu-shares', '512',
+                          '--cpuset-cpus', '0-1', '--memory', '67108864',
+                          'foo/bar'],
+                         docker_backend.RunArgs(ctr))
+
+    def testRunArgsHostNetwork(self):
+        ctr = run_containers.Container('abc123', 'foo/bar')
+        ctr.network_from = 'host'
+        ctr.ports = [(80, 80, '')]
+        self.assertEqual(['--name', 'abc123', '--net', 'host', 'foo/bar'],
+                         docker_backend.RunArgs(ctr))
+        config = docker_backend.CreateConfig(ctr)
+        self.assertEqual({}, config['ExposedPorts'])
+        self.assertEqual({}, config['HostConfig']['PortBindings'])
+        self.assertEqual('host', config['HostConfig']['NetworkMode'])
+
+    def testRunArgsMinimal(self):
+        ctr = run_containers.Container('abc123', 'foo/bar')
+        self.assertEqual(['--name', 'abc123', 'foo/bar'],
+                         docker_backend.RunArgs(ctr))
+
+    def testCreateConfig(self):
+        config = docker_backend.CreateConfig(NewContainer())
+        self.assertEqual('foo/bar:1.0', config['Image'])
+        self.assertEqual(['one', 'two'], config['Cmd'])
+        self.assertEqual('abc123', config['Hostname'])
+        self.assertEqual('/tmp', config['WorkingDir'])
+        self.assertEqual(['KEY=value str'], config['Env'])
+        self.assertEqual({'2222/udp': {}, '8080/tcp': {}},
+                         config['ExposedPorts'])
+        self.assertEqual({'2222/udp': [{'HostPort': '111'}],
+                          '8080/tcp': [{'HostPort': '80'}]},
+                         config['HostConfig']['PortBindings'])
+        self.assertEqual(['/export/vol1:/mnt:ro'],
+                         config['HostConfig']['Binds'])
+        self.assertEqual('container:.net',
+                         config['HostConfig']['NetworkMode'])
+
+    def testCreateConfigResources(self):
+        ctr = run_containers.Container('abc123', 'foo/bar')
+        ctr.cpu_shares = 512
+        ctr.cpuset = '0-1'
+        ctr.memory = 64 * 1024 * 1024
+        host_config = docker_backend.CreateConfig(ctr)['HostConfig']
+        self.assertEqual(512, host_config['CpuShares'])
+        self.assertEqual('0-1', host_config['CpusetCpus'])
+        self.assertEqual(64 * 1024 * 1024, host_config['Memory'])
+
+    def testCreateConfigMinimal(self):
+        config = docker_backend.CreateConfig(
+            run_containers.Container('abc123', 'foo/bar'))
+        self.assertIsNone(config['Cmd'])
+        self.assertNotIn('Hostname', config)
+        self.assertNotIn('WorkingDir', config)
+        self.assertNotIn('NetworkMode', config['HostConfig'])
+        self.assertNotIn('CpuShares', config['HostConfig'])
+        self.assertNotIn('Memory', config['HostConfig'])
+
+    def testSplitImage(self):
+        self.assertEqual(('busybox', 'latest'),
+                         docker_backend.SplitImage('busybox'))
+        self.assertEqual(('foo/bar', '1.0'),
+                         docker_backend.SplitImage('foo/bar:1.0'))
+        self.assertEqual(('localhost:5000/my/app', 'latest'),
+                         docker_backend.SplitImage('localhost:5000/my/app'))
+        self.assertEqual(('localhost:5000/my/app', 'v2'),
+                         docker_backend.SplitImage('localhost:5000/my/app:v2'))
+
+    def testParseTime(self):
+        self.assertEqual(1401624000, docker_backend.ParseTime(
+            '2014-06-01T12:00:00.123456789Z'))
+        self.assertEqual(0, docker_backend.ParseTime(None))
+
+    def testParseCliEvent(self):
+        ctr_id = 'f' * 64
+        self.assertEqual(
+            {'status': 'die', 'id': ctr_id},
+            docker_backend.ParseCliEvent(
+                '[2014-06-10 12:00:00 +0000 UTC] %s: (from busybox:latest) '
+                'die\n' % ctr_id))
+        self.assertEqual(
+            {'status': 'die', 'id': ctr_id},
+            docker_backend.ParseCliEvent(
+                '2016-03-01T12:00:00.000000000Z container die %s '
+                '(exitCode=1, image=busybox, name=abc123)\n' % ctr_id))
+        self.assertIsNone(docker_backend.ParseCliEvent(
+            '2016-03-01T12:00:00.000000000Z network connect 1234\n'))
+
+    def testParseApiEvent(self):
+        self.assertEqual(
+            {'status': 'die', 'id': 'abc'},
+            docker_backend.ParseApiEvent(
+                {'status': 'die', 'id': 'abc', 'from': 'busybox'}))
+        self.assertEqual(
+            {'status': 'die', 'id': 'abc'},
+            docker_backend.ParseApiEvent(
+                {'Type': 'container', 'Action': 'die',
+                 'Actor': {'ID': 'abc'}}))
+
+    def testNewBackend(self):
+        self.assertIsInstance(
+            docker_backend.NewBackend(docker_backend.BACKEND_CLI),
+            docker_backend.CliBackend)
+        self.assertIsInstance(
+            docker_backend.NewBackend(docker_backend.BACKEND_API),
+            docker_backend.ApiBackend)
+        self.assertIsInstance(
+            docker_backend.NewBackend(docker_backend.BACKEND_AUTO,
+                                      socket_path='/nonexistent.sock'),
+            docker_backend.CliBackend)
+        with self.assertRaises(ValueError):
+            docker_backend.NewBackend('carrier-pigeon')
+
+
+class ApiBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = fake_docker.FakeDockerServer().Start()
+        self.state = self.server.state
+        self.backend = docker_backend.ApiBackend(self.server.socket_path)
+
+    def tearDown(self):
+        self.backend.Close()
+        self.server.Stop()
+
+    def testPull(self):
+        self.backend.Pull('foo/bar:1.0')
+        self.assertIn('foo/bar:1.0', self.state.images)
+
+    def testPullStreamedError(self):
+        self.state.pull_errors['foo/bar:latest'] = 'not found'
+        with self.assertRaises(docker_backend.DockerError):
+            self.backend.Pull('foo/bar')
+
+    def testRunCreatesAndStarts(self):
+        ctr_id = self.backend.Run(NewContainer())
+        info = self.backend.Inspect('abc123')
+        self.assertEqual(ctr_id, info['Id'])
+        self.assertTrue(info['State']['Running'])
+        self.assertEqual(['one', 'two'], info['Config']['Cmd'])
+        self.assertIn(('POST', '/containers/%s/start' % ctr_id),
+                      self.state.requests)
+
+    def testRunNameConflict(self):
+        self.backend.Run(NewContainer())
+        with self.assertRaises(docker_backend.DockerError):
+            self.backend.Run(NewContainer())
+
+    def testKillAndRemove(self):
+        self.backend.Run(NewContainer())
+        self.backend.Kill('abc123')
+        self.assertFalse(self.backend.Inspect('abc123')['State']['Running'])
+        self.assertEqual(137, self.backend.Wait('abc123'))
+        self.backend.Remove('abc123')
+        self.assertIsNone(self.backend.Inspect('abc123'))
+
+    def testKillAndRemoveMissingAreHarmless(self):
+        self.backend.Kill('nope')
+        self.backend.Remove('nope')
+
+    def testRestart(self):
+        self.backend.Run(NewContainer())
+        self.backend.Kill('abc123')
+        self.backend.Restart('abc123')
+        self.assertTrue(self.backend.Inspect('abc123')['State']['Running'])
+
+    def testConnectionIsReused(self):
+        self.backend.Pull('busybox')
+        self.backend.Run(NewContainer())
+        self.backend.Inspect('abc123')
+        self.backend.Kill('abc123')
+        self.backend.Remove('abc123')
+        self.assertEqual(1, self.state.connections)
+
+    def testStaleConnectionIsReplaced(self):
+        self.backend.Pull('busybox')
+        for conn in self.backend.pool.idle:
+            conn.sock.close()
+        self.backend.Pull('busybox')
+        self.assertEqual(2, self.state.connections)
+
+    def testImageId(self):
+        self.assertIsNone(self.backend.ImageId('foo/bar:1.0'))
+        self.state.AddImage('foo/bar:1.0', 'sha256:abc')
+        self.assertEqual('sha256:abc', self.backend.ImageId('foo/bar:1.0'))
+
+    def _RunContainers(self, specs, cache=None):
+        user = run_containers.LoadUserContainers(specs, [])
+        infra = run_containers.LoadInfraContainers(user)
+        return run_containers.RunContainers(self.backend, infra + user,
+                                            cache=cache)
+
+    def _Pulled(self):
+        return [name for method, name in self.state.requests
+                if (method, name) == ('POST', '/images/create')]
+
+    def _Created(self):
+        return [name for method, name in self.state.requests
+                if (method, name) == ('POST', '/containers/create')]
+
+    def testEvents(self):
+        ctr_id = self.backend.Run(NewContainer())
+        events = self.backend.Events()
+        self.backend.Kill('abc123')
+        self.assertEqual({'status': 'die', 'id': ctr_id}, next(events))
+        self.backend.Remove('abc123')
+        self.assertEqual({'status': 'destroy', 'id': ctr_id}, next(events))
+        events.close()
+
+    def testListContainers(self):
+        self.backend.Run(NewContainer())
+        other = run_containers.Container('abc124', 'foo/bar')
+        other.labels = {'a': 'b'}
+        other_id = self.backend.Run(other)
+        self.assertEqual([(other_id, 'abc124')],
+                         self.backend.ListContainers('a'))
+        self.assertEqual([], self.backend.ListContainers('c'))
+
+    def testListAndRemoveImages(self):
+        self.state.AddImage('foo/bar:1.0')
+        image_id = self.state.images['foo/bar:1.0']
+        self.state.image_sizes[image_id] = 123
+        self.assertEqual([{'Id': image_id, 'Size': 123, 'Created': 0}],
+                         self.backend.ListImages())
+        self.backend.RemoveImage(image_id)
+        self.assertEqual([], self.backend.ListImages())
+        with self.assertRaises(docker_backend.DockerError):
+            self.backend.RemoveImage(image_id)
+
+    def testLogs(self):
+        self.backend.Run(NewContainer())
+        big = b'x' * (docker_backend.LOG_READ_SIZE + 1)
+        self.state.AddOutput('abc123', docker_backend.STDOUT, b'hello\n')
+        self.state.AddOutput('abc123', docker_backend.STDERR, big)
+        self.state.AddOutput('abc123', docker_backend.STDOUT, b'old\n',
+                             when=0)
+        stream = self.backend.Logs('abc123', since=1)
+        self.backend.Kill('abc123')
+        self.assertEqual(
+            [(docker_backend.STDOUT, b'hello\n'),
+             (docker_backend.STDERR, big[:docker_backend.LOG_READ_SIZE]),
+             (docker_backend.STDERR, b'x')],
+            list(stream))
+
+    def testLogsClose(self):
+        self.backend.Run(NewContainer())
+        stream = self.backend.Logs('abc123')
+        stream.Close()
+        self.assertEqual([], list(stream))
+
+    def testLogsMissing(self):
+        with self.assertRaises(docker_backend.DockerError):
+            self.backend.Logs('nope')
+
+    def testRunContainers(self):
+        ctr_ids = self._RunContainers([{'name': 'abc123', 'image': 'foo/bar',
+                                        'ports': [{'containerPort': 80}]}])
+        self.assertEqual(['.net', 'abc123'], sorted(ctr_ids))
+        self.assertEqual(pause_image.Tarball(),
+                         self.state.imports[pause_image.IMAGE])
+        self.assertIn('foo/bar:latest', self.state.images)
+        net = self.backend.Inspect('.net')
+        self.assertEqual({'80/tcp': [{'HostPort': '80'}]},
+                         net['HostConfig']['PortBindings'])
+        ctr = self.backend.Inspect('abc123')
+        self.assertEqual('container:.net', ctr['HostConfig']['NetworkMode'])
+
+    def testRunContainersIsTimed(self):
+        seconds = metrics.DOCKER_SECONDS
+        before = [seconds.Count(op, 'metrics/timed')
+                  for op in ('pull', 'kill', 'rm', 'run')]
+        self._RunContainers([{'name': 'abc123', 'image': 'metrics/timed'}])
+        self.assertEqual([n + 1 for n in before],
+                         [seconds.Count(op, 'metrics/timed')
+                          for op in ('pull', 'kill', 'rm', 'run')])
+
+    def testRunContainersIsTraced(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'trace.jsonl')
+        tracing.TRACER.Open(path)
+        try:
+            with tracing.Span('apply'):
+                self._RunContainers([{'name': 'abc123',
+                                      'image': 'foo/bar'}])
+        finally:
+            tracing.TRACER.Close()
+        with open(path) as f:
+            spans = [json.loads(line) for line in f]
+        self.assertEqual(1, len(set(span['trace_id'] for span in spans)))
+        names = [span['name'] for span in spans]
+        for name in ('load_user_containers', 'pull', 'pull_attempt',
+                     'start_container', 'docker_api'):
+            self.assertIn(name, names)
+        started = [span['attributes'] for span in spans
+                   if span['name'] == 'start_container']
+        self.assertIn({'container': 'abc123', 'image': 'foo/bar'}, started)
+
+    def testRunContainersLeavesUpToDateAlone(self):
+        specs = [{'name': 'abc123', 'image': 'foo/bar'},
+                 {'name': 'abc124', 'image': 'foo/bar'}]
+        self._RunContainers(specs)
+        self.assertEqual(3, len(self._Created()))
+        ids = [self.backend.Inspect(n)['Id'] for n in ('.net', 'abc123')]
+        self._RunContainers(specs)
+        self.assertEqual(3, len(self._Created()))
+        self.assertEqual(
+            ids, [self.backend.Inspect(n)['Id'] for n in ('.net', 'abc123')])
+
+    def testRunContainersRecreatesChanged(self):
+        self._RunContainers([{'name': 'abc123', 'image': 'foo/bar'},
+                             {'name': 'abc124', 'image': 'foo/bar'}])
+        old_id = self.backend.Inspect('abc124')['Id']
+        self._RunContainers([{'name': 'abc123', 'image': 'foo/bar'},
+                             {'name': 'abc124', 'image': 'foo/bar',
+                              'env': [{'key': 'A', 'value': 'b'}]}])
+        self.assertEqual(4, len(self._Created()))
+        self.assertNotEqual(old_id, self.backend.Inspect('abc124')['Id'])
+
+    def testRunContainersRecreatesStopped(self):
+        self._RunContainers([{'name': 'abc123', 'image': 'foo/bar'}])
+        self.backend.Kill('abc123')
+        self._RunContainers([{'name': 'abc123', 'image': 'foo/bar'}])
+        self.assertEqual(3, len(self._Created()))
+
+    def testRunContainersRecreatesNetworkJoiners(self):
+        self._RunContainers([{'name': 'abc123', 'image': 'foo/bar'}])
+        # A new port changes only the .net container, but abc123 has to
+        # rejoin the new network namespace.
+        self._RunContainers([{'name': 'abc123', 'image': 'foo/bar',
+                              'ports': [{'containerPort': 80}]}])
+        self.assertEqual(4, len(self._Created()))
+
+    def testRunContainersWarmStoreSkipsRegistry(self):
+        self.state.AddImage(pause_image.IMAGE)
+        self.state.AddImage('foo/bar:1.0')
+        self._RunContainers([{'name': 'abc123', 'image': 'foo/bar:1.0'},
+                             {'name': 'abc124', 'image': 'foo/bar:1.0'}])
+        self.assertEqual([], self._Pulled())
+        self.assertEqual(3, len(self._Created()))
+
+    def testRunContainersPullsSharedImageOnce(self):
+        self._RunContainers([{'name': 'abc123', 'image': 'foo/bar'},
+                             {'name': 'abc124', 'image': 'foo/bar'},
+                             {'name': 'abc125', 'image': 'foo/bar:1.0'}])
+        # The pause image (imported, not pulled), foo/bar and foo/bar:1.0.
+        self.assertEqual(3, len(self._Pulled()))
+
+    def testRunContainersPullPolicies(self):
+        self.state.AddImage(pause_image.IMAGE)
+        self.state.AddImage('foo/bar')
+        self._RunContainers([{'name': 'abc123', 'image': 'foo/bar',
+                              'imagePullPolicy': 'IfNotPresent'}])
+        self.assertEqual([], self._Pulled())
+        self._RunContainers([{'name': 'abc123', 'image': 'foo/bar',
+                              'imagePullPolicy': 'Always'}])
+        self.assertEqual(1, len(self._Pulled()))
+
+    def testRunContainersNeverPullsMissingImage(self):
+        with self.assertRaises(SystemExit):
+            self._RunContainers([{'name': 'abc123', 'image': 'foo/bar',
+                                  'imagePullPolicy': 'Never'}])
+        self.assertNotIn('foo/bar:latest', self.state.images)
+
+    def testRunContainersSharesCache(self):
+        cache = image_cache.ImageCache(self.backend)
+        specs = [{'name': 'abc123', 'image': 'foo/bar:1.0'}]
+        self._RunContainers(specs, cache)
+        lookups = len(self.state.requests)
+        self._RunContainers(specs, cache)
+        # Only the containers are inspected the second time.
+        self.assertEqual(
+            [('GET', '/containers/.net/json'),
+             ('GET', '/containers/abc123/json')],
+            self.state.requests[lookups:])
+
+    def testRunContainersStartsDependenciesFirst(self):
+        self._RunContainers([{'name': 'abc123', 'image': 'foo/bar',
+                              'dependsOn': ['abc124']},
+                             {'name': 'abc124', 'image': 'foo/bar'},
+                             {'name': 'abc125', 'image': 'foo/bar'}])
+        started = [self.state.containers[path.split('/')[2]]['Name']
+                   for method, path in self.state.requests
+                   if method == 'POST' and path.endswith('/start')]
+        self.assertEqual('/.net', started[0])
+        self.assertTrue(started.index('/abc124') < started.index('/abc123'))
+        self.assertEqual(4, len(started))
+
+    def testRunContainersGroups(self):
+        containers = run_containers.LoadConfig({
+            'version': 'v1beta1',
+            'groups': [
+                {'name': 'one', 'containers': [
+                    {'name': 'abc123', 'image': 'foo/bar',
+                     'ports': [{'containerPort': 80}]}]},
+                {'name': 'two', 'containers': [
+                    {'name': 'abc123', 'image': 'foo/bar',
+                     'ports': [{'containerPort': 80, 'hostPort': 81}]}]},
+            ]})
+        ctr_ids = run_containers.RunContainers(self.backend, containers)
+        self.assertEqual(['.net.one', '.net.two', 'one.abc123', 'two.abc123'],
+                         sorted(ctr_ids))
+        ctr = self.backend.Inspect('two.abc123')
+        self.assertEqual('abc123', ctr['Config']['Hostname'])
+        self.assertEqual('container:.net.two',
+                         ctr['HostConfig']['NetworkMode'])
+
+    def testInjectedFailure(self):
+        self.state.failure_rates['create'] = 1
+        with self.assertRaises(docker_backend.DockerError):
+            self.backend.Run(NewContainer())
+        self.assertIsNone(self.backend.Inspect('abc123'))
+
+
+class CliBackendTest(unittest.TestCase):
+
+    """Drives the fake daemon through benchmarks/fake_docker_cli.py."""
+
+    def setUp(self):
+        self.server = fake_docker.FakeDockerServer().Start()
+        self.state = self.server.state
+        self.tmpdir = tempfile.mkdtemp()
+        self.fork_log = os.path.join(self.tmpdir, 'forks')
+        self.backend = docker_backend.CliBackend(apply_benchmark.NewCliShim(
+            self.tmpdir, self.server.socket_path, self.fork_log))
+
+    def tearDown(self):
+        self.server.Stop()
+        shutil.rmtree(self.tmpdir)
+
+    def testParseRunArgs(self):
+        ctr = NewContainer()
+        ctr.labels = {'a': 'b=c'}
+        ctr.cpu_shares = 512
+        ctr.cpuset = '0,2'
+        ctr.memory = 64 * 1024 * 1024
+        parsed = fake_docker_cli.ParseRunArgs(docker_backend.RunArgs(ctr))
+        self.assertEqual(docker_backend.RunArgs(ctr),
+                         docker_backend.RunArgs(parsed))
+
+    def testLifecycle(self):
+        self.backend.Pull('foo/bar:1.0')
+        self.assertIsNotNone(self.backend.ImageId('foo/bar:1.0'))
+        ctr_id = self.backend.Run(NewContainer())
+        self.assertEqual(ctr_id, self.backend.Inspect('abc123')['Id'])
+        self.backend.Kill('abc123')
+        self.backend.Remove('abc123')
+        self.assertIsNone(self.backend.Inspect('abc123'))
+        with open(self.fork_log) as f:
+            self.assertEqual(7, len(f.readlines()))
+
+    def testInspectWithDaemonDown(self):
+        down = os.path.join(self.tmpdir, 'down')
+        os.mkdir(down)
+        backend = docker_backend.CliBackend(apply_benchmark.NewCliShim(
+            down, os.path.join(down, 'docker.sock'), self.fork_log))
+        with self.assertRaises(docker_backend.DockerError):
+            backend.Inspect('abc123')
+
+    def testImportImage(self):
+        self.backend.ImportImage(pause_image.IMAGE, pause_image.Tarball())
+        self.assertEqual(pause_image.Tarball(),
+                         self.state.imports[pause_image.IMAGE])
+        self.assertIsNotNone(self.backend.ImageId(pause_image.IMAGE))
+
+
+if __name__ == '__main__':
+    unittest.main()
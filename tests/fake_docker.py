@@ -0,0 +1,376 @@
+"""A fake Docker daemon serving the Remote API on a unix socket.
+
+Each operation can be given a latency, and a rate at which it fails with an
+HTTP 500, so that benchmarks can model a slow or flaky daemon.  Operations
+are named by Operation().
+"""
+
+import json
+import os
+import random
+import shutil
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+try:
+    from urllib.parse import parse_qs, unquote, urlparse
+except ImportError:
+    from urllib import unquote
+    from urlparse import parse_qs, urlparse
+
+
+class FakeDockerState(object):
+
+    """What the fake daemon knows: images, containers and a request log."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.events = []          # [{'status': ..., 'id': ...}]
+        self.images = {}          # name -> image id
+        self.image_sizes = {}     # image id -> bytes
+        self.image_created = {}   # image id -> seconds since the epoch
+        self.containers = {}      # id -> inspect dict
+        self.names = {}           # name -> id
+        self.requests = []        # [(method, path)]
+        self.output = {}          # id -> [(time, stream, bytes)]
+        self.connections = 0
+        self.pull_errors = {}     # image -> error message
+        self.imports = {}         # image -> the tarball it was imported from
+        self.latency = {}         # operation -> seconds
+        self.failure_rates = {}   # operation -> probability of an HTTP 500
+        self.rng = random.Random(0)
+        self.next_id = 1
+
+    def AddImage(self, image, image_id=None):
+        if ':' not in image.rpartition('/')[2]:
+            image += ':latest'
+        if image_id is None:
+            image_id = self.images.get(image, 'sha256:%064x' % self.next_id)
+            self.next_id += 1
+        self.images[image] = image_id
+
+    def Emit(self, status, ctr_id):
+        """Records an event; the caller holds the lock."""
+        self.events.append({'status': status, 'id': ctr_id,
+                            'from': self.containers[ctr_id]['Config']['Image'],
+                            'time': len(self.events)})
+        self.changed.notify_all()
+
+    def AddOutput(self, name, stream, data, when=None):
+        """Has a container write to stdout (1) or stderr (2)."""
+        with self.lock:
+            ctr_id = self.Find(name)['Id']
+            self.output.setdefault(ctr_id, []).append(
+                (time.time() if when is None else when, stream, data))
+            self.changed.notify_all()
+
+    def Find(self, name):
+        if name in self.names:
+            return self.containers[self.names[name]]
+        for ctr_id, info in self.containers.items():
+            if ctr_id.startswith(name):
+                return info
+        return None
+
+
+def Operation(method, parts):
+    """Names an API call, e.g. 'pull', 'create', 'start' or 'inspect'."""
+    if parts[0] == 'images':
+        if method == 'DELETE':
+            return 'image_remove'
+        return 'pull' if method == 'POST' else 'image_inspect'
+    if parts[0] == 'containers':
+        if method == 'DELETE':
+            return 'remove'
+        if method == 'GET':
+            return 'inspect'
+        return parts[-1]
+    return parts[0]
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _Reply(self, status, body=None):
+        data = b''
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        # As docker does, a 204 comes with neither a body nor its length.
+        if status != 204:
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        # The client has the whole of an empty response already, and may
+        # have hung up.
+        if data:
+            self.wfile.write(data)
+
+    def _Body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return None
+        data = self.rfile.read(length)
+        if self.headers.get('Content-Type') != 'application/json':
+            return data
+        return json.loads(data.decode('utf-8'))
+
+    def _Dispatch(self, method):
+        state = self.server.state
+        url = urlparse(self.path)
+        query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        parts = [unquote(p) for p in url.path.strip('/').split('/')]
+        if (method, parts) == ('GET', ['events']):
+            # This streams for as long as the client stays connected, so it
+            # takes the lock only while waiting for news.
+            return self._StreamEvents(state)
+        if method == 'GET' and parts[0] == 'containers' and \
+                parts[-1] == 'logs':
+            return self._StreamLogs(state, parts[1], query)
+        # The latency is served outside the lock, so that concurrent calls
+        # overlap as they would against a real daemon.
+        op = Operation(method, parts)
+        if state.latency.get(op):
+            time.sleep(state.latency[op])
+        if state.rng.random() < state.failure_rates.get(op, 0):
+            self._Body()
+            with state.lock:
+                state.requests.append((method, url.path))
+            return self._Reply(500, {'message': 'injected failure'})
+        with state.lock:
+            state.requests.append((method, url.path))
+            body = self._Body()
+            handler = getattr(self, '_%s_%s' % (method, parts[0]), None)
+            if handler is None:
+                return self._Reply(404, {'message': 'no such endpoint'})
+            return handler(state, parts[1:], query, body)
+
+    def do_GET(self):
+        self._Dispatch('GET')
+
+    def do_POST(self):
+        self._Dispatch('POST')
+
+    def do_DELETE(self):
+        self._Dispatch('DELETE')
+
+    def _StreamEvents(self, state):
+        with state.lock:
+            state.requests.append(('GET', '/events'))
+            sent = len(state.events)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self.wfile.flush()
+        while True:
+            with state.lock:
+                while sent == len(state.events):
+                    state.changed.wait(0.05)
+                    if self.server.stopping:
+                        return
+                news = state.events[sent:]
+                sent = len(state.events)
+            try:
+                for event in news:
+                    data = (json.dumps(event) + '\n').encode('utf-8')
+                    self.wfile.write(('%x\r\n' % len(data)).encode('ascii'))
+                    self.wfile.write(data + b'\r\n')
+                self.wfile.flush()
+            except IOError:
+                return
+
+    def _StreamLogs(self, state, name, query):
+        """Follows a container's output, multiplexed as docker does, until
+        the container stops."""
+        since = int(query.get('since', 0))
+        with state.lock:
+            state.requests.append(('GET', '/containers/%s/logs' % name))
+            info = state.Find(name)
+            if info is None:
+                return self._Reply(404, {'message': 'no such container'})
+            ctr_id = info['Id']
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.docker.raw-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.flush()
+        sent = 0
+        while True:
+            with state.lock:
+                while (sent == len(state.output.get(ctr_id, [])) and
+                       state.containers.get(ctr_id, {}).get(
+                           'State', {}).get('Running')):
+                    state.changed.wait(0.05)
+                    if self.server.stopping:
+                        return
+                output = state.output.get(ctr_id, [])
+                news = output[sent:]
+                sent = len(output)
+            if not news:
+                # It stopped, and everything it wrote has been sent.
+                return
+            try:
+                for when, stream, data in news:
+                    if when >= since:
+                        self.wfile.write(struct.pack('>BxxxL', stream,
+                                                     len(data)) + data)
+                self.wfile.flush()
+            except IOError:
+                return
+
+    def _POST_images(self, state, parts, query, body):
+        if query.get('fromSrc') == '-':
+            image = '%s:%s' % (query['repo'], query.get('tag', 'latest'))
+            state.AddImage(image)
+            state.imports[image] = body
+            return self._Reply(200, {'status': state.images[image]})
+        image = '%s:%s' % (query['fromImage'], query.get('tag', 'latest'))
+        if image in state.pull_errors:
+            lines = [{'status': 'Pulling'},
+                     {'error': state.pull_errors[image]}]
+        else:
+            state.AddImage(image)
+            lines = [{'status': 'Pulling'}, {'status': 'Downloaded'}]
+        data = ''.join(json.dumps(line) + '\r\n' for line in lines)
+        data = data.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _GET_images(self, state, parts, query, body):
+        if parts == ['json']:
+            return self._Reply(200, [
+                {'Id': image_id, 'Size': state.image_sizes.get(image_id, 0),
+                 'Created': state.image_created.get(image_id, 0)}
+                for image_id in sorted(set(state.images.values()))])
+        image = '/'.join(parts[:-1])
+        if ':' not in image.rpartition('/')[2]:
+            image += ':latest'
+        if parts[-1] != 'json' or image not in state.images:
+            return self._Reply(404, {'message': 'no such image'})
+        return self._Reply(200, {'Id': state.images[image]})
+
+    def _POST_containers(self, state, parts, query, body):
+        if parts == ['create']:
+            name = query.get('name')
+            if name in state.names:
+                return self._Reply(409, {'message': 'name in use'})
+            ctr_id = '%064x' % state.next_id
+            state.next_id += 1
+            image = body.get('Image', '')
+            if ':' not in image.rpartition('/')[2]:
+                image += ':latest'
+            state.containers[ctr_id] = {
+                'Id': ctr_id,
+                'Name': '/' + name,
+                'Image': state.images.get(image),
+                'Config': body,
+                'HostConfig': body.get('HostConfig', {}),
+                'State': {'Running': False, 'ExitCode': 0},
+            }
+            state.names[name] = ctr_id
+            return self._Reply(201, {'Id': ctr_id})
+
+        info = state.Find(parts[0])
+        if info is None:
+            return self._Reply(404, {'message': 'no such container'})
+        action = parts[1]
+        if action in ('start', 'restart'):
+            info['State']['Running'] = True
+            state.Emit(action, info['Id'])
+            return self._Reply(204)
+        if action == 'kill':
+            if info['State']['Running']:
+                info['State']['Running'] = False
+                info['State']['ExitCode'] = 137
+                state.Emit('die', info['Id'])
+            return self._Reply(204)
+        if action == 'wait':
+            return self._Reply(200, {'StatusCode': info['State']['ExitCode']})
+        return self._Reply(404, {'message': 'no such action'})
+
+    def _GET_containers(self, state, parts, query, body):
+        if parts == ['json']:
+            labels = json.loads(query.get('filters', '{}')).get('label', [])
+            return self._Reply(200, [
+                {'Id': ctr_id, 'Names': [info['Name']]}
+                for ctr_id, info in sorted(state.containers.items())
+                if all(label in (info['Config'].get('Labels') or {})
+                       for label in labels)])
+        info = state.Find(parts[0])
+        if info is None:
+            return self._Reply(404, {'message': 'no such container'})
+        return self._Reply(200, info)
+
+    def _DELETE_images(self, state, parts, query, body):
+        image_id = parts[0]
+        if image_id not in state.images.values():
+            return self._Reply(404, {'message': 'no such image'})
+        if any(info.get('Image') == image_id
+               for info in state.containers.values()):
+            return self._Reply(409, {'message': 'image is in use'})
+        for name, named_id in list(state.images.items()):
+            if named_id == image_id:
+                del state.images[name]
+        return self._Reply(200, [{'Deleted': image_id}])
+
+    def _DELETE_containers(self, state, parts, query, body):
+        info = state.Find(parts[0])
+        if info is None:
+            return self._Reply(404, {'message': 'no such container'})
+        state.Emit('destroy', info['Id'])
+        del state.containers[info['Id']]
+        del state.names[info['Name'][1:]]
+        return self._Reply(204)
+
+
+class FakeDockerServer(socketserver.ThreadingMixIn,
+                       socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmpdir, 'docker.sock')
+        self.state = FakeDockerState()
+        self.stopping = False
+        socketserver.UnixStreamServer.__init__(self, self.socket_path,
+                                               FakeDockerHandler)
+
+    def get_request(self):
+        request = socketserver.UnixStreamServer.get_request(self)
+        with self.state.lock:
+            self.state.connections += 1
+        return request
+
+    def Start(self):
+        thread = threading.Thread(target=self.serve_forever,
+                                  kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def Stop(self):
+        self.stopping = True
+        self.shutdown()
+        self.server_close()
+        shutil.rmtree(self.tmpdir)
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+
+"""Tests for garbage_collector."""
+
+import time
+import unittest
+from container_agent import docker_backend
+from container_agent import garbage_collector
+from container_agent import image_cache
+from container_agent import metrics
+from container_agent import run_containers
+from container_agent import supervisor
+from tests import fake_docker
+
+
+MANIFEST = """
+version: v1beta1
+containers:
+  - name: one
+    image: foo/one
+  - name: two
+    image: foo/two
+"""
+
+
+class GarbageCollectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = fake_docker.FakeDockerServer().Start()
+        self.state = self.server.state
+        self.backend = docker_backend.ApiBackend(self.server.socket_path)
+        self.cache = image_cache.ImageCache(self.backend)
+        self.keeper = supervisor.Supervisor(self.backend)
+        self.usage = [50.0]
+        self.gc = garbage_collector.GarbageCollector(
+            self.backend, self.cache, '/docker', high_water=80, low_water=60,
+            disk_usage=self._DiskUsage, clock=lambda: 1000)
+        self.containers = run_containers.LoadManifest(MANIFEST)
+        run_containers.ApplyContainers(self.backend, self.keeper, {},
+                                       self.containers, cache=self.cache)
+
+    def tearDown(self):
+        self.backend.Close()
+        self.server.Stop()
+
+    def _DiskUsage(self, path):
+        self.assertEqual('/docker', path)
+        return self.usage[0]
+
+    def _AddImage(self, image, size, created):
+        self.state.AddImage(image)
+        image_id = self.state.images[image + ':latest']
+        self.state.image_sizes[image_id] = size
+        self.state.image_created[image_id] = created
+        return image_id
+
+    def _FreeOnRemove(self):
+        # Removing an image frees its share of the disk.
+        real_remove = self.backend.RemoveImage
+
+        def RemoveImage(removed_id):
+            real_remove(removed_id)
+            self.usage[0] -= self.state.image_sizes[removed_id]
+        self.backend.RemoveImage = RemoveImage
+
+    def testOrphansAreRemoved(self):
+        removed = self.gc.CollectContainers(
+            [ctr for ctr in self.containers if ctr.name != 'two'],
+            self.keeper)
+        self.assertEqual(['two'], removed)
+        self.assertIsNone(self.backend.Inspect('two'))
+        self.assertNotIn('two', self.keeper.Watched())
+        self.assertIsNotNone(self.backend.Inspect('one'))
+
+    def testUnlabelledContainersAreLeftAlone(self):
+        self.backend.Run(run_containers.Container('stranger', 'foo/bar'))
+        self.assertEqual([], self.gc.CollectContainers(self.containers))
+        self.assertIsNotNone(self.backend.Inspect('stranger'))
+
+    def testOrphansAreRemovedInParallel(self):
+        self.state.latency = {'kill': 0.2}
+        start = time.time()
+        self.assertEqual(['.net', 'one', 'two'],
+                         self.gc.CollectContainers([]))
+        self.assertLess(time.time() - start, 0.5)
+
+    def testImagesAreKeptBelowHighWater(self):
+        self._AddImage('foo/old', 10, 1)
+        self.usage[0] = 80
+        self.assertEqual([], self.gc.CollectImages(self.containers))
+        self.assertIn('foo/old:latest', self.state.images)
+
+    def testLeastRecentlyUsedGoFirst(self):
+        old = self._AddImage('foo/old', 13, 1)
+        older = self._AddImage('foo/older', 13, 0)
+        newer = self._AddImage('foo/newer', 13, 2)
+        self._FreeOnRemove()
+        self.usage[0] = 85
+        # foo/newer was used by the manifest last time round.
+        self.gc.last_used[newer] = 500
+        self.assertEqual([older, old], self.gc.CollectImages(self.containers))
+        self.assertEqual(59, self.usage[0])
+        self.assertNotIn('foo/old:latest', self.state.images)
+        self.assertIn('foo/newer:latest', self.state.images)
+        self.assertIn('foo/one:latest', self.state.images)
+
+    def testImagesInUseAreKept(self):
+        self.usage[0] = 90
+        self.assertEqual([], self.gc.CollectImages(self.containers))
+        self.assertIn('foo/one:latest', self.state.images)
+        self.assertIn('foo/two:latest', self.state.images)
+
+    def testRemovedImagesAreForgotten(self):
+        old = self._AddImage('foo/old', 10, 1)
+        self.assertEqual(old, self.cache.ImageId('foo/old'))
+        self.usage[0] = 90
+        self.assertEqual([old], self.gc.CollectImages(self.containers))
+        self.assertIsNone(self.cache.ImageId('foo/old'))
+
+    def testCollect(self):
+        self.gc.Collect([], self.keeper)
+        self.assertEqual({}, self.keeper.Watched())
+
+    def testTimingsOfUnusedImagesAreDropped(self):
+        metrics.DOCKER_SECONDS.Observe(1, 'pull', 'foo/gone')
+        self.gc.Collect(self.containers, self.keeper)
+        images = [image for _, image in metrics.DOCKER_SECONDS.Labels()]
+        self.assertNotIn('foo/gone', images)
+        self.assertIn('foo/one', images)
+
+
+if __name__ == '__main__':
+    unittest.main()
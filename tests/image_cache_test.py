@@ -0,0 +1,159 @@
+#!/usr/bin/python
+
+"""Tests for image_cache."""
+
+import threading
+import time
+import unittest
+from container_agent import docker_backend
+from container_agent import image_cache
+
+
+class FakeBackend(object):
+
+    def __init__(self):
+        self.images = {}    # image -> image ID
+        self.lookups = []   # [image]
+
+    def ImageId(self, image):
+        self.lookups.append(image)
+        return self.images.get(image)
+
+
+class ImageCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = FakeBackend()
+        self.now = 1000.0
+        self.cache = image_cache.ImageCache(self.backend, ttl=60,
+                                            clock=lambda: self.now)
+
+    def testDefaultPullPolicy(self):
+        self.assertEqual(image_cache.PULL_ALWAYS,
+                         image_cache.DefaultPullPolicy('busybox'))
+        self.assertEqual(image_cache.PULL_ALWAYS,
+                         image_cache.DefaultPullPolicy('foo/bar:latest'))
+        self.assertEqual(image_cache.PULL_IF_NOT_PRESENT,
+                         image_cache.DefaultPullPolicy('foo/bar:1.0'))
+        self.assertEqual(
+            image_cache.PULL_IF_NOT_PRESENT,
+            image_cache.DefaultPullPolicy('localhost:5000/foo:1.0'))
+
+    def testStrongerPullPolicy(self):
+        self.assertEqual(image_cache.PULL_ALWAYS,
+                         image_cache.StrongerPullPolicy(
+                             image_cache.PULL_NEVER, image_cache.PULL_ALWAYS))
+        self.assertEqual(image_cache.PULL_IF_NOT_PRESENT,
+                         image_cache.StrongerPullPolicy(
+                             None, image_cache.PULL_IF_NOT_PRESENT))
+        self.assertIsNone(image_cache.StrongerPullPolicy(None, None))
+
+    def testImageIdIsCachedUntilTtl(self):
+        self.backend.images['foo:1'] = 'sha256:1'
+        self.assertEqual('sha256:1', self.cache.ImageId('foo:1'))
+        self.backend.images['foo:1'] = 'sha256:2'
+        self.now += 59
+        self.assertEqual('sha256:1', self.cache.ImageId('foo:1'))
+        self.assertEqual(1, len(self.backend.lookups))
+        self.now += 1
+        self.assertEqual('sha256:2', self.cache.ImageId('foo:1'))
+        self.assertEqual(2, len(self.backend.lookups))
+
+    def testAbsenceIsCached(self):
+        self.assertIsNone(self.cache.ImageId('foo:1'))
+        self.assertIsNone(self.cache.ImageId('foo:1'))
+        self.assertEqual(1, len(self.backend.lookups))
+
+    def testInvalidate(self):
+        self.cache.ImageId('foo:1')
+        self.backend.images['foo:1'] = 'sha256:1'
+        self.cache.Invalidate('foo:1')
+        self.assertEqual('sha256:1', self.cache.ImageId('foo:1'))
+
+    def testNeedsPull(self):
+        self.backend.images['foo:1'] = 'sha256:1'
+        for image, policy, expected in [
+                ('foo:1', image_cache.PULL_ALWAYS, True),
+                ('foo:1', image_cache.PULL_IF_NOT_PRESENT, False),
+                ('foo:1', image_cache.PULL_NEVER, False),
+                ('foo:2', image_cache.PULL_ALWAYS, True),
+                ('foo:2', image_cache.PULL_IF_NOT_PRESENT, True),
+                ('foo:2', image_cache.PULL_NEVER, False)]:
+            self.assertEqual(expected, self.cache.NeedsPull(image, policy),
+                             (image, policy))
+
+    def testInvalidateId(self):
+        self.backend.images['foo:1'] = 'sha256:1'
+        self.backend.images['foo:2'] = 'sha256:2'
+        self.cache.ImageId('foo:1')
+        self.cache.ImageId('foo:2')
+        self.cache.InvalidateId('sha256:1')
+        self.assertEqual((False, None), self.cache.Lookup('foo:1'))
+        self.assertEqual((True, 'sha256:2'), self.cache.Lookup('foo:2'))
+
+    def testPullRefreshesImageId(self):
+        self.assertIsNone(self.cache.ImageId('foo:1'))
+
+        def Pull():
+            self.backend.images['foo:1'] = 'sha256:1'
+            return 2.5
+
+        self.assertEqual(2.5, self.cache.Pull('foo:1', Pull))
+        self.assertEqual('sha256:1', self.cache.ImageId('foo:1'))
+
+    def testConcurrentPullsAreCoalesced(self):
+        started = threading.Event()
+        release = threading.Event()
+        pulls = []
+        results = []
+
+        def Pull():
+            pulls.append(1)
+            started.set()
+            release.wait()
+            return 1.0
+
+        def Caller():
+            results.append(self.cache.Pull('foo:1', Pull))
+
+        threads = [threading.Thread(target=Caller) for _ in range(4)]
+        threads[0].start()
+        started.wait()
+        for t in threads[1:]:
+            t.start()
+        # Give the others time to find the pull in flight.
+        time.sleep(0.05)
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(1, len(pulls))
+        self.assertEqual([1.0] * 4, results)
+        self.assertEqual({}, self.cache.flights)
+
+    def testPullErrorReachesEveryCaller(self):
+        release = threading.Event()
+        errors = []
+
+        def Pull():
+            release.wait()
+            raise docker_backend.DockerError('no such image')
+
+        def Caller():
+            try:
+                self.cache.Pull('foo:1', Pull)
+            except docker_backend.DockerError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=Caller) for _ in range(3)]
+        for t in threads:
+            t.start()
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(3, len(errors))
+        # A later pull is a new attempt.
+        self.assertEqual(1, self.cache.Pull('foo:1', lambda: 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
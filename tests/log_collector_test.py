@@ -0,0 +1,195 @@
+#!/usr/bin/python
+
+"""Tests for log_collector."""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from container_agent import docker_backend
+from container_agent import log_collector
+from container_agent import run_containers
+from tests import fake_docker
+
+
+def Read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def WaitFor(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class RotatingFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'stdout.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testRotates(self):
+        f = log_collector.RotatingFile(self.path, 4, 3)
+        f.Write(b'abcdefghij')
+        f.Write(b'klmn')
+        f.Close()
+        self.assertEqual(['stdout.log', 'stdout.log.1', 'stdout.log.2'],
+                         sorted(os.listdir(self.tmpdir)))
+        self.assertEqual(b'mn', Read(self.path))
+        self.assertEqual(b'ijkl', Read(self.path + '.1'))
+        self.assertEqual(b'efgh', Read(self.path + '.2'))
+
+    def testAppendsToExistingFile(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'abc')
+        f = log_collector.RotatingFile(self.path, 4, 2)
+        f.Write(b'de')
+        f.Close()
+        self.assertEqual(b'abcd', Read(self.path + '.1'))
+        self.assertEqual(b'e', Read(self.path))
+
+    def testSingleFile(self):
+        f = log_collector.RotatingFile(self.path, 4, 1)
+        f.Write(b'abcdef')
+        f.Close()
+        self.assertEqual(['stdout.log'], os.listdir(self.tmpdir))
+        self.assertEqual(b'ef', Read(self.path))
+
+
+class LogCollectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = fake_docker.FakeDockerServer().Start()
+        self.state = self.server.state
+        self.backend = docker_backend.ApiBackend(self.server.socket_path)
+        self.tmpdir = tempfile.mkdtemp()
+        self.collector = log_collector.LogCollector(self.backend, self.tmpdir)
+        self.old_delay = log_collector.REATTACH_DELAY
+        log_collector.REATTACH_DELAY = 0.01
+
+    def tearDown(self):
+        log_collector.REATTACH_DELAY = self.old_delay
+        self.collector.Stop()
+        self.backend.Close()
+        self.server.Stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _Run(self):
+        return self.backend.Run(run_containers.Container('abc123', 'foo/bar'))
+
+    def _Path(self, name):
+        return os.path.join(self.tmpdir, 'abc123', name)
+
+    def _Contains(self, name, data):
+        return lambda: (os.path.exists(self._Path(name)) and
+                        Read(self._Path(name)) == data)
+
+    def testCollectsBothStreams(self):
+        ctr_id = self._Run()
+        self.collector.Watch('abc123', ctr_id, log_collector.LogConfig())
+        self.state.AddOutput('abc123', docker_backend.STDOUT, b'out\n')
+        self.state.AddOutput('abc123', docker_backend.STDERR, b'err\n')
+        self.assertTrue(WaitFor(self._Contains('stdout.log', b'out\n')))
+        self.assertTrue(WaitFor(self._Contains('stderr.log', b'err\n')))
+
+    def testRotatesWithinLimits(self):
+        ctr_id = self._Run()
+        self.collector.Watch('abc123', ctr_id, log_collector.LogConfig(4, 2))
+        self.state.AddOutput('abc123', docker_backend.STDOUT, b'abcdefghij')
+        self.assertTrue(WaitFor(self._Contains('stdout.log', b'ij')))
+        self.assertEqual(b'efgh', Read(self._Path('stdout.log.1')))
+        self.assertFalse(os.path.exists(self._Path('stdout.log.2')))
+
+    def testFollowsRestarts(self):
+        ctr_id = self._Run()
+        self.collector.Watch('abc123', ctr_id, log_collector.LogConfig())
+        # Docker goes by whole seconds; keep the two outputs apart.
+        self.state.AddOutput('abc123', docker_backend.STDOUT, b'one\n',
+                             when=time.time() - 5)
+        self.assertTrue(WaitFor(self._Contains('stdout.log', b'one\n')))
+        self.backend.Kill('abc123')
+        self.backend.Restart('abc123')
+        self.state.AddOutput('abc123', docker_backend.STDOUT, b'two\n')
+        self.assertTrue(WaitFor(self._Contains('stdout.log', b'one\ntwo\n')))
+
+    def testWatchIsIdempotent(self):
+        ctr_id = self._Run()
+        config = log_collector.LogConfig()
+        self.collector.Watch('abc123', ctr_id, config)
+        self.collector.Watch('abc123', ctr_id, log_collector.LogConfig())
+        self.assertTrue(WaitFor(lambda: self._Requests() == 1))
+        self.assertEqual({'abc123': (ctr_id, config)},
+                         self.collector.Watched())
+
+    def testUnwatch(self):
+        ctr_id = self._Run()
+        self.collector.Watch('abc123', ctr_id, log_collector.LogConfig())
+        self.assertTrue(WaitFor(lambda: self._Requests() == 1))
+        self.collector.Unwatch('abc123')
+        self.assertEqual({}, self.collector.Watched())
+        self.collector.Unwatch('abc123')
+
+    def testStopsWhenRemoved(self):
+        ctr_id = self._Run()
+        self.collector.Watch('abc123', ctr_id, log_collector.LogConfig())
+        self.assertTrue(WaitFor(lambda: self._Requests() == 1))
+        self.backend.Kill('abc123')
+        self.backend.Remove('abc123')
+        follower = self.collector.followers['abc123']
+        follower.Join(5)
+        self.assertFalse(follower.thread.is_alive())
+
+    def testLogsDirectoryError(self):
+        errors = []
+        self.addCleanup(setattr, log_collector, 'LogError',
+                        log_collector.LogError)
+        log_collector.LogError = errors.append
+        # A file where the container's directory should be.
+        with open(os.path.join(self.tmpdir, 'abc123'), 'w'):
+            pass
+        self.collector.Watch('abc123', 'abc123', log_collector.LogConfig())
+        follower = self.collector.followers['abc123']
+        self.assertTrue(follower.Join(5))
+        self.assertEqual(0, self._Requests())
+        self.assertEqual(1, len(errors))
+        self.assertIn("container 'abc123'", errors[0])
+
+    def testUnwatchGivesUpOnStuckStream(self):
+        stuck = threading.Event()
+        self.addCleanup(stuck.set)
+
+        def Logs(name, since=0):
+            def Chunks():
+                stuck.wait()
+                return
+                yield
+            return docker_backend.LogStream(Chunks(), lambda: None)
+        self.backend.Logs = Logs
+        self.addCleanup(setattr, log_collector, 'STOP_TIMEOUT',
+                        log_collector.STOP_TIMEOUT)
+        log_collector.STOP_TIMEOUT = 0.05
+        self.collector.Watch('abc123', 'abc123', log_collector.LogConfig())
+        follower = self.collector.followers['abc123']
+        self.assertTrue(WaitFor(lambda: follower.stream is not None))
+        self.collector.Unwatch('abc123')
+        self.assertEqual({}, self.collector.Watched())
+        self.assertTrue(follower.thread.is_alive())
+        stuck.set()
+        self.assertTrue(follower.Join(5))
+
+    def _Requests(self):
+        return len([path for method, path in self.state.requests
+                    if path.endswith('/logs')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+
+"""Tests for metadata."""
+
+import threading
+import time
+import unittest
+from container_agent import metadata
+from container_agent import restart_policy
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+try:
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from urlparse import parse_qs, urlparse
+
+
+class FakeMetadataHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        with server.changed:
+            server.requests.append(query)
+            if self.headers.get('Metadata-Flavor') != 'Google':
+                return self._Reply(403, None, None)
+            if url.path != metadata.MANIFEST_PATH:
+                return self._Reply(404, None, None)
+            if query.get('wait_for_change') == 'true':
+                deadline = time.time() + float(query['timeout_sec'])
+                while (query['last_etag'] == server.etag and
+                       time.time() < deadline and not server.stopping):
+                    server.changed.wait(0.05)
+            if server.value is None:
+                return self._Reply(404, None, None)
+            return self._Reply(200, server.value, server.etag)
+
+    def _Reply(self, status, value, etag):
+        data = (value or '').encode('utf-8')
+        self.send_response(status)
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeMetadataServer(socketserver.ThreadingMixIn, HTTPServer):
+
+    """Mimics the manifest attribute of the GCE metadata server."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeMetadataHandler)
+        self.changed = threading.Condition()
+        self.requests = []
+        self.connections = 0
+        self.stopping = False
+        self.value = None
+        self.etag = None
+        self.Set('first')
+
+    def Set(self, value):
+        with self.changed:
+            self.value = value
+            self.etag = '%x' % (len(self.requests) * 1000 + id(value) % 1000)
+            self.changed.notify_all()
+
+    def get_request(self):
+        request = HTTPServer.get_request(self)
+        self.connections += 1
+        return request
+
+    def Start(self):
+        thread = threading.Thread(target=self.serve_forever,
+                                  kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def Stop(self):
+        self.stopping = True
+        self.shutdown()
+        self.server_close()
+
+
+class MetadataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeMetadataServer().Start()
+        self.client = metadata.MetadataClient(
+            '127.0.0.1', self.server.server_address[1], wait_timeout=5)
+
+    def tearDown(self):
+        self.client.Close()
+        self.server.Stop()
+
+    def testFetch(self):
+        self.assertEqual((True, 'first'), self.client.Fetch())
+        self.assertEqual((False, 'first'), self.client.Fetch())
+        self.server.Set('second')
+        self.assertEqual((True, 'second'), self.client.Fetch())
+
+    def testFetchMissing(self):
+        self.server.Set(None)
+        self.assertEqual((True, None), self.client.Fetch())
+        self.assertEqual((False, None), self.client.Fetch(wait=True))
+
+    def testFetchWaitsForChange(self):
+        self.client.Fetch()
+        timer = threading.Timer(0.1, self.server.Set, ['second'])
+        timer.start()
+        start = time.time()
+        self.assertEqual((True, 'second'), self.client.Fetch(wait=True))
+        self.assertTrue(time.time() - start >= 0.09)
+        timer.join()
+        query = self.server.requests[-1]
+        self.assertEqual('true', query['wait_for_change'])
+        self.assertEqual('text', query['alt'])
+
+    def testFetchWaitTimesOut(self):
+        self.client.wait_timeout = 0.1
+        self.client.Fetch()
+        self.assertEqual((False, 'first'), self.client.Fetch(wait=True))
+
+    def testConnectionIsReused(self):
+        for _ in range(5):
+            self.client.Fetch()
+        self.assertEqual(1, self.server.connections)
+
+    def testUnreachable(self):
+        self.server.Stop()
+        client = metadata.MetadataClient('127.0.0.1', 1)
+        with self.assertRaises(metadata.MetadataError):
+            client.Fetch()
+        self.server = FakeMetadataServer().Start()
+
+    def testSource(self):
+        source = metadata.MetadataSource(
+            self.client, restart_policy.Backoff(initial=0.01)).Start()
+        try:
+            self.assertEqual('first', source.Read())
+            self.assertFalse(source.Changed())
+            self.server.Set('second')
+            deadline = time.time() + 5
+            while not source.Changed() and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual('second', source.Read())
+        finally:
+            source.Close()
+
+
+if __name__ == '__main__':
+    unittest.main()
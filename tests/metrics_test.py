@@ -0,0 +1,119 @@
+#!/usr/bin/python
+
+"""Tests for metrics."""
+
+import unittest
+from container_agent import metrics
+
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def testCounter(self):
+        c = self.registry.Register(metrics.Counter(
+            'restarts_total', 'Restarts.', ('container',)))
+        c.Inc('a')
+        c.Inc('a')
+        c.Inc('b', amount=3)
+        self.assertEqual(2, c.Value('a'))
+        self.assertEqual(0, c.Value('c'))
+        self.assertEqual('# HELP restarts_total Restarts.\n'
+                         '# TYPE restarts_total counter\n'
+                         'restarts_total{container="a"} 2\n'
+                         'restarts_total{container="b"} 3\n',
+                         self.registry.Render())
+
+    def testRemove(self):
+        c = self.registry.Register(metrics.Counter(
+            'restarts_total', 'Restarts.', ('container',)))
+        c.Inc('a')
+        c.Inc('b')
+        self.assertEqual([('a',), ('b',)], c.Labels())
+        c.Remove('a')
+        c.Remove('missing')
+        self.assertEqual([('b',)], c.Labels())
+        self.assertEqual('# HELP restarts_total Restarts.\n'
+                         '# TYPE restarts_total counter\n'
+                         'restarts_total{container="b"} 1\n',
+                         self.registry.Render())
+
+    def testLabelsAreChecked(self):
+        c = metrics.Counter('restarts_total', 'Restarts.', ('container',))
+        with self.assertRaises(ValueError):
+            c.Inc()
+        with self.assertRaises(ValueError):
+            c.Inc('a', 'b')
+
+    def testLabelValuesAreEscaped(self):
+        g = self.registry.Register(metrics.Gauge('g', 'G.', ('x',)))
+        g.Set(1.5, 'a"b\\c\nd')
+        self.assertIn('g{x="a\\"b\\\\c\\nd"} 1.5\n', self.registry.Render())
+
+    def testGaugeFunc(self):
+        values = [None]
+        self.registry.Register(metrics.Gauge('g', 'G.',
+                                             func=lambda: values[0]))
+        self.assertEqual('# HELP g G.\n# TYPE g gauge\n',
+                         self.registry.Render())
+        values[0] = 7.0
+        self.assertIn('\ng 7\n', self.registry.Render())
+
+    def testHistogram(self):
+        h = self.registry.Register(metrics.Histogram(
+            'seconds', 'Seconds.', ('op',), buckets=(1, 5)))
+        h.Observe(0.5, 'pull')
+        h.Observe(3, 'pull')
+        h.Observe(10, 'pull')
+        self.assertEqual(3, h.Count('pull'))
+        self.assertEqual(13.5, h.Sum('pull'))
+        self.assertEqual(0, h.Count('run'))
+        self.assertEqual('# HELP seconds Seconds.\n'
+                         '# TYPE seconds histogram\n'
+                         'seconds_bucket{op="pull",le="1"} 1\n'
+                         'seconds_bucket{op="pull",le="5"} 2\n'
+                         'seconds_bucket{op="pull",le="+Inf"} 3\n'
+                         'seconds_sum{op="pull"} 13.5\n'
+                         'seconds_count{op="pull"} 3\n',
+                         self.registry.Render())
+
+    def testHistogramTime(self):
+        h = metrics.Histogram('seconds', 'Seconds.', ('op',))
+        with self.assertRaises(RuntimeError):
+            with h.Time('run'):
+                raise RuntimeError()
+        self.assertEqual(1, h.Count('run'))
+
+    def testDuplicateName(self):
+        self.registry.Register(metrics.Counter('c', 'C.'))
+        with self.assertRaises(ValueError):
+            self.registry.Register(metrics.Gauge('c', 'C.'))
+
+    def testServer(self):
+        self.registry.Register(metrics.Counter('c', 'C.')).Inc()
+        server = metrics.MetricsServer('127.0.0.1', 0, self.registry).Start()
+        try:
+            conn = httplib.HTTPConnection(*server.Address())
+            conn.request('GET', '/metrics')
+            resp = conn.getresponse()
+            self.assertEqual(200, resp.status)
+            self.assertEqual(metrics.CONTENT_TYPE,
+                             resp.getheader('Content-Type'))
+            self.assertIn(b'\nc 1\n', resp.read())
+            conn.request('GET', '/')
+            resp = conn.getresponse()
+            resp.read()
+            self.assertEqual(404, resp.status)
+            conn.close()
+        finally:
+            server.Stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+#!/usr/bin/python
+
+"""Tests for pause_image."""
+
+import io
+import struct
+import tarfile
+import unittest
+from container_agent import pause_image
+
+
+class PauseImageTest(unittest.TestCase):
+
+    def testPauseBinary(self):
+        binary = pause_image.PauseBinary()
+        self.assertEqual(b'\x7fELF\x02\x01\x01', binary[:7])
+        e_type, e_machine, _, entry = struct.unpack('<HHIQ', binary[16:32])
+        self.assertEqual((2, 62), (e_type, e_machine))
+        # The entry point is the code, at the end of the file.
+        offset = entry - pause_image.LOAD_ADDRESS
+        self.assertEqual(pause_image.CODE, binary[offset:])
+
+    def testSupported(self):
+        self.assertTrue(pause_image.Supported('x86_64'))
+        self.assertTrue(pause_image.Supported('AMD64'))
+        self.assertFalse(pause_image.Supported('aarch64'))
+        self.assertFalse(pause_image.Supported('armv7l'))
+
+    def testTarball(self):
+        tarball = pause_image.Tarball()
+        self.assertEqual(tarball, pause_image.Tarball())
+        with tarfile.open(fileobj=io.BytesIO(tarball)) as tar:
+            self.assertEqual(['pause'], tar.getnames())
+            info = tar.getmember('pause')
+            self.assertEqual(0o755, info.mode)
+            self.assertEqual(pause_image.PauseBinary(),
+                             tar.extractfile(info).read())
+
+
+if __name__ == '__main__':
+    unittest.main()
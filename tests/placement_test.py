@@ -0,0 +1,63 @@
+#!/usr/bin/python
+
+"""Tests for placement."""
+
+import unittest
+from container_agent import placement
+from container_agent import run_containers
+
+
+def NewContainer(name, cpu_shares=None, cpuset=None):
+    ctr = run_containers.Container(name, 'foo/bar')
+    ctr.cpu_shares = cpu_shares
+    ctr.cpuset = cpuset
+    return ctr
+
+
+class PlacementTest(unittest.TestCase):
+
+    def testParseCpuList(self):
+        self.assertEqual([0], placement.ParseCpuList('0'))
+        self.assertEqual([0, 1, 2, 5], placement.ParseCpuList('5,0-2'))
+        self.assertEqual([3], placement.ParseCpuList(3))
+        for text in ('', '1-', '2-1', 'a', '0,,1'):
+            with self.assertRaises(ValueError):
+                placement.ParseCpuList(text)
+
+    def testFormatCpuList(self):
+        self.assertEqual('0-2,5', placement.FormatCpuList([5, 1, 0, 2]))
+        self.assertEqual('3', placement.FormatCpuList([3]))
+
+    def testCpusWanted(self):
+        self.assertEqual(1, placement.CpusWanted(2, 4))
+        self.assertEqual(1, placement.CpusWanted(1024, 4))
+        self.assertEqual(2, placement.CpusWanted(1025, 4))
+        self.assertEqual(4, placement.CpusWanted(8192, 4))
+
+    def testSpread(self):
+        ctrs = placement.Spread([NewContainer('a', 1024),
+                                 NewContainer('b', 2048),
+                                 NewContainer('c', 512),
+                                 NewContainer('d', 512)], 4)
+        self.assertEqual(['2', '0-1', '3', '3'],
+                         [ctr.cpuset for ctr in ctrs])
+
+    def testSpreadAvoidsPinnedCores(self):
+        ctrs = placement.Spread([NewContainer('a', 1024, '0'),
+                                 NewContainer('b', None, '1'),
+                                 NewContainer('c', 1024)], 3)
+        self.assertEqual(['0', '1', '2'], [ctr.cpuset for ctr in ctrs])
+
+    def testSpreadLeavesUnrequestedAlone(self):
+        ctrs = placement.Spread([NewContainer('a')], 2)
+        self.assertIsNone(ctrs[0].cpuset)
+
+    def testSpreadIsStable(self):
+        def Place():
+            return [ctr.cpuset for ctr in placement.Spread(
+                [NewContainer(name, 700) for name in 'abcde'], 3)]
+        self.assertEqual(Place(), Place())
+
+
+if __name__ == '__main__':
+    unittest.main()
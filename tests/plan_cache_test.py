@@ -0,0 +1,66 @@
+#!/usr/bin/python
+
+"""Tests for plan_cache."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from container_agent import plan_cache
+
+
+class PlanCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'plans')
+        self.cache = plan_cache.PlanCache(self.cache_dir, max_plans=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testManifestHash(self):
+        self.assertEqual(plan_cache.ManifestHash('a'),
+                         plan_cache.ManifestHash(b'a'))
+        self.assertNotEqual(plan_cache.ManifestHash('a'),
+                            plan_cache.ManifestHash('a '))
+
+    def testGetMissing(self):
+        self.assertIsNone(self.cache.Get('manifest'))
+
+    def testPutAndGet(self):
+        self.cache.Put('manifest', [{'name': 'abc123'}])
+        self.assertEqual([{'name': 'abc123'}], self.cache.Get('manifest'))
+        self.assertIsNone(self.cache.Get('other manifest'))
+
+    def testCorruptPlanIsMissing(self):
+        self.cache.Put('manifest', [])
+        path = os.path.join(self.cache_dir,
+                            plan_cache.ManifestHash('manifest') + '.json')
+        with open(path, 'w') as f:
+            f.write('{')
+        self.assertIsNone(self.cache.Get('manifest'))
+
+    def testUnwritableDirectoryIsHarmless(self):
+        with open(self.cache_dir, 'w'):
+            pass
+        self.cache.Put('manifest', [])
+        self.assertIsNone(self.cache.Get('manifest'))
+
+    def testOldPlansArePruned(self):
+        for i, text in enumerate(['one', 'two', 'three']):
+            self.cache.Put(text, [i])
+            path = os.path.join(self.cache_dir,
+                                plan_cache.ManifestHash(text) + '.json')
+            when = time.time() - 100 + i
+            os.utime(path, (when, when))
+        self.cache.Put('one', [0])
+        self.assertEqual(2, len(os.listdir(self.cache_dir)))
+        self.assertEqual([0], self.cache.Get('one'))
+        self.assertEqual([2], self.cache.Get('three'))
+        self.assertIsNone(self.cache.Get('two'))
+
+
+if __name__ == '__main__':
+    unittest.main()
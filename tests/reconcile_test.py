@@ -0,0 +1,71 @@
+#!/usr/bin/python
+
+"""Tests for reconcile."""
+
+import unittest
+from container_agent import reconcile
+from container_agent import run_containers
+
+
+def NewContainer():
+    ctr = run_containers.Container('abc123', 'foo/bar')
+    ctr.command = ['one', 'two']
+    ctr.hostname = 'abc123'
+    ctr.ports = [(80, 8080, '')]
+    ctr.mounts = ['/export/vol1:/mnt:ro']
+    ctr.env_vars = ['KEY=value']
+    ctr.network_from = 'container:.net'
+    return ctr
+
+
+def Inspected(fingerprint, running=True):
+    return {'State': {'Running': running},
+            'Config': {'Labels': {reconcile.FINGERPRINT_LABEL: fingerprint}}}
+
+
+class ReconcileTest(unittest.TestCase):
+
+    def testFingerprintIsStable(self):
+        self.assertEqual(reconcile.Fingerprint(NewContainer(), 'sha256:1'),
+                         reconcile.Fingerprint(NewContainer(), 'sha256:1'))
+
+    def testFingerprintIgnoresLabels(self):
+        ctr = NewContainer()
+        ctr.labels['foo'] = 'bar'
+        self.assertEqual(reconcile.Fingerprint(NewContainer(), 'sha256:1'),
+                         reconcile.Fingerprint(ctr, 'sha256:1'))
+
+    def testFingerprintChanges(self):
+        base = reconcile.Fingerprint(NewContainer(), 'sha256:1')
+        self.assertNotEqual(
+            base, reconcile.Fingerprint(NewContainer(), 'sha256:2'))
+
+        def Changed(attr, value):
+            ctr = NewContainer()
+            setattr(ctr, attr, value)
+            return reconcile.Fingerprint(ctr, 'sha256:1')
+
+        self.assertNotEqual(base, Changed('image', 'foo/baz'))
+        self.assertNotEqual(base, Changed('command', ['one']))
+        self.assertNotEqual(base, Changed('hostname', 'other'))
+        self.assertNotEqual(base, Changed('working_dir', '/tmp'))
+        self.assertNotEqual(base, Changed('ports', [(81, 8080, '')]))
+        self.assertNotEqual(base, Changed('mounts', []))
+        self.assertNotEqual(base, Changed('env_vars', ['KEY=other']))
+        self.assertNotEqual(base, Changed('network_from', None))
+        self.assertNotEqual(base, Changed('cpu_shares', 512))
+        self.assertNotEqual(base, Changed('cpuset', '0'))
+        self.assertNotEqual(base, Changed('memory', 64 * 1024 * 1024))
+
+    def testIsUpToDate(self):
+        self.assertTrue(reconcile.IsUpToDate(Inspected('abc'), 'abc'))
+        self.assertFalse(reconcile.IsUpToDate(Inspected('abc'), 'abd'))
+        self.assertFalse(
+            reconcile.IsUpToDate(Inspected('abc', running=False), 'abc'))
+        self.assertFalse(reconcile.IsUpToDate(None, 'abc'))
+        self.assertFalse(reconcile.IsUpToDate(
+            {'State': {'Running': True}, 'Config': {'Labels': None}}, 'abc'))
+
+
+if __name__ == '__main__':
+    unittest.main()
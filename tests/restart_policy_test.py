@@ -0,0 +1,117 @@
+#!/usr/bin/python
+
+"""Tests for restart_policy."""
+
+import random
+import unittest
+from container_agent import restart_policy
+
+
+class RestartPolicyTest(unittest.TestCase):
+
+    def testShouldRestart(self):
+        always = restart_policy.RestartPolicy('always')
+        self.assertTrue(always.ShouldRestart(0))
+        self.assertTrue(always.ShouldRestart(1))
+        on_failure = restart_policy.RestartPolicy('on-failure')
+        self.assertFalse(on_failure.ShouldRestart(0))
+        self.assertTrue(on_failure.ShouldRestart(1))
+        never = restart_policy.RestartPolicy('never')
+        self.assertFalse(never.ShouldRestart(0))
+        self.assertFalse(never.ShouldRestart(1))
+
+    def testBackoffDoubles(self):
+        backoff = restart_policy.Backoff(initial=1, maximum=10, jitter=0)
+        self.assertEqual([1, 2, 4, 8, 10, 10],
+                         [backoff.Delay(n) for n in range(6)])
+
+    def testBackoffHugeAttempt(self):
+        backoff = restart_policy.Backoff(initial=1, maximum=10, jitter=0)
+        self.assertEqual(10, backoff.Delay(10000))
+
+    def testBackoffJitter(self):
+        backoff = restart_policy.Backoff(initial=10, maximum=100, jitter=0.2,
+                                         rng=random.Random(42))
+        delays = [backoff.Delay(0) for _ in range(100)]
+        self.assertTrue(all(8 <= d <= 12 for d in delays))
+        self.assertTrue(len(set(delays)) > 1)
+
+    def testStateBacksOffThenCrashLoops(self):
+        backoff = restart_policy.Backoff(initial=1, jitter=0)
+        state = restart_policy.RestartState(
+            restart_policy.RestartPolicy(), started_at=0)
+        now = 0
+        delays = []
+        for _ in range(4):
+            now += 1
+            delays.append(state.OnExit(now, 1, backoff))
+            if len(delays) < restart_policy.CRASHLOOP_THRESHOLD:
+                self.assertEqual('backoff', state.state)
+            now += delays[-1]
+            state.OnStart(now)
+        self.assertEqual([1, 2, 4, 8], delays)
+        self.assertEqual('crashloop', state.Status(now)['state'])
+        self.assertEqual(4, state.restarts)
+
+    def testStateToDictRoundTrip(self):
+        backoff = restart_policy.Backoff(initial=1, jitter=0)
+        policy = restart_policy.RestartPolicy('on-failure', 5)
+        state = restart_policy.RestartState(policy, started_at=0)
+        for now in (1, 3, 6):
+            state.OnExit(now, 1, backoff)
+            state.OnStart(now + 1)
+        state.OnExit(10, 2, backoff)
+        again = restart_policy.RestartState.FromDict(policy, state.ToDict())
+        self.assertEqual(policy, again.policy)
+        self.assertEqual((state.attempts, state.restarts, state.short_runs,
+                          2, 'crashloop', None),
+                         (again.attempts, again.restarts, again.short_runs,
+                          again.last_exit_code, again.state,
+                          again.next_restart))
+
+    def testStateFromDictIsRunning(self):
+        state = restart_policy.RestartState(
+            restart_policy.RestartPolicy(), started_at=0)
+        state.OnExit(1, 1, restart_policy.Backoff())
+        again = restart_policy.RestartState.FromDict(
+            restart_policy.RestartPolicy(), state.ToDict())
+        self.assertEqual('running', again.state)
+
+    def testStableRunResetsBackoff(self):
+        backoff = restart_policy.Backoff(initial=1, jitter=0)
+        state = restart_policy.RestartState(
+            restart_policy.RestartPolicy(), started_at=0)
+        for now in (1, 3, 7):
+            state.OnExit(now, 1, backoff)
+            state.OnStart(now)
+        self.assertEqual('crashloop', state.Status(8)['state'])
+        later = 7 + restart_policy.STABLE_RUN_SECS
+        self.assertEqual('running', state.Status(later)['state'])
+        self.assertEqual(1, state.OnExit(later, 1, backoff))
+        self.assertEqual('backoff', state.state)
+
+    def testMaxAttempts(self):
+        backoff = restart_policy.Backoff(initial=1, jitter=0)
+        state = restart_policy.RestartState(
+            restart_policy.RestartPolicy('always', 1), started_at=0)
+        self.assertEqual(1, state.OnExit(1, 1, backoff))
+        state.OnStart(2)
+        self.assertIsNone(state.OnExit(3, 1, backoff))
+        self.assertEqual('failed', state.state)
+
+    def testFailedRestartsBackOff(self):
+        backoff = restart_policy.Backoff(initial=1, jitter=0)
+        state = restart_policy.RestartState(
+            restart_policy.RestartPolicy('always', 3), started_at=0)
+        self.assertEqual(1, state.OnExit(1, 1, backoff))
+        self.assertEqual(2, state.OnRestartFailed(2, backoff))
+        self.assertEqual(4, state.next_restart)
+        self.assertEqual(4, state.OnRestartFailed(4, backoff))
+        self.assertEqual('backoff', state.state)
+        self.assertIsNone(state.OnRestartFailed(8, backoff))
+        self.assertEqual('failed', state.state)
+        self.assertIsNone(state.next_restart)
+
+
+if __name__ == '__main__':
+    unittest.main()
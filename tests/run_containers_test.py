@@ -2,9 +2,22 @@
 
 """Tests for run_containers."""
 
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 import yaml
+from container_agent import log_collector
+from container_agent import metrics
+from container_agent import pause_image
+from container_agent import plan_cache
+from container_agent import restart_policy
 from container_agent import run_containers
+from container_agent import validation
+from container_agent import volumes
 
 
 class RunContainersTest(unittest.TestCase):
@@ -79,6 +92,78 @@ class RunContainersTest(unittest.TestCase):
         with self.assertRaises(SystemExit):
             run_containers.LoadVolumes(yaml.load(yaml_code))
 
+    def testVolumeSources(self):
+        yaml_code = """
+      - name: plain
+      - name: scratch
+        source:
+          tmpfs:
+            sizeBytes: 1048576
+      - name: logs
+        source:
+          hostDir:
+            path: /var/log
+      - name: empty
+        source:
+          emptyDir: {}
+      """
+        x = run_containers.LoadVolumeSources(yaml.load(yaml_code))
+        self.assertEqual(volumes.VolumeSource(), x['plain'])
+        self.assertEqual(volumes.VolumeSource('tmpfs', size=1048576),
+                         x['scratch'])
+        self.assertEqual(volumes.VolumeSource('hostDir', path='/var/log'),
+                         x['logs'])
+        self.assertEqual(volumes.VolumeSource(), x['empty'])
+
+    def testVolumeSourcesInvalid(self):
+        for source in ('{}', '{emptyDir: {}, hostDir: {path: /a}}',
+                       '{nfs: {server: a}}', '{tmpfs: {}}',
+                       '{tmpfs: {sizeBytes: 100}}', '{hostDir: {}}',
+                       '{hostDir: {path: var/log}}'):
+            yaml_code = """
+      - name: abc
+        source: %s
+      """ % (source)
+            with self.assertRaises(SystemExit):
+                run_containers.LoadVolumeSources(yaml.load(yaml_code))
+
+    def testVolumeSourceMounts(self):
+        yaml_code = """
+      version: v1beta1
+      containers:
+        - name: server
+          image: foo/bar
+          volumeMounts:
+            - name: scratch
+              path: /tmp
+            - name: logs
+              path: /logs
+              readOnly: true
+            - name: data
+              path: /data
+        - name: helper
+          image: foo/bar
+          volumeMounts:
+            - name: scratch
+              path: /scratch
+      volumes:
+        - name: scratch
+          source:
+            tmpfs:
+              sizeBytes: 1048576
+        - name: logs
+          source:
+            hostDir:
+              path: /var/log
+        - name: data
+      """
+        x = run_containers.LoadConfig(yaml.load(yaml_code))
+        self.assertEqual(['/export/scratch:/tmp:rw', '/var/log:/logs:ro',
+                          '/export/data:/data:rw'], x[1].mounts)
+        self.assertEqual([['/export/scratch', 1048576]], x[1].tmpfs)
+        self.assertEqual([['/export/scratch', 1048576]], x[2].tmpfs)
+        self.assertEqual([], x[0].tmpfs)
+
     def testContainerValidMinimal(self):
         yaml_code = """
       - name: abc123
@@ -487,6 +572,614 @@ class RunContainersTest(unittest.TestCase):
         with self.assertRaises(SystemExit):
             run_containers.LoadEnvVars(yaml.load(yaml_code), 'ctr_name')
 
+    def testContainerDefaultRestartPolicy(self):
+        yaml_code = """
+      - name: abc123
+        image: foo/bar
+      """
+        x = run_containers.LoadUserContainers(yaml.load(yaml_code), [])
+        self.assertEqual('always', x[0].restart_policy.name)
+        self.assertEqual(0, x[0].restart_policy.max_attempts)
+
+    def testContainerWithRestartPolicy(self):
+        yaml_code = """
+      - name: abc123
+        image: foo/bar
+        restartPolicy:
+          name: on-failure
+          maxAttempts: 5
+      """
+        x = run_containers.LoadUserContainers(yaml.load(yaml_code), [])
+        self.assertEqual('on-failure', x[0].restart_policy.name)
+        self.assertEqual(5, x[0].restart_policy.max_attempts)
+
+    def testRestartPolicyInvalidName(self):
+        yaml_code = """
+      name: sometimes
+      """
+        with self.assertRaises(SystemExit):
+            run_containers.LoadRestartPolicy(yaml.load(yaml_code), 'ctr_name')
+
+    def testRestartPolicyInvalidMaxAttempts(self):
+        yaml_code = """
+      name: always
+      maxAttempts: -1
+      """
+        with self.assertRaises(SystemExit):
+            run_containers.LoadRestartPolicy(yaml.load(yaml_code), 'ctr_name')
+
+    def testContainerWithoutResources(self):
+        yaml_code = """
+      - name: abc123
+        image: foo/bar
+      """
+        x = run_containers.LoadUserContainers(yaml.load(yaml_code), [])
+        self.assertIsNone(x[0].cpu_shares)
+        self.assertIsNone(x[0].cpuset)
+        self.assertIsNone(x[0].memory)
+
+    def testContainerWithResources(self):
+        yaml_code = """
+      - name: abc123
+        image: foo/bar
+        cpuShares: 512
+        cpuset: 3,0-1
+        memory: 67108864
+      """
+        x = run_containers.LoadUserContainers(yaml.load(yaml_code), [])
+        self.assertEqual(512, x[0].cpu_shares)
+        self.assertEqual('0-1,3', x[0].cpuset)
+        self.assertEqual(67108864, x[0].memory)
+
+    def testResourcesInvalid(self):
+        for spec in ({'cpuShares': 1}, {'cpuShares': '512'},
+                     {'cpuset': '1-0'}, {'cpuset': 'all'},
+                     {'memory': 1024}, {'memory': True}):
+            errors = validation.ErrorList()
+            run_containers.LoadResources(spec, 'ctr_name', errors)
+            self.assertEqual(1, len(errors.errors), spec)
+
+    def testContainerWithoutLogs(self):
+        yaml_code = """
+      - name: abc123
+        image: foo/bar
+      """
+        x = run_containers.LoadUserContainers(yaml.load(yaml_code), [])
+        self.assertIsNone(x[0].log_config)
+
+    def testContainerWithLogs(self):
+        yaml_code = """
+      - name: abc123
+        image: foo/bar
+        logs:
+          maxBytes: 1024
+      - name: abc124
+        image: foo/bar
+        logs: {}
+      """
+        x = run_containers.LoadUserContainers(yaml.load(yaml_code), [])
+        self.assertEqual(log_collector.LogConfig(1024, 5), x[0].log_config)
+        self.assertEqual(log_collector.LogConfig(), x[1].log_config)
+
+    def testLogsInvalidMaxBytes(self):
+        yaml_code = """
+      maxBytes: 0
+      """
+        with self.assertRaises(SystemExit):
+            run_containers.LoadLogConfig(yaml.load(yaml_code), 'ctr_name')
+
+    def testLogsInvalidMaxFiles(self):
+        yaml_code = """
+      maxFiles: two
+      """
+        with self.assertRaises(SystemExit):
+            run_containers.LoadLogConfig(yaml.load(yaml_code), 'ctr_name')
+
+    def testContainerDefaultImagePullPolicy(self):
+        yaml_code = """
+      - name: abc123
+        image: foo/bar
+      - name: abc124
+        image: foo/bar:1.0
+      """
+        x = run_containers.LoadUserContainers(yaml.load(yaml_code), [])
+        self.assertEqual('Always', x[0].image_pull_policy)
+        self.assertEqual('IfNotPresent', x[1].image_pull_policy)
+
+    def testContainerWithImagePullPolicy(self):
+        yaml_code = """
+      - name: abc123
+        image: foo/bar
+        imagePullPolicy: Never
+      """
+        x = run_containers.LoadUserContainers(yaml.load(yaml_code), [])
+        self.assertEqual('Never', x[0].image_pull_policy)
+
+    def testImagePullPolicyInvalid(self):
+        yaml_code = """
+      - name: abc123
+        image: foo/bar
+        imagePullPolicy: Sometimes
+      """
+        with self.assertRaises(SystemExit):
+            run_containers.LoadUserContainers(yaml.load(yaml_code), [])
+
+    def testInfraContainerIsNeverPulled(self):
+        self.addCleanup(setattr, pause_image, 'Supported',
+                        pause_image.Supported)
+        pause_image.Supported = lambda: True
+        x = run_containers.LoadInfraContainers([])
+        self.assertEqual(pause_image.IMAGE, x[0].image)
+        self.assertEqual(['/pause'], x[0].command)
+        self.assertEqual('Never', x[0].image_pull_policy)
+
+    def testInfraContainerFallsBackToBusybox(self):
+        self.addCleanup(setattr, pause_image, 'Supported',
+                        pause_image.Supported)
+        pause_image.Supported = lambda: False
+        x = run_containers.LoadInfraContainers([])
+        self.assertEqual('busybox', x[0].image)
+        self.assertEqual(
+            ['sh', '-c', 'rm -f nap && mkfifo nap && exec cat nap'],
+            x[0].command)
+        self.assertEqual('IfNotPresent', x[0].image_pull_policy)
+
+    def testContainerWithDependsOn(self):
+        yaml_code = """
+      - name: abc123
+        image: foo/bar
+        dependsOn: [abc124, abc124]
+      - name: abc124
+        image: foo/bar
+      """
+        x = run_containers.LoadUserContainers(yaml.load(yaml_code), [])
+        self.assertEqual(['abc124'], x[0].depends_on)
+        self.assertEqual([], x[1].depends_on)
+        self.assertEqual(['abc124', '.net'],
+                         run_containers.StartupDependencies(x[0]))
+
+    def testDependsOnUnknown(self):
+        yaml_code = """
+      - name: abc123
+        image: foo/bar
+        dependsOn: [abc124]
+      """
+        with self.assertRaises(SystemExit):
+            run_containers.LoadUserContainers(yaml.load(yaml_code), [])
+
+    def testDependsOnInvalid(self):
+        yaml_code = """
+      - name: abc123
+        image: foo/bar
+        dependsOn: [ABC]
+      """
+        with self.assertRaises(SystemExit):
+            run_containers.LoadUserContainers(yaml.load(yaml_code), [])
+
+    def testDependsOnCycle(self):
+        yaml_code = """
+      - name: abc123
+        image: foo/bar
+        dependsOn: [abc124]
+      - name: abc124
+        image: foo/bar
+        dependsOn: [abc123]
+      """
+        with self.assertRaises(SystemExit):
+            run_containers.LoadUserContainers(yaml.load(yaml_code), [])
+
+    def testRegistryDependency(self):
+        yaml_code = """
+      - name: registry
+        image: google/docker-registry
+        ports:
+          - containerPort: 5000
+            hostPort: 5000
+      - name: app
+        image: localhost:5000/my/app
+      - name: other
+        image: foo/bar
+      """
+        x = run_containers.LoadUserContainers(yaml.load(yaml_code), [])
+        self.assertEqual([], x[0].depends_on)
+        self.assertEqual(['registry'], x[1].depends_on)
+        self.assertEqual([], x[2].depends_on)
+
+    def testValidateConfigValid(self):
+        yaml_code = """
+      version: v1beta1
+      containers:
+        - name: abc123
+          image: foo/bar
+      """
+        result = run_containers.ValidateConfig(yaml.load(yaml_code))
+        self.assertTrue(result.IsValid())
+        self.assertEqual([], result.errors)
+        self.assertEqual(['.net', 'abc123'],
+                         [ctr.name for ctr in result.containers])
+
+    def testValidateConfigCollectsEveryError(self):
+        yaml_code = """
+      version: v0
+      containers:
+        - name: abc123
+          image: foo/bar
+          ports:
+            - containerPort: 0
+            - containerPort: 80
+            - containerPort: 81
+              hostPort: 80
+          env:
+            - key: A
+          volumeMounts:
+            - name: nope
+              path: /mnt
+          dependsOn: [nobody]
+        - name: abc123
+          image: foo/bar
+        - image: foo/bar
+        - name: abc124
+          restartPolicy:
+            name: sometimes
+      volumes:
+        - name: Bad
+      """
+        result = run_containers.ValidateConfig(yaml.load(yaml_code))
+        self.assertFalse(result.IsValid())
+        self.assertEqual([], result.containers)
+        self.assertEqual([
+            "config version 'v0' is not supported",
+            'volumes[0].name is invalid: Bad',
+            'containers[abc123].ports[0].containerPort is invalid: 0',
+            'containers[abc123].ports[2].hostPort is not unique: 80',
+            'containers[abc123].volumeMounts[0].name is not a known volume: '
+            'nope',
+            'containers[abc123].env[A] has no value',
+            'containers[1].name is not unique: abc123',
+            'containers[2] has no name',
+            'containers[abc124] has no image',
+            'containers[abc123].dependsOn is not a known container: nobody',
+        ], result.errors)
+
+    def testValidateConfigCollectsTypeErrors(self):
+        yaml_code = """
+      version: v1beta1
+      containers:
+        - name: 123
+          image: foo/bar
+        - name: abc123
+          image: foo/bar
+          env: 1
+          restartPolicy: always
+          dependsOn: abc124
+        - name: abc124
+          image: foo/bar
+          env:
+            - key: A
+              value: [1]
+          ports: [80]
+          command: ls
+        - just a string
+      volumes: [vol1]
+      """
+        result = run_containers.ValidateConfig(yaml.load(yaml_code))
+        self.assertEqual([
+            'volumes[0] is not an object: vol1',
+            'containers[0].name is invalid: 123',
+            'containers[abc123].env is not a list: 1',
+            'containers[abc123].restartPolicy is not an object: always',
+            'containers[abc123].dependsOn is not a list: abc124',
+            'containers[abc124].command is not a list: ls',
+            'containers[abc124].ports[0] is not an object: 80',
+            'containers[abc124].env[A].value is invalid: [1]',
+            'containers[3] is not an object: just a string',
+        ], result.errors)
+
+    def testValidateConfigEmptyFields(self):
+        for text in ('version: v1beta1\ncontainers:\n',
+                     'version: v1beta1\ngroups:\n'):
+            result = run_containers.ValidateConfig(yaml.load(text))
+            self.assertEqual(([], []), (result.containers, result.errors))
+        result = run_containers.ValidateConfig(
+            yaml.load('version: v1beta1\ngroups: [web]\n'))
+        self.assertEqual(['groups[0] is not an object: web'], result.errors)
+
+    def testValidateConfigLarge(self):
+        n = 2000
+        config = {
+            'version': 'v1beta1',
+            'volumes': [{'name': 'vol%d' % i} for i in range(n)],
+            'containers': [
+                {'name': 'ctr%d' % i, 'image': 'foo/bar',
+                 'ports': [{'name': 'port%d' % i, 'containerPort': i + 1}],
+                 'volumeMounts': [{'name': 'vol%d' % i, 'path': '/mnt'}],
+                 'env': [{'key': 'K%d' % i, 'value': 'v'}]}
+                for i in range(n)],
+        }
+        config['containers'].append({'name': 'ctr0', 'image': 'foo/bar'})
+        result = run_containers.ValidateConfig(config)
+        self.assertEqual(['containers[%d].name is not unique: ctr0' % (n)],
+                         result.errors)
+
+    def testValidateManifestNotYaml(self):
+        result = run_containers.ValidateManifest('{')
+        self.assertFalse(result.IsValid())
+        self.assertEqual(1, len(result.errors))
+        result = run_containers.ValidateManifest('- a list')
+        self.assertEqual(['manifest is not a YAML or JSON object'],
+                         result.errors)
+
+    def testValidateManifestIsTimed(self):
+        seconds = metrics.VALIDATION_SECONDS
+        valid, invalid = seconds.Count('valid'), seconds.Count('invalid')
+        run_containers.ValidateManifest('version: v1beta1\ncontainers: []\n')
+        run_containers.ValidateManifest('{')
+        self.assertEqual([valid + 1, invalid + 1],
+                         [seconds.Count('valid'), seconds.Count('invalid')])
+
+    def testLoadManifestInvalid(self):
+        with self.assertRaises(SystemExit):
+            run_containers.LoadManifest('version: v1beta1\n'
+                                        'containers: [{name: A}]\n')
+
+    def testParseManifest(self):
+        expected = {'version': 'v1beta1', 'containers': [{'name': 'a'}]}
+        self.assertEqual(expected, run_containers.ParseManifest(
+            '{"version": "v1beta1", "containers": [{"name": "a"}]}'))
+        self.assertEqual(expected, run_containers.ParseManifest(
+            'version: v1beta1\ncontainers:\n  - name: a\n'))
+        # A YAML flow mapping is not JSON.
+        self.assertEqual(expected, run_containers.ParseManifest(
+            '{version: v1beta1, containers: [{name: a}]}'))
+        with self.assertRaises(yaml.YAMLError):
+            run_containers.ParseManifest('{')
+
+    def testExampleManifestsMatch(self):
+        manifests = os.path.join(os.path.dirname(__file__), '..', 'manifests')
+        loaded = []
+        for name in ('example.json', 'example.yaml'):
+            with open(os.path.join(manifests, name)) as f:
+                loaded.append([ctr.ToDict() for ctr in
+                               run_containers.LoadManifest(f.read())])
+        self.assertEqual(loaded[0], loaded[1])
+
+    def testJsonManifestStrings(self):
+        # JSON strings are unicode on Python 2; paths and names must still
+        # pass validation.
+        x = run_containers.LoadManifest(json.dumps({
+            'version': 'v1beta1',
+            'containers': [
+                {'name': 'abc123', 'image': 'foo/bar',
+                 'workingDir': '/srv',
+                 'dependsOn': ['abc124'],
+                 'volumeMounts': [{'name': 'vol1', 'path': '/mnt'}]},
+                {'name': 'abc124', 'image': 'foo/bar'}],
+            'volumes': [{'name': 'vol1'}],
+        }))
+        self.assertEqual(['.net', 'abc123', 'abc124'],
+                         [ctr.name for ctr in x])
+        self.assertEqual(['abc124'], x[1].depends_on)
+        self.assertEqual(['/export/vol1:/mnt:rw'], x[1].mounts)
+
+    def testContainerToDictRoundTrip(self):
+        ctr = run_containers.Container('abc123', 'foo/bar')
+        ctr.ports = [(80, 8080, '/udp')]
+        ctr.env_vars = ['A=b']
+        ctr.depends_on = ['abc124']
+        ctr.restart_policy = restart_policy.RestartPolicy('on-failure', 3)
+        ctr.log_config = log_collector.LogConfig(1024, 2)
+        again = run_containers.Container.FromDict(
+            json.loads(json.dumps(ctr.ToDict())))
+        self.assertEqual(ctr.ToDict(), again.ToDict())
+        self.assertEqual([(80, 8080, '/udp')], again.ports)
+        self.assertEqual(ctr.restart_policy, again.restart_policy)
+        self.assertEqual(ctr.log_config, again.log_config)
+
+    def testLoadManifestUsesPlanCache(self):
+        tmpdir = tempfile.mkdtemp()
+        plans = plan_cache.PlanCache(tmpdir)
+        text = 'version: v1beta1\ncontainers: [{name: a, image: foo}]\n'
+        real_validate = run_containers.ValidateManifest
+        try:
+            first = run_containers.LoadManifest(text, plans)
+
+            def Unreachable(text):
+                raise AssertionError('validated a cached manifest')
+
+            run_containers.ValidateManifest = Unreachable
+            second = run_containers.LoadManifest(text, plans)
+        finally:
+            run_containers.ValidateManifest = real_validate
+            shutil.rmtree(tmpdir)
+        self.assertEqual([ctr.ToDict() for ctr in first],
+                         [ctr.ToDict() for ctr in second])
+
+    def testLoadManifestDoesNotCacheInvalid(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            plans = plan_cache.PlanCache(tmpdir)
+            with self.assertRaises(SystemExit):
+                run_containers.LoadManifest('version: v0\n', plans)
+            self.assertEqual([], os.listdir(tmpdir))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testGroups(self):
+        yaml_code = """
+      version: v1beta1
+      groups:
+        - name: web
+          containers:
+            - name: server
+              image: foo/bar
+              dependsOn: [cache]
+              ports:
+                - containerPort: 80
+              volumeMounts:
+                - name: data
+                  path: /mnt
+            - name: cache
+              image: foo/cache
+          volumes:
+            - name: data
+        - name: batch
+          containers:
+            - name: server
+              image: foo/bar
+              ports:
+                - containerPort: 80
+                  hostPort: 8080
+              volumeMounts:
+                - name: data
+                  path: /mnt
+          volumes:
+            - name: data
+      """
+        x = run_containers.LoadConfig(yaml.load(yaml_code))
+        self.assertEqual(['.net.web', 'web.server', 'web.cache',
+                          '.net.batch', 'batch.server'],
+                         [ctr.name for ctr in x])
+        self.assertEqual(['web', 'web', 'web', 'batch', 'batch'],
+                         [ctr.group for ctr in x])
+        self.assertEqual('server', x[1].hostname)
+        self.assertEqual('container:.net.web', x[1].network_from)
+        self.assertEqual('container:.net.batch', x[4].network_from)
+        self.assertEqual(['web.cache'], x[1].depends_on)
+        self.assertEqual(['/export/web/data:/mnt:rw'], x[1].mounts)
+        self.assertEqual(['/export/batch/data:/mnt:rw'], x[4].mounts)
+        self.assertEqual([(80, 80, '')], x[0].ports)
+        self.assertEqual([(8080, 80, '')], x[3].ports)
+
+    def testHostNetwork(self):
+        yaml_code = """
+      version: v1beta1
+      hostNetwork: true
+      containers:
+        - name: server
+          image: foo/bar
+          ports:
+            - containerPort: 80
+        - name: sidecar
+          image: foo/bar
+      """
+        x = run_containers.LoadConfig(yaml.load(yaml_code))
+        self.assertEqual(['server', 'sidecar'], [ctr.name for ctr in x])
+        self.assertEqual(['host', 'host'], [ctr.network_from for ctr in x])
+        self.assertEqual([None, None], [ctr.hostname for ctr in x])
+        self.assertEqual([(80, 80, '')], x[0].ports)
+        self.assertEqual([], run_containers.StartupDependencies(x[0]))
+
+    def testHostNetworkInvalid(self):
+        for yaml_code in ("""
+      version: v1beta1
+      hostNetwork: yes please
+      containers:
+        - name: server
+          image: foo/bar
+      """, """
+      version: v1beta1
+      hostNetwork: true
+      containers:
+        - name: server
+          image: foo/bar
+          ports:
+            - containerPort: 80
+              hostPort: 8080
+      """, """
+      version: v1beta1
+      hostNetwork: true
+      containers:
+        - name: server
+          image: foo/bar
+          ports:
+            - containerPort: 80
+        - name: other
+          image: foo/bar
+          ports:
+            - containerPort: 80
+      """, """
+      version: v1beta1
+      hostNetwork: true
+      groups:
+        - name: web
+          containers:
+            - name: server
+              image: foo/bar
+      """):
+            with self.assertRaises(SystemExit):
+                run_containers.LoadConfig(yaml.load(yaml_code))
+
+    def testGroupsHostNetwork(self):
+        yaml_code = """
+      version: v1beta1
+      groups:
+        - name: web
+          hostNetwork: true
+          containers:
+            - name: server
+              image: foo/bar
+              ports:
+                - containerPort: 80
+        - name: batch
+          containers:
+            - name: server
+              image: foo/bar
+              ports:
+                - containerPort: 80
+                  hostPort: 8080
+      """
+        x = run_containers.LoadConfig(yaml.load(yaml_code))
+        self.assertEqual(['web.server', '.net.batch', 'batch.server'],
+                         [ctr.name for ctr in x])
+        self.assertEqual('host', x[0].network_from)
+        self.assertEqual([(80, 80, '')], x[0].ports)
+        self.assertEqual('container:.net.batch', x[2].network_from)
+
+        # The ports of a host network group are still the VM's.
+        with self.assertRaises(SystemExit):
+            run_containers.LoadConfig(yaml.load(
+                yaml_code.replace('hostPort: 8080', 'hostPort: 80')))
+
+    def testGroupsHostPortConflict(self):
+        yaml_code = """
+      version: v1beta1
+      groups:
+        - name: one
+          containers:
+            - name: server
+              image: foo/bar
+              ports:
+                - containerPort: 80
+        - name: two
+          containers:
+            - name: server
+              image: foo/bar
+              ports:
+                - containerPort: 80
+      """
+        result = run_containers.ValidateConfig(yaml.load(yaml_code))
+        self.assertEqual(['host port 80 is not unique VM-wide: it is used '
+                          'by groups one and two'], result.errors)
+
+    def testGroupsInvalid(self):
+        yaml_code = """
+      version: v1beta1
+      containers: []
+      groups:
+        - name: Bad
+        - containers: []
+        - name: one
+        - name: one
+      """
+        result = run_containers.ValidateConfig(yaml.load(yaml_code))
+        self.assertEqual([
+            'config has groups, so it cannot have containers or volumes '
+            'outside them',
+            'groups[0].name is invalid: Bad',
+            'groups[1] has no name',
+            'groups[3].name is not unique: one',
+        ], result.errors)
+
     def testFlagList(self):
         self.assertEqual([], run_containers.FlagList([], '-x'))
         self.assertEqual(['-x', 'a'], run_containers.FlagList(['a'], '-x'))
@@ -535,6 +1228,65 @@ class RunContainersTest(unittest.TestCase):
         with self.assertRaises(SystemExit):
             run_containers.CheckGroupWideConflicts(containers)
 
+    def testParallelMapPreservesOrder(self):
+        self.assertEqual([], run_containers.ParallelMap(abs, [], 4))
+        self.assertEqual([1, 4, 9, 16],
+                         run_containers.ParallelMap(lambda x: x * x,
+                                                    [1, 2, 3, 4], 2))
+
+    def testParallelMapBoundsConcurrency(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def Work(x):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.01)
+            with lock:
+                state['running'] -= 1
+            return x
+
+        run_containers.ParallelMap(Work, list(range(12)), 3)
+        self.assertTrue(1 < state['peak'] <= 3)
+
+    def testParallelMapReraises(self):
+        def Work(x):
+            if x == 2:
+                raise SystemExit(1)
+            return x
+
+        with self.assertRaises(SystemExit):
+            run_containers.ParallelMap(Work, [1, 2, 3], 2)
+
+    def testIsLocalRegistryImage(self):
+        self.assertTrue(
+            run_containers.IsLocalRegistryImage('localhost:5000/my/app'))
+        self.assertTrue(
+            run_containers.IsLocalRegistryImage('127.0.0.1:5000/my/app'))
+        self.assertFalse(run_containers.IsLocalRegistryImage('busybox'))
+        self.assertFalse(
+            run_containers.IsLocalRegistryImage('localhostess/app'))
+        self.assertFalse(
+            run_containers.IsLocalRegistryImage('gcr.io/localhost/app'))
+
+    def testPullImagesPullsEachImageOnce(self):
+        pulls = []
+
+        def FakePullImage(backend, image):
+            pulls.append(image)
+            return 1.5
+
+        real_pull_image = run_containers.PullImage
+        run_containers.PullImage = FakePullImage
+        try:
+            timings = run_containers.PullImages(
+                None, ['busybox', 'foo/bar', 'busybox'], 2)
+        finally:
+            run_containers.PullImage = real_pull_image
+        self.assertEqual(['busybox', 'foo/bar'], sorted(pulls))
+        self.assertEqual({'busybox': 1.5, 'foo/bar': 1.5}, timings)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+
+"""Tests for scheduler."""
+
+import threading
+import time
+import unittest
+from container_agent import scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def testFindCycle(self):
+        self.assertIsNone(scheduler.FindCycle({}))
+        self.assertIsNone(scheduler.FindCycle(
+            {'a': ['b', 'c'], 'b': ['c'], 'c': [], 'd': ['a']}))
+        self.assertEqual(['a', 'a'], scheduler.FindCycle({'a': ['a']}))
+        self.assertEqual(['b', 'c', 'd', 'b'], scheduler.FindCycle(
+            {'a': ['b'], 'b': ['c'], 'c': ['d'], 'd': ['b']}))
+
+    def testFindCycleIgnoresUnknownItems(self):
+        self.assertIsNone(scheduler.FindCycle({'a': ['x'], 'b': ['a']}))
+
+    def testRunGraphRespectsDependencies(self):
+        finished = []
+        lock = threading.Lock()
+
+        def Work(item):
+            time.sleep(0.01)
+            with lock:
+                finished.append(item)
+            return item.upper()
+
+        deps = {'b': ['a'], 'c': ['a'], 'd': ['b', 'c']}
+        results = scheduler.RunGraph(Work, ['d', 'c', 'b', 'a'], deps, 4)
+        self.assertEqual(['D', 'C', 'B', 'A'], results)
+        self.assertEqual('a', finished[0])
+        self.assertEqual('d', finished[-1])
+
+    def testRunGraphRunsIndependentItemsConcurrently(self):
+        def Work(item):
+            time.sleep(0.1)
+
+        # A critical path of two steps, with nine items in all.
+        items = ['net'] + ['ctr%d' % i for i in range(8)]
+        deps = dict((item, ['net']) for item in items[1:])
+        start = time.time()
+        scheduler.RunGraph(Work, items, deps, 8)
+        self.assertTrue(time.time() - start < 0.5)
+
+    def testRunGraphBoundsConcurrency(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def Work(item):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.01)
+            with lock:
+                state['running'] -= 1
+
+        scheduler.RunGraph(Work, list(range(12)), {}, 3)
+        self.assertTrue(1 < state['peak'] <= 3)
+
+    def testRunGraphSkipsDependentsOfFailures(self):
+        ran = []
+
+        def Work(item):
+            ran.append(item)
+            if item == 'b':
+                raise SystemExit(1)
+
+        deps = {'b': ['a'], 'c': ['b'], 'd': ['c', 'a'], 'e': ['a']}
+        with self.assertRaises(SystemExit):
+            scheduler.RunGraph(Work, ['a', 'b', 'c', 'd', 'e'], deps, 2)
+        self.assertEqual(['a', 'b', 'e'], sorted(ran))
+
+    def testRunGraphRejectsCycles(self):
+        with self.assertRaises(ValueError):
+            scheduler.RunGraph(abs, [1, 2], {1: [2], 2: [1]}, 2)
+
+    def testRunGraphEmpty(self):
+        self.assertEqual([], scheduler.RunGraph(abs, [], {}, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,351 @@
+#!/usr/bin/python
+
+"""Tests for supervisor."""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from container_agent import agent_state
+from container_agent import docker_backend
+from container_agent import metrics
+from container_agent import restart_policy
+from container_agent import supervisor
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class FakeBackend(object):
+
+    """Just enough of a docker backend to supervise containers."""
+
+    def __init__(self):
+        self.running = {}      # container ID -> bool
+        self.exit_codes = {}   # container ID -> int
+        self.restarts = []     # [container ID]
+        self.restart_errors = 0
+        self.events = queue.Queue()
+        self.events_errors = []  # exceptions for Events() to raise first
+        self.inspect_errors = 0
+
+    def Inspect(self, ctr_id):
+        if self.inspect_errors:
+            self.inspect_errors -= 1
+            raise docker_backend.DockerError('docker is down')
+        if ctr_id not in self.running:
+            return None
+        return {'Id': ctr_id,
+                'State': {'Running': self.running[ctr_id],
+                          'ExitCode': self.exit_codes.get(ctr_id, 1)}}
+
+    def Restart(self, ctr_id):
+        if self.restart_errors:
+            self.restart_errors -= 1
+            raise docker_backend.DockerError('restart failed')
+        self.restarts.append(ctr_id)
+        self.running[ctr_id] = True
+
+    def Die(self, ctr_id):
+        self.running[ctr_id] = False
+        self.events.put({'status': 'die', 'id': ctr_id})
+
+    def Events(self):
+        if self.events_errors:
+            raise self.events_errors.pop(0)
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            yield event
+
+
+class SupervisorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = FakeBackend()
+        self.backoff = restart_policy.Backoff(initial=0, jitter=0)
+        self.keeper = supervisor.Supervisor(self.backend, self.backoff)
+        for ctr_id in ('aaa111', 'bbb222'):
+            self.backend.running[ctr_id] = True
+        self.keeper.Watch('one', 'aaa111')
+        self.keeper.Watch('two', 'bbb222')
+
+    def testDieSchedulesRestart(self):
+        self.backend.running['aaa111'] = False
+        self.keeper.HandleEvent({'status': 'die', 'id': 'aaa111'})
+        self.keeper.RestartDue(time.time())
+        self.assertEqual(['aaa111'], self.backend.restarts)
+
+    def testRestartWaitsForDelay(self):
+        self.backoff.initial = 60
+        self.backend.running['aaa111'] = False
+        self.keeper.HandleEvent({'status': 'die', 'id': 'aaa111'})
+        self.keeper.RestartDue(time.time())
+        self.assertEqual([], self.backend.restarts)
+        self.keeper.RestartDue(time.time() + 61)
+        self.assertEqual(['aaa111'], self.backend.restarts)
+
+    def testRestartIsCounted(self):
+        before = metrics.RESTARTS.Value('one')
+        self.backend.running['aaa111'] = False
+        self.keeper.HandleEvent({'status': 'die', 'id': 'aaa111'})
+        self.keeper.RestartDue(time.time())
+        self.assertEqual(before + 1, metrics.RESTARTS.Value('one'))
+
+    def testUnwatchDropsRestartCount(self):
+        self.backend.running['aaa111'] = False
+        self.keeper.HandleEvent({'status': 'die', 'id': 'aaa111'})
+        self.keeper.RestartDue(time.time())
+        self.assertIn(('one',), metrics.RESTARTS.Labels())
+        self.keeper.Unwatch('aaa111')
+        self.assertNotIn(('one',), metrics.RESTARTS.Labels())
+
+    def testAbbreviatedIdsMatch(self):
+        self.backend.running['aaa111'] = False
+        self.keeper.HandleEvent({'status': 'die', 'id': 'aaa'})
+        self.keeper.RestartDue(time.time())
+        self.assertEqual(['aaa111'], self.backend.restarts)
+
+    def testUnwatchedContainersAreIgnored(self):
+        self.backend.running['ccc333'] = False
+        self.keeper.HandleEvent({'status': 'die', 'id': 'ccc333'})
+        self.keeper.RestartDue(time.time())
+        self.assertEqual([], self.backend.restarts)
+
+    def testAlreadyRunningIsNotRestarted(self):
+        self.keeper.HandleEvent({'status': 'die', 'id': 'aaa111'})
+        self.keeper.RestartDue(time.time())
+        self.assertEqual([], self.backend.restarts)
+
+    def testDestroyStopsWatching(self):
+        self.keeper.HandleEvent({'status': 'destroy', 'id': 'aaa111'})
+        self.assertEqual({'two': 'bbb222'}, self.keeper.Watched())
+
+    def testVanishedContainerStopsWatching(self):
+        self.keeper.HandleEvent({'status': 'die', 'id': 'aaa111'})
+        del self.backend.running['aaa111']
+        self.keeper.RestartDue(time.time())
+        self.assertEqual({'two': 'bbb222'}, self.keeper.Watched())
+
+    def testFailedRestartIsRetried(self):
+        self.backend.restart_errors = 1
+        self.backend.running['aaa111'] = False
+        self.keeper.HandleEvent({'status': 'die', 'id': 'aaa111'})
+        self.keeper.RestartDue(time.time())
+        self.assertEqual([], self.backend.restarts)
+        self.keeper.RestartDue(time.time())
+        self.assertEqual(['aaa111'], self.backend.restarts)
+
+    def testFailedRestartsCountAsAttempts(self):
+        self.keeper.Watch('three', 'ccc333',
+                          restart_policy.RestartPolicy('always', 2))
+        self.backend.restart_errors = 2
+        self.backend.running['ccc333'] = False
+        self.keeper.HandleEvent({'status': 'die', 'id': 'ccc333'})
+        self.keeper.RestartDue(time.time())
+        self.assertEqual(2, self.keeper.Status()['three']['attempts'])
+        self.keeper.RestartDue(time.time())
+        self.assertEqual([], self.backend.restarts)
+        self.assertEqual('failed', self.keeper.Status()['three']['state'])
+        self.keeper.RestartDue(time.time())
+        self.assertEqual([], self.backend.restarts)
+
+    def testResyncRestartsDeadContainers(self):
+        self.backend.running['bbb222'] = False
+        self.keeper.Resync()
+        self.keeper.RestartDue(time.time())
+        self.assertEqual(['bbb222'], self.backend.restarts)
+
+    def testNeverPolicy(self):
+        self.keeper.Watch('three', 'ccc333',
+                          restart_policy.RestartPolicy('never'))
+        self.backend.running['ccc333'] = False
+        self.keeper.HandleEvent({'status': 'die', 'id': 'ccc333'})
+        self.keeper.RestartDue(time.time())
+        self.assertEqual([], self.backend.restarts)
+        self.assertEqual('stopped', self.keeper.Status()['three']['state'])
+
+    def testChangePolicyRechecksStoppedContainer(self):
+        self.keeper.Watch('three', 'ccc333',
+                          restart_policy.RestartPolicy('never'))
+        self.backend.running['ccc333'] = False
+        self.keeper.HandleEvent({'status': 'die', 'id': 'ccc333'})
+        self.assertEqual('stopped', self.keeper.Status()['three']['state'])
+        self.keeper.ChangePolicy('ccc333', restart_policy.RestartPolicy())
+        self.keeper.Recheck('ccc333')
+        self.keeper.RestartDue(time.time())
+        self.assertEqual(['ccc333'], self.backend.restarts)
+        self.assertEqual(1, self.keeper.Status()['three']['restarts'])
+
+    def testOnFailurePolicy(self):
+        self.keeper.Watch('three', 'ccc333',
+                          restart_policy.RestartPolicy('on-failure'))
+        self.backend.running['ccc333'] = False
+        self.backend.exit_codes['ccc333'] = 0
+        self.keeper.HandleEvent({'status': 'die', 'id': 'ccc333'})
+        self.keeper.RestartDue(time.time())
+        self.assertEqual([], self.backend.restarts)
+
+        self.backend.exit_codes['ccc333'] = 2
+        self.keeper.Resync()
+        self.keeper.RestartDue(time.time())
+        self.assertEqual([], self.backend.restarts)
+
+        self.keeper.Watch('three', 'ccc333',
+                          restart_policy.RestartPolicy('on-failure'))
+        self.keeper.HandleEvent({'status': 'die', 'id': 'ccc333'})
+        self.keeper.RestartDue(time.time())
+        self.assertEqual(['ccc333'], self.backend.restarts)
+
+    def testMaxAttempts(self):
+        self.keeper.Watch('three', 'ccc333',
+                          restart_policy.RestartPolicy('always', 2))
+        for _ in range(3):
+            self.backend.running['ccc333'] = False
+            self.keeper.HandleEvent({'status': 'die', 'id': 'ccc333'})
+            self.keeper.RestartDue(time.time())
+        self.assertEqual(['ccc333', 'ccc333'], self.backend.restarts)
+        self.assertEqual('failed', self.keeper.Status()['three']['state'])
+
+    def testCrashLoopIsReported(self):
+        for _ in range(restart_policy.CRASHLOOP_THRESHOLD):
+            self.backend.running['aaa111'] = False
+            self.keeper.HandleEvent({'status': 'die', 'id': 'aaa111'})
+            self.keeper.RestartDue(time.time())
+        status = self.keeper.Status()
+        self.assertEqual('crashloop', status['one']['state'])
+        self.assertEqual(restart_policy.CRASHLOOP_THRESHOLD,
+                         status['one']['restarts'])
+        self.assertEqual('aaa111', status['one']['id'])
+        self.assertEqual('running', status['two']['state'])
+
+    def testWriteStatus(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self.keeper.status_path = os.path.join(tmpdir, 'status.json')
+            self.keeper.WriteStatus()
+            with open(self.keeper.status_path) as f:
+                status = json.load(f)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(['one', 'two'], sorted(status))
+        self.assertEqual('running', status['one']['state'])
+
+    def testWriteStatusFailureIsLogged(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.keeper.status_path = os.path.join(tmpdir, 'missing', 's.json')
+        self.keeper.WriteStatus()
+        # A directory in the way: the rename fails, after the write.
+        self.keeper.status_path = os.path.join(tmpdir, 'status.json')
+        os.makedirs(os.path.join(self.keeper.status_path, 'x'))
+        self.keeper.WriteStatus()
+        self.assertEqual(['status.json'], os.listdir(tmpdir))
+
+    def testWriteState(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self.keeper.state_file = agent_state.StateFile(
+                os.path.join(tmpdir, 'state.json'))
+            self.keeper.Watch('three', 'ccc333', fingerprint='f00')
+            self.keeper.WriteState()
+            records = self.keeper.state_file.Load()
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(['one', 'three', 'two'], sorted(records))
+        self.assertEqual('ccc333', records['three']['id'])
+        self.assertEqual('f00', records['three']['fingerprint'])
+        self.assertEqual(0, records['three']['restart']['restarts'])
+
+    def testWatchRestartState(self):
+        state = restart_policy.RestartState(
+            restart_policy.RestartPolicy(), time.time())
+        state.restarts = 7
+        self.keeper.Watch('three', 'ccc333', restart_state=state)
+        self.assertEqual(7, self.keeper.Status()['three']['restarts'])
+
+    def testRun(self):
+        thread = threading.Thread(target=self.keeper.Run)
+        thread.start()
+        try:
+            self.backend.Die('aaa111')
+            self.backend.Die('bbb222')
+            deadline = time.time() + 5
+            while len(self.backend.restarts) < 2 and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            self.keeper.Stop()
+            self.backend.events.put(None)
+            thread.join()
+        self.assertEqual(['aaa111', 'bbb222'], sorted(self.backend.restarts))
+
+    def testRunSurvivesEventsReaderErrors(self):
+        self.addCleanup(setattr, supervisor, 'RECONNECT_DELAY',
+                        supervisor.RECONNECT_DELAY)
+        supervisor.RECONNECT_DELAY = 0.01
+        self.backend.events_errors = [AttributeError('readline'),
+                                      docker_backend.DockerError('gone')]
+        thread = threading.Thread(target=self.keeper.Run)
+        thread.start()
+        try:
+            # Once reconnected, deaths are seen again.
+            deadline = time.time() + 5
+            while (self.backend.events_errors or
+                   self.backend.events.qsize()) and time.time() < deadline:
+                time.sleep(0.01)
+            time.sleep(0.05)
+            self.backend.Die('aaa111')
+            while not self.backend.restarts and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            self.keeper.Stop()
+            self.backend.events.put(None)
+            thread.join()
+        self.assertEqual(['aaa111'], self.backend.restarts)
+
+    def testRunSurvivesDockerErrors(self):
+        self.addCleanup(setattr, supervisor, 'RECONNECT_DELAY',
+                        supervisor.RECONNECT_DELAY)
+        supervisor.RECONNECT_DELAY = 0.01
+        # The first resync fails, as if docker were restarting.
+        self.backend.running['aaa111'] = False
+        self.backend.inspect_errors = 1
+        thread = threading.Thread(target=self.keeper.Run)
+        thread.start()
+        try:
+            deadline = time.time() + 5
+            while not self.backend.restarts and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            self.keeper.Stop()
+            self.backend.events.put(None)
+            thread.join()
+        self.assertEqual(['aaa111'], self.backend.restarts)
+        self.assertEqual({'one': 'aaa111', 'two': 'bbb222'},
+                         self.keeper.Watched())
+
+    def testRunUsesOneReaderThread(self):
+        for i in range(100):
+            self.keeper.Watch('ctr%d' % i, 'id%d' % i)
+            self.backend.running['id%d' % i] = True
+        before = threading.active_count()
+        thread = threading.Thread(target=self.keeper.Run)
+        thread.start()
+        try:
+            time.sleep(0.05)
+            # The Run() thread itself, plus the events reader.
+            self.assertEqual(before + 2, threading.active_count())
+        finally:
+            self.keeper.Stop()
+            self.backend.events.put(None)
+            thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
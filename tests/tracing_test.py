@@ -0,0 +1,86 @@
+#!/usr/bin/python
+
+"""Tests for tracing."""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from container_agent import tracing
+
+
+class TracingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'trace.jsonl')
+        self.tracer = tracing.Tracer()
+        self.tracer.Open(self.path)
+
+    def tearDown(self):
+        self.tracer.Close()
+        shutil.rmtree(self.tmpdir)
+
+    def _Spans(self):
+        with open(self.path) as f:
+            return dict((span['name'], span)
+                        for span in (json.loads(line) for line in f))
+
+    def testNesting(self):
+        with self.tracer.Span('apply'):
+            with self.tracer.Span('pull', image='foo/bar') as span:
+                span.Set('attempt', 2)
+        spans = self._Spans()
+        self.assertIsNone(spans['apply']['parent_id'])
+        self.assertEqual(spans['apply']['span_id'],
+                         spans['pull']['parent_id'])
+        self.assertEqual(spans['apply']['trace_id'],
+                         spans['pull']['trace_id'])
+        self.assertEqual({'image': 'foo/bar', 'attempt': 2},
+                         spans['pull']['attributes'])
+        self.assertEqual('ok', spans['pull']['status'])
+        self.assertGreaterEqual(spans['apply']['duration'],
+                                spans['pull']['duration'])
+
+    def testOtherThreadsJoinTheRoot(self):
+        def Pull():
+            with self.tracer.Span('pull'):
+                pass
+        with self.tracer.Span('apply'):
+            with self.tracer.Span('pulls'):
+                thread = threading.Thread(target=Pull)
+                thread.start()
+                thread.join()
+        spans = self._Spans()
+        self.assertEqual(spans['apply']['span_id'],
+                         spans['pull']['parent_id'])
+
+    def testSeparateTraces(self):
+        with self.tracer.Span('one'):
+            pass
+        with self.tracer.Span('two'):
+            pass
+        spans = self._Spans()
+        self.assertIsNone(spans['two']['parent_id'])
+        self.assertNotEqual(spans['one']['trace_id'],
+                            spans['two']['trace_id'])
+
+    def testError(self):
+        with self.assertRaises(SystemExit):
+            with self.tracer.Span('apply'):
+                raise SystemExit(1)
+        span = self._Spans()['apply']
+        self.assertEqual('error', span['status'])
+        self.assertEqual('SystemExit: 1', span['attributes']['error'])
+
+    def testOffWhenClosed(self):
+        self.tracer.Close()
+        with self.tracer.Span('apply') as span:
+            span.Set('ignored', True)
+        self.assertEqual({}, self._Spans())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/python
+
+"""Tests for volumes."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from container_agent import metrics
+from container_agent import run_containers
+from container_agent import volumes
+
+
+def NewContainer(name, mounts=(), tmpfs=(), group=None):
+    ctr = run_containers.Container(name, 'foo/bar')
+    ctr.mounts = list(mounts)
+    ctr.tmpfs = [list(t) for t in tmpfs]
+    ctr.group = group
+    return ctr
+
+
+class TmpfsMounterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, 'export')
+        self.proc_mounts = os.path.join(self.tmpdir, 'mounts')
+        self.WriteMounts([])
+        self.commands = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def WriteMounts(self, lines):
+        with open(self.proc_mounts, 'w') as f:
+            f.write('proc /proc proc rw,relatime 0 0\n')
+            for line in lines:
+                f.write(line + '\n')
+
+    def Mounter(self, memory=1 << 30):
+        return volumes.TmpfsMounter(self.root, self.commands.append,
+                                    self.proc_mounts, lambda: memory)
+
+    def testReadTmpfsMounts(self):
+        self.WriteMounts([
+            'tmpfs /dev/shm tmpfs rw,nosuid,nodev 0 0',
+            'tmpfs /export/a\\040b tmpfs rw,relatime,size=1024k 0 0',
+            '/dev/sda1 /export/c ext4 rw 0 0'])
+        self.assertEqual({'/dev/shm': None, '/export/a b': 1048576},
+                         volumes.ReadTmpfsMounts(self.proc_mounts))
+
+    def testMountsEachVolumeOnce(self):
+        scratch = os.path.join(self.root, 'web', 'scratch')
+        self.Mounter().SetUp([
+            NewContainer('web.a', ['%s:/tmp:rw' % (scratch)],
+                         [(scratch, 1048576)], 'web'),
+            NewContainer('web.b', ['%s:/scratch:rw' % (scratch)],
+                         [(scratch, 1048576)], 'web')])
+        self.assertTrue(os.path.isdir(scratch))
+        self.assertEqual(
+            [['mount', '-t', 'tmpfs', '-o', 'size=1048576', 'tmpfs',
+              scratch]], self.commands)
+        self.assertEqual(1048576, metrics.TMPFS_BYTES.Value('web'))
+
+    def testReportsPerGroup(self):
+        a = os.path.join(self.root, 'a', 'v')
+        b = os.path.join(self.root, 'b', 'v')
+        self.Mounter().SetUp([
+            NewContainer('a.x', ['%s:/v:rw' % (a)], [(a, 8192)], 'a'),
+            NewContainer('b.x', ['%s:/v:rw' % (b)], [(b, 4096)], 'b')])
+        self.assertEqual(8192, metrics.TMPFS_BYTES.Value('a'))
+        self.assertEqual(4096, metrics.TMPFS_BYTES.Value('b'))
+        # Group b is gone.
+        self.Mounter().SetUp([
+            NewContainer('a.x', ['%s:/v:rw' % (a)], [(a, 8192)], 'a')])
+        self.assertEqual(8192, metrics.TMPFS_BYTES.Value('a'))
+        self.assertIsNone(metrics.TMPFS_BYTES.Value('b'))
+
+    def testLeavesMountedVolumeAlone(self):
+        scratch = os.path.join(self.root, 'scratch')
+        self.WriteMounts(['tmpfs %s tmpfs rw,size=1024k 0 0' % (scratch)])
+        self.Mounter().SetUp([NewContainer(
+            'a', ['%s:/tmp:rw' % (scratch)], [(scratch, 1048576)])])
+        self.assertEqual([], self.commands)
+
+    def testResizes(self):
+        scratch = os.path.join(self.root, 'scratch')
+        self.WriteMounts(['tmpfs %s tmpfs rw,size=1024k 0 0' % (scratch)])
+        self.Mounter().SetUp([NewContainer(
+            'a', ['%s:/tmp:rw' % (scratch)], [(scratch, 2097152)])])
+        self.assertEqual([['mount', '-o', 'remount,size=2097152', scratch]],
+                         self.commands)
+
+    def testUnmountsVolumeNoLongerTmpfs(self):
+        data = os.path.join(self.root, 'data')
+        self.WriteMounts(['tmpfs %s tmpfs rw,size=1024k 0 0' % (data),
+                          'tmpfs /run tmpfs rw,size=1024k 0 0'])
+        self.Mounter().SetUp([
+            NewContainer('a', ['%s:/data:rw' % (data), '/run:/run:rw'])])
+        self.assertEqual([['umount', data]], self.commands)
+
+    def testTooMuchMemory(self):
+        scratch = os.path.join(self.root, 'scratch')
+        with self.assertRaises(volumes.VolumeError):
+            self.Mounter(memory=4096).SetUp([NewContainer(
+                'a', ['%s:/tmp:rw' % (scratch)], [(scratch, 8192)])])
+        self.assertEqual([], self.commands)
+
+
+if __name__ == '__main__':
+    unittest.main()